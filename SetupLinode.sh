@@ -5,6 +5,15 @@ sudo apt-get update
 sudo apt-get upgrade -y
 sudo apt-get install nginx gunicorn python3-pip python3-dev git -y
 
+# assets.py and the analysis page generator write .br copies next to .gz ones; nginx needs the
+# ngx_brotli static module to serve them, packaged by Debian and Ubuntu as below
+sudo apt-get install libnginx-mod-http-brotli-static -y || echo "ngx_brotli is not available, only the gzip copies will be served"
+if ls /etc/nginx/modules-enabled/ 2>/dev/null | grep -q brotli-static; then
+    BROTLI_STATIC="brotli_static on;"
+else
+    BROTLI_STATIC=""
+fi
+
 # Setup firewall
 sudo ufw allow 'Nginx Full'
 sudo ufw allow OpenSSH
@@ -15,6 +24,31 @@ echo "server {
     listen 80;
     server_name voteh.ca;
 
+    # Fingerprinted assets from assets.py never change, so they can be cached forever
+    location /static/dist/ {
+        alias /home/deployuser/web/ElectionClock/static/dist/;
+        gzip_static on;
+        $BROTLI_STATIC
+        add_header Cache-Control \"public, max-age=31536000, immutable\";
+    }
+
+    # Analysis pages are generated ahead of time with gzip and brotli copies; Flask only handles misses
+    location ~ ^/[A-Za-z0-9_-]+_analysis\\.html\$ {
+        root /home/deployuser/web/ElectionClock/static_pages;
+        gzip_static on;
+        $BROTLI_STATIC
+        add_header Cache-Control \"public, max-age=300\";
+        try_files \$uri @flask;
+    }
+
+    location @flask {
+        proxy_pass http://unix:/home/deployuser/web/ElectionClock/electionclock.sock;
+        proxy_set_header Host \$host;
+        proxy_set_header X-Real-IP \$remote_addr;
+        proxy_set_header X-Forwarded-For \$proxy_add_x_forwarded_for;
+        proxy_set_header X-Forwarded-Proto \$scheme;
+    }
+
     location / {
         proxy_pass proxy_pass http://unix:/home/deployuser/web/ElectionClock/electionclock.sock;;
         proxy_set_header Host \$host;
@@ -1,14 +1,27 @@
 # app.py
-from flask import Flask, render_template, jsonify, request, send_from_directory
+import time
+_app_import_started = time.perf_counter()
+
+from flask import Flask, jsonify, request, g
 from datetime import datetime
 from auth import require_auth
-from quants.tsionhehkwen import get_analysis_results, add_documents, add_analysis_results
+from elections import schedule
+import assets
+from pages import PageRegistry
+from quants.tsionhehkwen import get_analysis_results, add_documents, add_analysis_results, startup_report
+from quants.search import search_chunks, SEARCH_MODES
+from quants.query_cache import TTLCache
+import metrics
 import pytz
 import os
+import gzip
+import hashlib
 import logging
 import sys
 
 app = Flask(__name__)
+assets.init_app(app)  # Fingerprinted static files and responsive image helpers
+page_registry = PageRegistry(app)  # Pre-rendered pages, built on first request
 DEBUG_MODE = os.getenv('DEBUG_MODE', 'False').lower() in ('true', '1', 't', 'y')
 log_level = "DEBUG" if DEBUG_MODE else "INFO"
 
@@ -33,17 +46,87 @@ except PermissionError as e:
 logging.getLogger().addHandler(logging.StreamHandler(sys.stdout))
 logging.info("***BEGIN app.py****")
 
-elections = {
-    'federal': '2025-10-19',
-}
+# Compressed response bodies keyed by ETag so repeat hits skip serialization and gzip
+compressed_bodies = TTLCache(max_entries=128, ttl_seconds=3600, name='compressed_bodies')
+
+# Time every request; routes are labelled by their rule, so /<page_name>.html is one series however many pages exist
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def observe_request(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        metrics.HTTP_REQUEST_SECONDS.labels(route=route, method=request.method, status=response.status_code).observe(
+            time.perf_counter() - started)
+    return response
+
+# Function to build a JSON response with an ETag, caching headers and gzip when the client accepts it
+def cached_json_response(payload, max_age=60, private=True):
+    body = app.json.dumps(payload).encode('utf-8')
+    etag = hashlib.sha1(body).hexdigest()
+    response = app.response_class(mimetype='application/json')
+
+    if 'gzip' in request.accept_encodings and len(body) > 512:
+        compressed = compressed_bodies.get(etag)
+        if compressed is None:
+            compressed = gzip.compress(body, compresslevel=6)
+            compressed_bodies.put(etag, compressed)
+        response.set_data(compressed)
+        response.content_encoding = 'gzip'
+        etag += '-gzip'  # Each encoding is its own representation
+    else:
+        response.set_data(body)
+
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    response.cache_control.max_age = max_age
+    if private:
+        response.cache_control.private = True
+    else:
+        response.cache_control.public = True
+    return response.make_conditional(request)  # A 304 when If-None-Match matches
+
+# Function to send a pre-rendered page in the best encoding the client accepts, or a 304
+def page_response(page):
+    encoding, body, etag = page.variant(request.accept_encodings)
+    response = app.response_class(body, mimetype='text/html')
+    if encoding != 'identity':
+        response.content_encoding = encoding
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.max_age = 300
+    return response.make_conditional(request)
 
 @app.route('/')
 def countdown():
-    now = datetime.now(pytz.timezone('America/Toronto'))
-    next_election_date = datetime.strptime(elections['federal'], '%Y-%m-%d')
-    next_election_date = pytz.timezone('America/Toronto').localize(next_election_date)
-    time_left = next_election_date - now
-    return render_template('countdown.html', time_left=time_left, election_date=next_election_date)
+    # The page is static; the target date comes from /api/countdown so it can be cached anywhere
+    page = page_registry.get('countdown')
+    if page is None:
+        logging.error("The countdown page is not in the page registry")
+        return "The countdown page is unavailable", 503
+    return page_response(page)
+
+@app.route('/api/countdown')
+def api_countdown():
+    jurisdiction = request.args.get("jurisdiction")
+    if jurisdiction and jurisdiction.lower() not in schedule.by_jurisdiction:
+        return jsonify({"error": f"Unknown jurisdiction: {jurisdiction}"}), 404
+    now = datetime.now(pytz.utc)
+    now_ms = int(now.timestamp() * 1000)
+    next_election = schedule.next_election(jurisdiction, now_ms)
+    elections = schedule.elections if not jurisdiction else schedule.by_jurisdiction[jurisdiction.lower()]
+    payload = {
+        "server_time": now.isoformat(),
+        "server_time_ms": now_ms,
+        "next": next_election or schedule.latest_election(jurisdiction),
+        "upcoming": next_election is not None,
+        "elections": elections,
+    }
+    return cached_json_response(payload, max_age=10, private=False)
 
 @app.route('/analyze', methods=['POST'])
 @require_auth
@@ -61,15 +144,58 @@ def analyze_document():
 def get_analysis():
     query = request.args.get("query", "C-70_E_Analysis")
     results = get_analysis_results(query, n_results=1)
-    return jsonify(results)
+    return cached_json_response(results)
 
-@app.route('/<page_name>.html')
-def serve_analysis_page(page_name):
-    # Serve dynamically generated analysis HTML pages
+# Most results a /search page can hold
+MAX_PER_PAGE = 50
+
+@app.route('/search', methods=['GET'])
+@require_auth
+def search():
+    # mode=keyword is served from the local full-text index without any call to OpenAI
+    query = request.args.get("q", "").strip()
+    mode = request.args.get("mode", "hybrid")
+    page = request.args.get("page", 1, type=int)
+    per_page = request.args.get("per_page", 10, type=int)
+    if not query:
+        return jsonify({"error": "Missing q"}), 400
+    if mode not in SEARCH_MODES:
+        return jsonify({"error": f"Unknown mode: {mode}, expected one of {', '.join(SEARCH_MODES)}"}), 400
+    if page < 1 or not 1 <= per_page <= MAX_PER_PAGE:
+        return jsonify({"error": f"page must be at least 1 and per_page between 1 and {MAX_PER_PAGE}"}), 400
     try:
-        return render_template(f"{page_name}.html")
+        results = search_chunks(query, mode=mode, page=page, per_page=per_page, doc_id=request.args.get("doc_id"))
     except Exception as e:
-        return jsonify({"error": f"Page not found: {e}"}), 404
+        logging.error(f"Search failed for {query!r} ({mode}): {e}")
+        return jsonify({"error": "Search failed"}), 503
+    # Keyword-only results served because the vector side failed should not outlive the outage
+    return cached_json_response(results, max_age=0 if results["degraded"] else 60)
+
+# Body of the 404 for unknown pages, built once so scans of random URLs cost next to nothing
+PAGE_NOT_FOUND = b'{"error": "Page not found"}'
+
+@app.route('/<page_name>.html')
+def serve_analysis_page(page_name):
+    # Serve pre-rendered analysis HTML pages from memory
+    page = page_registry.get(page_name)
+    if page is None:
+        return PAGE_NOT_FOUND, 404, {'Content-Type': 'application/json'}
+    return page_response(page)
+
+@app.route('/metrics')
+@require_auth
+def metrics_endpoint():
+    # Prometheus text format, added up across every gunicorn worker when PROMETHEUS_MULTIPROC_DIR is set
+    body, content_type = metrics.render()
+    return app.response_class(body, content_type=content_type, headers={'Cache-Control': 'no-store'})
+
+# Report what loading the app cost; the vector store itself is only opened by the routes that use it
+vector_store_timings = startup_report()
+logging.info(
+    f"Startup: app.py imported in {time.perf_counter() - _app_import_started:.3f}s, "
+    f"tsionhehkwen imported in {vector_store_timings.get('import_seconds', 0):.3f}s, "
+    f"vector store initialization deferred to first use"
+)
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=8000)
@@ -0,0 +1,226 @@
+# assets.py
+import os
+import re
+import sys
+import json
+import gzip
+import shutil
+import hashlib
+import logging
+from io import BytesIO
+from flask import request
+from markupsafe import Markup
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional; only gzip copies are written without it
+    brotli = None
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+DIST_DIRNAME = 'dist'
+MANIFEST_NAME = 'manifest.json'
+
+# Widths generated for responsive images, and the formats they are encoded in
+IMAGE_WIDTHS = (640, 1280, 1920)
+IMAGE_FORMATS = {'avif': {'quality': 55}, 'webp': {'quality': 80}}
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg', '.json')
+
+# Matches url(...) references to files under /static/ in stylesheets, with or without a host
+CSS_URL_PATTERN = re.compile(r"""url\((['"]?)(?:https?://[^/'")]+)?/static/([^'")]+)\1\)""")
+
+# Function to build a fingerprinted file name
+def fingerprint(relative_path, content):
+    """
+    :param relative_path: Path of the asset relative to the static directory.
+    :param content: The bytes of the asset.
+    :return: The path with a content hash inserted before the extension, e.g. styles.3f2a9c1b0d4e.css
+    """
+    root, ext = os.path.splitext(relative_path)
+    return f"{root}.{hashlib.sha256(content).hexdigest()[:12]}{ext}"
+
+# Function to write an output file, creating directories as needed
+def _write(dist_dir, relative_path, content):
+    path = os.path.join(dist_dir, relative_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(content)
+    return path
+
+# Function to write gzip and brotli copies next to a file so nginx can serve them as is
+def precompress(path, content):
+    """
+    Writes path.gz and, when brotli is installed, path.br.
+    :param path: Path of the file being compressed.
+    :param content: The bytes of the file.
+    """
+    with open(f"{path}.gz", 'wb') as f:
+        f.write(gzip.compress(content, compresslevel=9, mtime=0))
+    if brotli is not None:
+        with open(f"{path}.br", 'wb') as f:
+            f.write(brotli.compress(content, quality=11))
+
+# Function to generate resized AVIF and WebP variants of an image
+def build_image_variants(source_path, relative_path, dist_dir):
+    """
+    :param source_path: Path of the original image.
+    :param relative_path: Path of the image relative to the static directory.
+    :param dist_dir: Output directory.
+    :return: Dictionary of format to a list of [hashed path, width], smallest first.
+    """
+    from PIL import Image, features
+
+    variants = {}
+    root = os.path.splitext(relative_path)[0]
+    with Image.open(source_path) as image:
+        image.load()
+        widths = sorted({width for width in IMAGE_WIDTHS if width < image.width} | {image.width})
+        for image_format, options in IMAGE_FORMATS.items():
+            if not features.check(image_format):
+                logging.warning(f"Pillow was built without {image_format} support, skipping {image_format} variants")
+                continue
+            for width in widths:
+                height = round(image.height * width / image.width)
+                resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+                buffer = BytesIO()
+                resized.save(buffer, format=image_format.upper(), **options)
+                content = buffer.getvalue()
+                hashed = fingerprint(f"{root}-{width}.{image_format}", content)
+                _write(dist_dir, hashed, content)
+                variants.setdefault(image_format, []).append([f"{DIST_DIRNAME}/{hashed}", width])
+    return variants
+
+# Function to run the asset build
+def build_assets(static_dir=STATIC_DIR):
+    """
+    Fingerprints every static asset into static/dist, generates responsive image variants,
+    rewrites stylesheet references to the fingerprinted names, precompresses text assets
+    and writes a manifest the Flask helper reads at startup.
+    :param static_dir: The Flask static directory.
+    :return: The manifest dictionary.
+    """
+    dist_dir = os.path.join(static_dir, DIST_DIRNAME)
+    if os.path.isdir(dist_dir):
+        shutil.rmtree(dist_dir)
+    os.makedirs(dist_dir)
+
+    sources = []
+    for directory, dirnames, filenames in os.walk(static_dir):
+        dirnames[:] = [d for d in dirnames if os.path.join(directory, d) != dist_dir]
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            sources.append((path, os.path.relpath(path, static_dir).replace(os.sep, '/')))
+
+    manifest = {'files': {}, 'images': {}}
+
+    # Binary assets first so stylesheets can refer to their fingerprinted names
+    for path, relative_path in sorted(sources, key=lambda source: source[1].endswith('.css')):
+        with open(path, 'rb') as f:
+            content = f.read()
+        if relative_path.endswith('.css'):
+            content = CSS_URL_PATTERN.sub(
+                lambda m: f"url('/static/{manifest['files'].get(m.group(2), m.group(2))}')",
+                content.decode('utf-8')
+            ).encode('utf-8')
+        hashed = fingerprint(relative_path, content)
+        output_path = _write(dist_dir, hashed, content)
+        manifest['files'][relative_path] = f"{DIST_DIRNAME}/{hashed}"
+        if relative_path.endswith(COMPRESSIBLE_EXTENSIONS):
+            precompress(output_path, content)
+        if relative_path.lower().endswith(IMAGE_EXTENSIONS):
+            manifest['images'][relative_path] = build_image_variants(path, relative_path, dist_dir)
+        logging.info(f"{relative_path} -> {manifest['files'][relative_path]}")
+
+    with open(os.path.join(dist_dir, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+# Function to load the manifest written by build_assets
+def load_manifest(static_dir=STATIC_DIR):
+    """
+    :return: The manifest, or an empty one when the build has not been run.
+    """
+    try:
+        with open(os.path.join(static_dir, DIST_DIRNAME, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        logging.warning("No asset manifest found, serving unfingerprinted static files. Run python3 assets.py to build it.")
+        return {'files': {}, 'images': {}}
+
+# Function to resolve a static file to its fingerprinted URL
+def static_url(manifest, filename, static_url_path='/static'):
+    """
+    :param manifest: Manifest from load_manifest.
+    :param filename: Path of the asset relative to the static directory.
+    :param static_url_path: URL prefix static files are served under.
+    :return: URL of the fingerprinted file, or of the original when it is not in the manifest.
+    """
+    return f"{static_url_path}/{manifest['files'].get(filename, filename)}"
+
+# Function to build background CSS from the responsive variants of an image
+def responsive_background(manifest, selector, filename, static_url_path='/static'):
+    """
+    Builds CSS that gives the selector a background from the responsive variants of an image,
+    AVIF first with WebP as the fallback, stepping down in size on narrow screens.
+    :param manifest: Manifest from load_manifest.
+    :param selector: CSS selector the background applies to.
+    :param filename: Path of the image relative to the static directory.
+    :param static_url_path: URL prefix static files are served under.
+    :return: The CSS as Markup, safe to place in a style element.
+    """
+    fallback = static_url(manifest, filename, static_url_path)
+    variants = manifest['images'].get(filename, {})
+    if not variants:
+        return Markup(f"{selector} {{ background-image: url('{fallback}'); }}")
+
+    widths = sorted({width for entries in variants.values() for _, width in entries}, reverse=True)
+
+    def rule(width):
+        candidates = []
+        width_fallback = fallback
+        for image_format in ('avif', 'webp'):
+            for path, variant_width in variants.get(image_format, []):
+                if variant_width == width:
+                    candidates.append(f"url('{static_url_path}/{path}') type('image/{image_format}')")
+                    width_fallback = f"{static_url_path}/{path}"  # Browsers without image-set get the WebP
+        return (f"{selector} {{ background-image: url('{width_fallback}'); "
+                f"background-image: image-set({', '.join(candidates)}); }}")
+
+    css = [rule(widths[0])]
+    for width in widths[1:]:
+        css.append(f"@media (max-width: {width}px) {{ {rule(width)} }}")
+    return Markup("\n".join(css))
+
+# Function to hook fingerprinted assets into a Flask app
+def init_app(app):
+    """
+    Makes url_for('static', filename=...) resolve to fingerprinted files, adds the
+    responsive_background template helper and marks fingerprinted files as immutable.
+    :param app: The Flask app.
+    """
+    manifest = load_manifest(app.static_folder)
+    files = manifest['files']
+
+    @app.url_defaults
+    def fingerprinted_static(endpoint, values):
+        if endpoint == 'static' and values.get('filename') in files:
+            values['filename'] = files[values['filename']]
+
+    # Only matters when Flask serves static files itself; in production nginx does this
+    dist_prefix = f"{app.static_url_path}/{DIST_DIRNAME}/"
+
+    @app.after_request
+    def immutable_static(response):
+        if response.status_code in (200, 304) and request.path.startswith(dist_prefix):
+            response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        return response
+
+    app.add_template_global(
+        lambda selector, filename: responsive_background(manifest, selector, filename, app.static_url_path),
+        name='responsive_background'
+    )
+
+# Build the assets when run as a script
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s [%(levelname)s] %(message)s', level=logging.INFO, stream=sys.stdout)
+    build_assets()
@@ -0,0 +1,225 @@
+import json
+import time
+import random
+import hashlib
+import threading
+import itertools
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from chromadb.api.types import EmbeddingFunction
+
+from synthetic import assistant_reply
+
+# Dimension of the local embeddings; small enough to be quick, large enough for HNSW to do real work
+EMBEDDING_DIMENSION = 256
+
+# Deterministic embedding function that stands in for OpenAI
+class HashEmbeddingFunction(EmbeddingFunction):
+    """
+    Embeds each text as a unit vector drawn from a generator seeded with a hash of its words,
+    so the same text always gets the same vector and no network is needed. Texts sharing
+    words get similar vectors, which keeps similarity search meaningful.
+    """
+    def __init__(self, dimension=EMBEDDING_DIMENSION):
+        self.dimension = dimension
+
+    def __call__(self, input):
+        return [self._embed(text) for text in input]
+
+    def _embed(self, text):
+        vector = [0.0] * self.dimension
+        for word in text.lower().split()[:512]:
+            seed = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "big")
+            rng = random.Random(seed)
+            for _ in range(4):
+                vector[rng.randrange(self.dimension)] += rng.choice((-1.0, 1.0))
+        norm = sum(value * value for value in vector) ** 0.5 or 1.0
+        return [value / norm for value in vector]
+
+    @staticmethod
+    def name():
+        return "electionclock-benchmark-hash"
+
+    def get_config(self):
+        return {"dimension": self.dimension}
+
+    @staticmethod
+    def build_from_config(config):
+        return HashEmbeddingFunction(config.get("dimension", EMBEDDING_DIMENSION))
+
+# Class answering the OpenAI API calls apollo makes, on localhost
+class StubAssistant:
+    """
+    A local server for the Assistants API calls apollo makes (create and stream a run, cancel
+    it, retrieve the assistant) and for batch mode (upload a file, create and retrieve a batch,
+    download its output). Runs complete after run_seconds, batches on their second check, and
+    every reply is a fixed analysis, so the benchmark measures apollo and not the model. The
+    tests give replies and run times per prompt and have the first requests rate limited. Point
+    apollo at it with OPENAI_BASE_URL set to base_url.
+    """
+    def __init__(self, seed=70, run_seconds=0.0, reply_for=None, rate_limited=0, retry_after="1"):
+        """
+        :param seed: Seed of the fixed analysis.
+        :param run_seconds: Seconds each run takes, or a function of the prompt returning them.
+        :param reply_for: Function of the prompt returning the reply, in place of the fixed analysis (optional).
+        :param rate_limited: Number of run and batch requests answered with a 429 before any succeeds.
+        :param retry_after: Retry-After header of the 429 responses, or None to leave it out.
+        """
+        fixed_reply = assistant_reply(random.Random(seed))
+        reply_for = reply_for or (lambda prompt: fixed_reply)
+        run_time = run_seconds if callable(run_seconds) else (lambda prompt: run_seconds)
+        counter = itertools.count()
+        limited = itertools.count()
+        requests = self.requests = []  # (method, path, status, time.monotonic()) of every request
+        files = {}
+        batches = {}
+        cancelled = set()
+        lock = threading.Lock()
+
+        # Function to answer every request of a batch input file
+        def run_batch(content):
+            lines = []
+            for i, line in enumerate(content.decode("utf-8").splitlines()):
+                request = json.loads(line)
+                reply = reply_for(request["body"]["messages"][-1]["content"])
+                lines.append(json.dumps({"id": f"batch_req_{i}", "custom_id": request["custom_id"], "error": None, "response": {
+                    "status_code": 200, "request_id": f"req_{i}", "body": {
+                        "id": f"chatcmpl_{i}", "object": "chat.completion", "model": request["body"]["model"],
+                        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": reply}}],
+                        "usage": {"prompt_tokens": len(line) // 4, "completion_tokens": len(reply) // 4, "total_tokens": 0},
+                    }}}))
+            return ("\n".join(lines) + "\n").encode("utf-8")
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, payload, status=200, headers=None):
+                body = json.dumps(payload).encode("utf-8")
+                with lock:
+                    requests.append((self.command, self.path, status, time.monotonic()))
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _stream_run(self, i, prompt):
+                reply = reply_for(prompt)
+                seconds = run_time(prompt)
+                with lock:
+                    requests.append((self.command, self.path, 200, time.monotonic()))
+                run = {"id": f"run_{i}", "object": "thread.run", "thread_id": f"thread_{i}", "status": "queued",
+                       "assistant_id": "asst_benchmark", "created_at": 0}
+                message = {"id": f"msg_{i}", "object": "thread.message", "thread_id": f"thread_{i}", "run_id": f"run_{i}",
+                           "role": "assistant", "status": "completed", "created_at": 0, "attachments": [], "metadata": {},
+                           "content": [{"type": "text", "text": {"value": reply, "annotations": []}}]}
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                self.close_connection = True
+
+                def event(name, data):
+                    self.wfile.write(f"event: {name}\ndata: {json.dumps(data)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                try:
+                    event("thread.run.created", run)
+                    event("thread.run.in_progress", {**run, "status": "in_progress"})
+                    # Sleep in small steps so a cancelled run stops streaming
+                    waited = 0.0
+                    while waited < seconds and f"run_{i}" not in cancelled:
+                        time.sleep(0.01)
+                        waited += 0.01
+                    if f"run_{i}" in cancelled:
+                        return event("thread.run.cancelled", {**run, "status": "cancelled"})
+                    event("thread.message.completed", message)
+                    event("thread.run.completed", {**run, "status": "completed", "usage": {
+                        "prompt_tokens": 500, "completion_tokens": len(reply) // 4, "total_tokens": 500 + len(reply) // 4}})
+                    self.wfile.write(b"event: done\ndata: [DONE]\n\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                i = next(counter)
+                if self.path.endswith(("/threads/runs", "/batches")) and next(limited) < rate_limited:
+                    return self._send({"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                                      429, {"Retry-After": retry_after} if retry_after is not None else None)
+                if self.path.endswith("/threads/runs"):
+                    return self._stream_run(i, json.loads(body)["thread"]["messages"][-1]["content"])
+                if self.path.endswith("/cancel"):
+                    run_id = self.path.strip("/").split("/")[-2]
+                    with lock:
+                        cancelled.add(run_id)
+                    return self._send({"id": run_id, "object": "thread.run", "thread_id": self.path.strip("/").split("/")[-4],
+                                       "status": "cancelling", "assistant_id": "asst_benchmark", "created_at": 0})
+                if self.path.endswith("/files"):
+                    message = BytesParser(policy=HTTP).parsebytes(
+                        f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode("utf-8") + body)
+                    content = next(part.get_payload(decode=True) for part in message.iter_parts()
+                                   if part.get_param("name", header="content-disposition") == "file")
+                    with lock:
+                        files[f"file_{i}"] = content
+                    return self._send({"id": f"file_{i}", "object": "file", "bytes": len(content), "created_at": 0,
+                                       "filename": "requests.jsonl", "purpose": "batch", "status": "processed"})
+                if self.path.endswith("/batches"):
+                    request = json.loads(body)
+                    with lock:
+                        files[f"file_{i}_output"] = run_batch(files[request["input_file_id"]])
+                        batches[f"batch_{i}"] = {"id": f"batch_{i}", "object": "batch", "endpoint": request["endpoint"],
+                                                 "input_file_id": request["input_file_id"], "completion_window": "24h",
+                                                 "created_at": 0, "status": "validating", "checks": 0,
+                                                 "output": f"file_{i}_output"}
+                        batch = self._batch(f"batch_{i}")
+                    return self._send(batch)
+                self._send({"error": {"message": "Not found"}}, 404)
+
+            def _batch(self, batch_id):
+                batch = batches[batch_id]
+                public = {key: value for key, value in batch.items() if key not in ("checks", "output")}
+                if batch["checks"] >= 2:
+                    public.update(status="completed", output_file_id=batch["output"])
+                elif batch["checks"] == 1:
+                    public["status"] = "in_progress"
+                return public
+
+            def do_GET(self):
+                parts = self.path.split("?")[0].strip("/").split("/")
+                if "batches" in parts:
+                    with lock:
+                        batch = batches.get(parts[-1])
+                        if batch is not None:
+                            batch["checks"] += 1
+                            batch = self._batch(parts[-1])
+                    if batch is None:
+                        return self._send({"error": {"message": "No such batch"}}, 404)
+                    return self._send(batch)
+                if parts[-1] == "content" and parts[-2] in files:
+                    content = files[parts[-2]]
+                    with lock:
+                        requests.append((self.command, self.path, 200, time.monotonic()))
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/octet-stream")
+                    self.send_header("Content-Length", str(len(content)))
+                    self.end_headers()
+                    return self.wfile.write(content)
+                if "assistants" in parts:
+                    return self._send({"id": parts[-1], "object": "assistant", "created_at": 0, "model": "gpt-4o",
+                                       "instructions": "Reply with the analysis as JSON.", "tools": [], "metadata": {},
+                                       "name": None, "description": None, "temperature": 1.0, "top_p": 1.0,
+                                       "response_format": {"type": "json_object"}})
+                self._send({"error": {"message": "Not found"}}, 404)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}/v1/"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
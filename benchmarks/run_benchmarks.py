@@ -0,0 +1,325 @@
+import os
+import gc
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import statistics
+import tracemalloc
+from io import StringIO
+from datetime import datetime, timezone
+
+# Add the root directory to the Python path for module imports
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(benchmarks_dir)
+sys.path.append(project_root)
+
+from synthetic import write_bill_xml, write_analysis_store
+from fakes import HashEmbeddingFunction, StubAssistant
+
+# Default location of the saved baseline and of the reports
+BASELINE_PATH = os.path.join(benchmarks_dir, "baseline.json")
+RESULTS_DIR = os.path.join(benchmarks_dir, "results")
+
+# Benchmark settings
+SCALES = (1, 10, 100)  # Bill sizes, in multiples of C-70
+REPEAT = 3  # Timed runs per case; the median is reported
+ROUTE_REQUESTS = 200  # Requests per route in one timed run
+REGRESSION_THRESHOLD = 0.2  # Slowdown, or growth in peak memory, past which a case is flagged
+NOISE_FLOOR_SECONDS = 0.002  # Differences smaller than this are never flagged
+GROUPS = ("extract", "chunk", "ingest", "retrieve", "analyze", "render", "routes")
+
+# Function to point the project modules at the local fakes before they are imported
+def configure_environment(stub):
+    """
+    Sets the configuration apollo, tsionhehkwen and app read at import, so nothing reaches the
+    network. Values already loaded from .env files are overridden on purpose.
+    :param stub: The running StubAssistant.
+    """
+    os.environ.update({
+        "OPENAI_BASE_URL": stub.base_url,
+        "keyOPENAI": "benchmark",
+        "id_KEIKO": "asst_benchmark",
+        "ANALYSIS_BATCH_POLL_MIN": "0",
+        "AUTHME": "benchmark",
+        "DEBUG_MODE": "False",
+    })
+
+# Function to quieten the project loggers so output does not skew timings
+def quiet_logging():
+    from loguru import logger
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+    logging.getLogger().setLevel(logging.WARNING)
+
+# Function to time a case and measure its peak memory
+def measure(run, setup=None, repeat=REPEAT):
+    """
+    Times repeat runs, then makes one more run under tracemalloc for the peak of Python
+    allocations (memory held by native libraries such as Chroma's is not included).
+    :param run: Function called with the value setup returned.
+    :param setup: Function called before every run, outside the timing (optional).
+    :param repeat: Number of timed runs.
+    :return: Dictionary with the median, min and max seconds and the peak memory in KiB.
+    """
+    times = []
+    for _ in range(repeat):
+        state = setup() if setup else None
+        gc.collect()
+        started = time.perf_counter()
+        run(state)
+        times.append(time.perf_counter() - started)
+
+    state = setup() if setup else None
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run(state)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {
+        "median_s": statistics.median(times),
+        "min_s": min(times),
+        "max_s": max(times),
+        "peak_kib": round(peak / 1024, 1),
+    }
+
+# Class holding the fakes and modules shared by every case
+class Bench:
+    def __init__(self, workdir, repeat):
+        self.workdir = workdir
+        self.repeat = repeat
+        self.results = []
+
+        # Imported up front because each project module configures logging when imported
+        import chromadb
+        from quants import tsionhehkwen, apollo, generate_analysis_html, keyword_index
+        from quants.analysis_store import AnalysisStore
+        keyword_index.index_path = os.path.join(workdir, "keyword_index.sqlite3")
+        self.keyword_index = keyword_index
+        self.apollo = apollo
+        self.AnalysisStore = AnalysisStore
+        self.generate_analysis_html = generate_analysis_html
+
+        # The store the project uses, on disk as in production, with the local embedding function
+        embedding_function = HashEmbeddingFunction()
+        client = chromadb.PersistentClient(path=os.path.join(workdir, "vector_store"))
+        tsionhehkwen._store.update({
+            "pid": os.getpid(),
+            "client": client,
+            "embedding_function": embedding_function,
+            "collection": client.get_or_create_collection("Tsionhehkwen", embedding_function=embedding_function),
+            "analysis_collection": client.get_or_create_collection("AnalysisResults", embedding_function=embedding_function),
+        })
+        self.tsionhehkwen = tsionhehkwen
+        self.collection = tsionhehkwen.get_collection()
+
+    def record(self, group, case, scale, size, run, setup=None, repeat=None):
+        result = measure(run, setup, repeat or self.repeat)
+        result.update({"case": f"{group}.{case}", "scale": scale, "size": size})
+        self.results.append(result)
+        print(f"{result['case']:<24} {scale:>4}x  median {result['median_s'] * 1000:>10.2f} ms  "
+              f"peak {result['peak_kib']:>10.1f} KiB  ({size})", flush=True)
+        return result
+
+    def run_scale(self, scale, groups):
+        from extractors.xml2text import stream_xml_to_text, write_sections
+        from extractors.chunker import read_sections, pack_sections
+        from quants.tsionhehkwen import split_into_chunks, sync_document_chunks, get_document_chunks, search_documents
+
+        xml_path = os.path.join(self.workdir, f"bill-{scale}x.xml")
+        sections_path = os.path.join(self.workdir, f"bill-{scale}x.sections.jsonl")
+        sections = write_bill_xml(xml_path, scale)
+        xml_size = f"{sections} sections, {os.path.getsize(xml_path) // 1024} KiB XML"
+
+        if "extract" in groups:
+            self.record("extract", "text", scale, xml_size, lambda _: stream_xml_to_text(xml_path, StringIO()))
+            self.record("extract", "sections", scale, xml_size, lambda _: write_sections(xml_path, StringIO()))
+
+        # Later groups work from the extracted bill
+        text_buffer = StringIO()
+        stream_xml_to_text(xml_path, text_buffer)
+        text = text_buffer.getvalue()
+        with open(sections_path, "w", encoding="utf-8") as f:
+            write_sections(xml_path, f)
+        chunks, metadatas = pack_sections(read_sections(sections_path))
+        chunk_size = f"{len(chunks)} chunks"
+
+        if "chunk" in groups:
+            self.record("chunk", "sections", scale, chunk_size, lambda _: pack_sections(read_sections(sections_path)))
+            self.record("chunk", "text", scale, f"{len(text) // 1024} KiB text", lambda _: split_into_chunks(text))
+
+        doc_id = f"bench-{scale}x"
+        needs_store = any(group in groups for group in ("ingest", "retrieve", "analyze"))
+        if needs_store:
+            def empty_store():
+                self.collection.delete(where={"doc_id": doc_id})
+
+            if "ingest" in groups:
+                self.record("ingest", "initial", scale, chunk_size,
+                            lambda _: sync_document_chunks(doc_id, chunks, self.collection, metadatas), setup=empty_store)
+            sync_document_chunks(doc_id, chunks, self.collection, metadatas)
+            if "ingest" in groups:
+                self.record("ingest", "unchanged", scale, chunk_size,
+                            lambda _: sync_document_chunks(doc_id, chunks, self.collection, metadatas))
+
+        if "retrieve" in groups:
+            self.record("retrieve", "document", scale, chunk_size, lambda _: get_document_chunks(doc_id, target_collection=self.collection))
+            self.record("retrieve", "search", scale, f"top 10 of {self.collection.count()}",
+                        lambda _: search_documents("foreign agent registry disclosure", n_results=10))
+            self.record("retrieve", "keyword", scale, f"top 10 of {self.collection.count()}",
+                        lambda _: self.keyword_index.get_index().search("foreign agent registry disclosure", limit=10))
+
+        if "analyze" in groups:
+            self.record("analyze", "stub", scale, chunk_size, lambda _: self.apollo.analyze_chunks_concurrently(chunks, cache=None))
+
+            # Batch mode into a fresh analysis store each run
+            store_path = os.path.join(self.workdir, f"bill-{scale}x_batch_analysis.jsonl")
+            numbers = list(range(1, len(chunks) + 1))
+            keys = [f"chunk-{number}" for number in numbers]
+
+            def fresh_store():
+                if os.path.exists(store_path):
+                    os.remove(store_path)
+                return self.AnalysisStore(store_path)
+
+            def analyze_batch(store):
+                self.apollo.analyze_chunks_in_batch(chunks, numbers, keys, store)
+                store.close()
+            self.record("analyze", "batch", scale, chunk_size, analyze_batch, setup=fresh_store)
+
+        if "render" in groups:
+            generate_analysis_html = self.generate_analysis_html
+            generate_analysis_html.static_pages_dir = os.path.join(self.workdir, "static_pages")
+            analysis_path = write_analysis_store(os.path.join(self.workdir, f"bill-{scale}x_analysis.jsonl"), len(chunks))
+            self.record("render", "page", scale, chunk_size,
+                        lambda _: generate_analysis_html.generate_analysis_html(analysis_path, doc_id))
+
+        if needs_store:
+            self.collection.delete(where={"doc_id": doc_id})
+
+    def run_routes(self):
+        from app import app
+        quiet_logging()
+
+        client = app.test_client()
+        headers = {"Accept-Encoding": "gzip, br", "Authorization": "Bearer benchmark"}
+        routes = {
+            "countdown": "/",
+            "api_countdown": "/api/countdown?jurisdiction=federal",
+            "get_analysis": "/get_analysis?query=bench",
+            "search_keyword": "/search?q=registry&mode=keyword",
+            "search_hybrid": "/search?q=registry",
+            "missing_page": "/does-not-exist.html",
+        }
+        self.tsionhehkwen.get_analysis_collection().upsert(ids=["bench"], documents=["Benchmark analysis result"])
+        self.tsionhehkwen.sync_document_chunks("bench-routes", ["Benchmark chunk about the foreign agent registry"], self.collection)
+        for case, path in routes.items():
+            client.get(path, headers=headers)  # Warm up caches and the page registry
+            self.record("routes", case, 1, f"{ROUTE_REQUESTS} requests",
+                        lambda _, path=path: [client.get(path, headers=headers) for _ in range(ROUTE_REQUESTS)])
+
+# Function to describe the machine a report was made on
+def environment_report():
+    versions = {}
+    for package in ("lxml", "chromadb", "openai", "flask", "jinja2"):
+        try:
+            from importlib.metadata import version
+            versions[package] = version(package)
+        except Exception:
+            versions[package] = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "packages": versions,
+    }
+
+# Function to compare a report against a baseline
+def compare(report, baseline, threshold=REGRESSION_THRESHOLD):
+    """
+    :param report: The report of this run.
+    :param baseline: A report saved earlier.
+    :param threshold: Relative slowdown or memory growth past which a case regressed.
+    :return: List of (case, scale, metric, baseline value, new value) for the regressions.
+    """
+    previous = {(r["case"], r["scale"]): r for r in baseline["results"]}
+    regressions = []
+    print(f"\nCompared with the baseline from {baseline.get('created_at')}:")
+    for result in report["results"]:
+        old = previous.get((result["case"], result["scale"]))
+        if old is None:
+            continue
+        ratio = result["median_s"] / old["median_s"] if old["median_s"] else 1.0
+        memory_ratio = result["peak_kib"] / old["peak_kib"] if old["peak_kib"] else 1.0
+        flags = []
+        if ratio > 1 + threshold and result["median_s"] - old["median_s"] > NOISE_FLOOR_SECONDS:
+            regressions.append((result["case"], result["scale"], "median_s", old["median_s"], result["median_s"]))
+            flags.append("SLOWER")
+        if memory_ratio > 1 + threshold and result["peak_kib"] - old["peak_kib"] > 64:
+            regressions.append((result["case"], result["scale"], "peak_kib", old["peak_kib"], result["peak_kib"]))
+            flags.append("MORE MEMORY")
+        print(f"{result['case']:<24} {result['scale']:>4}x  time x{ratio:.2f}  memory x{memory_ratio:.2f}  {' '.join(flags)}")
+    if baseline.get("environment", {}).get("platform") != report["environment"]["platform"]:
+        print("Warning: the baseline was made on a different platform, timings may not be comparable.")
+    return regressions
+
+# Main function to run the benchmarks
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the ElectionClock pipeline and routes.")
+    parser.add_argument("--scales", default=",".join(map(str, SCALES)), help="Bill sizes in multiples of C-70, e.g. 1,10")
+    parser.add_argument("--only", default=",".join(GROUPS), help=f"Groups to run, from {', '.join(GROUPS)}")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="Timed runs per case")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Baseline report to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="Save this run as the baseline")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD, help="Relative change flagged as a regression")
+    args = parser.parse_args()
+
+    scales = [int(scale) for scale in args.scales.split(",") if scale]
+    groups = {group for group in args.only.split(",") if group}
+    unknown = groups - set(GROUPS)
+    if unknown:
+        parser.error(f"Unknown groups: {', '.join(sorted(unknown))}")
+
+    stub = StubAssistant()
+    configure_environment(stub)
+    workdir = tempfile.mkdtemp(prefix="electionclock-bench-")
+    try:
+        bench = Bench(workdir, args.repeat)
+        quiet_logging()
+        for scale in scales:
+            bench.run_scale(scale, groups)
+        if "routes" in groups:
+            bench.run_routes()
+    finally:
+        stub.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "environment": environment_report(),
+        "repeat": args.repeat,
+        "results": bench.results,
+    }
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    report_path = os.path.join(RESULTS_DIR, f"{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}.json")
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nReport written to {report_path}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regressions past {args.threshold:.0%}")
+            sys.exit(1)
@@ -0,0 +1,97 @@
+import json
+import random
+
+# Size of one scale unit, modelled on C-70: a summary, a handful of Parts split into
+# Divisions, and about 150 top-level sections with subsections and paragraphs
+SECTIONS_PER_SCALE = 150
+SECTIONS_PER_DIVISION = 12
+DIVISIONS_PER_PART = 3
+
+# Vocabulary the synthetic provisions are written from
+WORDS = (
+    "Minister person information entity foreign state Act regulation offence court order "
+    "prescribed Canada federal agent disclosure security service commissioner review "
+    "amendment section subsection paragraph provision authority public interest government "
+    "record measure liable conviction summary indictment term registry activity"
+).split()
+
+# Function to write a sentence of legal-sounding filler
+def sentence(rng, words=18):
+    """
+    :param rng: The random.Random to draw from, so every run writes the same text.
+    :param words: Number of words in the sentence.
+    :return: The sentence.
+    """
+    text = " ".join(rng.choice(WORDS) for _ in range(words))
+    return f"{text[0].upper()}{text[1:]}."
+
+# Function to write a synthetic bill
+def write_bill_xml(path, scale=1, seed=70):
+    """
+    Writes bill XML with the elements xml2text understands, SECTIONS_PER_SCALE sections per
+    unit of scale, written element by element so even large scales use little memory.
+    The same scale and seed always produce the same bytes.
+    :param path: Path of the XML file to write.
+    :param scale: Size of the bill in multiples of C-70.
+    :param seed: Seed for the text.
+    :return: Number of sections written.
+    """
+    rng = random.Random(seed * 1000 + scale)
+    sections = SECTIONS_PER_SCALE * scale
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<Bill>\n')
+        f.write(f"<Identification><BillNumber>C-{scale}</BillNumber>"
+                f"<LongTitle>An Act respecting {sentence(rng, 8)}</LongTitle></Identification>\n")
+        f.write(f"<Introduction><Summary><Text>{' '.join(sentence(rng) for _ in range(6))}</Text></Summary></Introduction>\n")
+        f.write("<Body>\n")
+        for number in range(1, sections + 1):
+            index = number - 1
+            if index % (SECTIONS_PER_DIVISION * DIVISIONS_PER_PART) == 0:
+                part = index // (SECTIONS_PER_DIVISION * DIVISIONS_PER_PART) + 1
+                f.write(f'<Heading level="1"><Label>PART {part}</Label><TitleText>{sentence(rng, 5)}</TitleText></Heading>\n')
+            if index % SECTIONS_PER_DIVISION == 0:
+                division = (index // SECTIONS_PER_DIVISION) % DIVISIONS_PER_PART + 1
+                f.write(f'<Heading level="2"><Label>DIVISION {division}</Label><TitleText>{sentence(rng, 4)}</TitleText></Heading>\n')
+            f.write(f"<Section><MarginalNote>{sentence(rng, 3)}</MarginalNote><Label>{number}</Label>"
+                    f"<Text>{sentence(rng, rng.randint(12, 40))}</Text>\n")
+            for sub in range(1, rng.randint(1, 5) + 1):
+                f.write(f"<Subsection><Label>({sub})</Label><Text>{sentence(rng, rng.randint(20, 60))}</Text>")
+                for letter in "abcd"[:rng.randint(0, 4)]:
+                    f.write(f"<Paragraph><Label>({letter})</Label><Text>{sentence(rng, rng.randint(8, 25))}</Text></Paragraph>")
+                f.write("</Subsection>\n")
+            f.write("</Section>\n")
+        f.write("</Body>\n</Bill>\n")
+    return sections
+
+# Function to write the analysis store the assistant's replies would produce for some chunks
+def write_analysis_store(path, chunks, seed=70):
+    """
+    :param path: Path of the JSONL file to write.
+    :param chunks: Number of chunks analyzed.
+    :param seed: Seed for the text.
+    :return: Path of the file, in the format apollo writes, ready for generate_analysis_html.
+    """
+    rng = random.Random(seed)
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(1, chunks + 1):
+            record = {"chunk": i, "key": f"chunk-{i}", "analysis": json.loads(assistant_reply(rng))}
+            f.write(json.dumps(record, separators=(",", ":")) + "\n")
+    return path
+
+# Function to write one analysis reply in the format the assistant is instructed to use
+def assistant_reply(rng):
+    """
+    :param rng: The random.Random to draw from.
+    :return: The reply as a JSON string.
+    """
+    return json.dumps({
+        "Analysis": {
+            "Summary": sentence(rng, 40),
+            "Details": {f"Part {n}": {"Amendments": [{"Act": sentence(rng, 4), "Change": sentence(rng, 20)}]} for n in range(1, 3)},
+            "Individual_Heart_Analysis": {"Score": rng.randint(1, 10), "Explanation": sentence(rng, 30)},
+            "Borg_Collective_Analysis": {"Score": rng.randint(1, 10), "Explanation": sentence(rng, 30)},
+        },
+        "Philosopher_Perspectives": [
+            {"Philosopher": name, "Perspective": sentence(rng, 25)} for name in ("Locke", "Hobbes", "Rousseau")
+        ],
+    })
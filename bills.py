@@ -0,0 +1,59 @@
+# bills.py
+import os
+import json
+
+# Default location of the bill registry
+REGISTRY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bills.json')
+
+# Class holding every bill the pipeline tracks
+class BillRegistry:
+    """
+    Bill registry loaded from a JSON file. Each entry has a name, used for the files written
+    to extractors/taillings and as the document ID in the vector store (e.g. C-70_E), the URL
+    of the bill XML, and optionally its number, parliamentary session and title. Entries with
+    "active": false stay in the registry but are skipped by the pipeline.
+    """
+    def __init__(self, entries):
+        self.bills = {}
+        for entry in entries:
+            bill = self._parse(entry)
+            if bill['name'] in self.bills:
+                raise ValueError(f"Bill {bill['name']} is listed more than once")
+            self.bills[bill['name']] = bill
+
+    @staticmethod
+    def _parse(entry):
+        url = entry['url']
+        return {
+            'name': entry.get('name') or os.path.splitext(os.path.basename(url))[0],
+            'url': url,
+            'number': entry.get('number'),
+            'session': entry.get('session'),
+            'title': entry.get('title'),
+            'active': entry.get('active', True),
+        }
+
+    @classmethod
+    def load(cls, path=REGISTRY_PATH):
+        """
+        Loads the registry from a JSON file.
+        :param path: Path to the registry file.
+        :return: A BillRegistry.
+        """
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def get(self, name):
+        """
+        :param name: The bill name.
+        :return: The bill as a dictionary, or None if it is not registered.
+        """
+        return self.bills.get(name)
+
+    def active(self, session=None):
+        """
+        :param session: Limit the bills to one parliamentary session, e.g. 44-1 (optional).
+        :return: List of the active bills, in registry order.
+        """
+        return [bill for bill in self.bills.values()
+                if bill['active'] and (session is None or bill['session'] == session)]
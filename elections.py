@@ -0,0 +1,114 @@
+# elections.py
+import os
+import json
+import bisect
+import threading
+from datetime import datetime
+import pytz
+
+# Default location of the election schedule
+SCHEDULE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'elections.json')
+
+# Election types the schedule understands
+ELECTION_TYPES = ('general', 'by-election')
+
+# Class holding every scheduled election, indexed for fast "next election" lookups
+class ElectionSchedule:
+    """
+    Election schedule loaded once at startup. Each entry in the schedule file has a
+    jurisdiction (federal, or a province such as ontario), a type (general or by-election),
+    a name, a date (YYYY-MM-DD) and the timezone whose midnight the countdown targets.
+    Elections are kept sorted by date, overall and per jurisdiction, and a cursor per index
+    only moves forward as elections pass, so finding the next election is constant time
+    on average.
+    """
+    def __init__(self, entries):
+        self.elections = sorted((self._parse(entry) for entry in entries), key=lambda e: e['timestamp_ms'])
+        self.by_jurisdiction = {}
+        for election in self.elections:
+            self.by_jurisdiction.setdefault(election['jurisdiction'], []).append(election)
+        self.by_date = {}
+        for election in self.elections:
+            self.by_date.setdefault(election['date'], []).append(election)
+        self._timestamps = {None: [e['timestamp_ms'] for e in self.elections]}
+        for jurisdiction, elections in self.by_jurisdiction.items():
+            self._timestamps[jurisdiction] = [e['timestamp_ms'] for e in elections]
+        self._cursors = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _parse(entry):
+        election_type = entry.get('type', 'general')
+        if election_type not in ELECTION_TYPES:
+            raise ValueError(f"Unknown election type {election_type!r} for {entry.get('name')}")
+        timezone = pytz.timezone(entry.get('timezone', 'America/Toronto'))
+        target = timezone.localize(datetime.strptime(entry['date'], '%Y-%m-%d'))
+        return {
+            'jurisdiction': entry['jurisdiction'].lower(),
+            'type': election_type,
+            'name': entry['name'],
+            'date': entry['date'],
+            'timezone': timezone.zone,
+            'target': target.isoformat(),
+            'timestamp_ms': int(target.timestamp() * 1000),
+        }
+
+    @classmethod
+    def load(cls, path=SCHEDULE_PATH):
+        """
+        Loads the schedule from a JSON file.
+        :param path: Path to the schedule file.
+        :return: An ElectionSchedule.
+        """
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def next_election(self, jurisdiction=None, now_ms=None):
+        """
+        Finds the next election that has not started yet.
+        :param jurisdiction: Limit the lookup to one jurisdiction (optional).
+        :param now_ms: Current time in epoch milliseconds, defaults to the system clock.
+        :return: The election as a dictionary, or None if nothing is scheduled.
+        """
+        key = jurisdiction.lower() if jurisdiction else None
+        timestamps = self._timestamps.get(key)
+        if not timestamps:
+            return None
+        if now_ms is None:
+            now_ms = int(datetime.now(pytz.utc).timestamp() * 1000)
+        elections = self.elections if key is None else self.by_jurisdiction[key]
+        with self._lock:
+            cursor = self._cursors.get(key, 0)
+            # The cached cursor is right unless an election has passed since (or the clock moved back)
+            still_next = cursor == len(timestamps) or timestamps[cursor] > now_ms
+            still_next = still_next and (cursor == 0 or timestamps[cursor - 1] <= now_ms)
+            if not still_next:
+                cursor = bisect.bisect_right(timestamps, now_ms)
+                self._cursors[key] = cursor
+        if cursor == len(timestamps):
+            return None
+        return elections[cursor]
+
+    def latest_election(self, jurisdiction=None):
+        """
+        :param jurisdiction: Limit the lookup to one jurisdiction (optional).
+        :return: The last scheduled election, used when every election is in the past.
+        """
+        elections = self.elections if not jurisdiction else self.by_jurisdiction.get(jurisdiction.lower(), [])
+        return elections[-1] if elections else None
+
+    def on_date(self, date):
+        """
+        :param date: A date string in YYYY-MM-DD format.
+        :return: List of elections held on that date.
+        """
+        return self.by_date.get(date, [])
+
+    def jurisdictions(self):
+        """
+        :return: Sorted list of jurisdictions in the schedule.
+        """
+        return sorted(self.by_jurisdiction)
+
+# The schedule for this process, loaded once at import
+schedule = ElectionSchedule.load(os.getenv('ELECTION_SCHEDULE_PATH', SCHEDULE_PATH))
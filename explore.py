@@ -1,107 +1,197 @@
 import os
 import sys
-from dotenv import load_dotenv
-import chromadb
-from chromadb.utils.embedding_functions import OpenAIEmbeddingFunction
+import json
+import argparse
+from loguru import logger
 
 # Ensure the project root is in the Python path
-sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-# Load environment variables from the .env file
-env_path = os.path.join(os.getenv('HOME'), "web/ElectionClockEnvironment/.env")
+from quants.tsionhehkwen import (
+    get_collection, get_analysis_collection, iter_collection, delete_records,
+    export_records, import_records, vector_store_directory, rebuild_keyword_index
+)
+from quants import vector_maintenance
 
-if not os.path.isfile(env_path):
-    raise ValueError(f".env file not found at {env_path}. Please ensure the file exists.")
+# Collections the explorer works on, by the name used on the command line
+COLLECTIONS = {
+    "documents": get_collection,
+    "analysis": get_analysis_collection,
+}
 
-load_dotenv(dotenv_path=env_path)
+# Function to send log output to stderr so stdout only carries results
+def quiet_logging():
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
 
-# Retrieve OpenAI API Key
-openai_api_key = os.getenv("keyOPENAI")
-if not openai_api_key:
-    raise ValueError("Please provide an OpenAI API key in the .env file with key 'keyOPENAI'.")
+# Function to shorten a document for a listing
+def preview(document, width=100):
+    """
+    :param document: The document text.
+    :param width: Maximum number of characters.
+    :return: The text on one line, cut to width.
+    """
+    text = " ".join((document or "").split())
+    return text if len(text) <= width else text[:width - 3] + "..."
 
-# Ensure the vector store directory exists
-vector_store_directory = "quants/vector_store"
-os.makedirs(vector_store_directory, exist_ok=True)
+# Function to build the metadata filter from the command line
+def where_filter(args):
+    """
+    :param args: Parsed arguments.
+    :return: A filter on doc_id, or None.
+    """
+    return {"doc_id": args.doc_id} if getattr(args, "doc_id", None) else None
 
-# Initialize the ChromaDB client with disk persistence
-client = chromadb.PersistentClient(path=vector_store_directory)
+# Function to list one page of a collection
+def list_records(collection, args):
+    offset = (args.page - 1) * args.page_size
+    shown = 0
+    for page in iter_collection(collection, where=where_filter(args), page_size=args.page_size, offset=offset, limit=args.page_size):
+        for i, (record_id, document) in enumerate(zip(page["ids"], page["documents"]), offset + 1):
+            print(f"{i}. {record_id}  {preview(document)}")
+            shown += 1
+    if not shown:
+        print("No records on this page.")
 
-# Use OpenAI's `text-embedding-ada-002` model
-embedding_function = OpenAIEmbeddingFunction(api_key=openai_api_key, model_name="text-embedding-ada-002")
+# Function to print one record in full
+def show_record(collection, args):
+    record = collection.get(ids=[args.id], include=["documents", "metadatas"])
+    if not record["ids"]:
+        sys.exit(f"No record found with ID: {args.id}")
+    print(json.dumps(record["metadatas"][0], indent=2, ensure_ascii=False))
+    print(record["documents"][0])
 
-# Retrieve or create the collection
-collection = client.get_or_create_collection(
-    name="Tsionhehkwen",
-    embedding_function=embedding_function
-)
+# Function to search a collection and print the ranked results
+def search_records(collection, args):
+    results = collection.query(query_texts=[args.query], n_results=args.n, where=where_filter(args))
+    if not results["ids"][0]:
+        print("No results.")
+    for i, (record_id, distance, document) in enumerate(zip(results["ids"][0], results["distances"][0], results["documents"][0]), 1):
+        print(f"{i}. {record_id}  distance {distance:.4f}  {preview(document)}")
+
+# Function to export a collection to JSONL
+def export_collection(collection, args):
+    with open(args.path, "w", encoding="utf-8") as f:
+        written = export_records(collection, f, where=where_filter(args), page_size=args.page_size, embeddings=not args.no_embeddings)
+    print(f"Exported {written} records to {args.path}")
+
+# Function to import a JSONL export into a collection
+def import_collection(collection, args):
+    # Writes hold the store lock, and fetch the collection again under it in case a rebuild or restore replaced it meanwhile
+    with vector_maintenance.store_lock(), open(args.path, "r", encoding="utf-8") as f:
+        collection = COLLECTIONS[args.collection]()
+        imported = import_records(collection, f, batch_size=args.batch_size)
+    print(f"Imported {imported} records from {args.path}")
+
+# Function to delete records in batches
+def delete_collection_records(collection, args):
+    if not (args.ids or args.doc_id or args.all):
+        sys.exit("Give --ids, --doc-id or --all")
+    if not args.yes:
+        target = f"{len(args.ids)} records" if args.ids else f"the records of {args.doc_id}" if args.doc_id else "every record"
+        if input(f"Delete {target} from {collection.name}? (yes/no): ").strip().lower() != "yes":
+            print("Deletion canceled.")
+            return
+    # The lock is taken after the prompt so nobody waits on the answer
+    with vector_maintenance.store_lock():
+        collection = COLLECTIONS[args.collection]()
+        deleted = delete_records(collection, where=where_filter(args), ids=args.ids or None, batch_size=args.batch_size)
+        remaining = collection.count()
+    print(f"Deleted {deleted} records, {remaining} remain")
+
+# Function to report the size and contents of a collection
+def collection_stats(collection, args):
+    """
+    Reads the collection page by page, so even very large collections are counted in bounded memory.
+    """
+    count = collection.count()
+    documents = {}
+    characters = 0
+    dimension = None
+    for page in iter_collection(collection, include=["documents", "metadatas"], page_size=args.page_size):
+        for document, metadata in zip(page["documents"], page["metadatas"]):
+            doc_id = (metadata or {}).get("doc_id", "(none)")
+            documents[doc_id] = documents.get(doc_id, 0) + 1
+            characters += len(document or "")
+    if count:
+        sample = collection.get(limit=1, include=["embeddings"])["embeddings"]
+        dimension = len(sample[0]) if len(sample) else None
+
+    disk_bytes = sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(vector_store_directory) for name in names
+    )
+    stats = {
+        "collection": collection.name,
+        "records": count,
+        "documents": len(documents),
+        "records_per_document": dict(sorted(documents.items())),
+        "average_characters": round(characters / count) if count else 0,
+        "embedding_dimension": dimension,
+        "store_disk_bytes": disk_bytes,
+    }
+    print(json.dumps(stats, indent=2))
+
+# Function to rebuild the keyword index behind /search from the documents collection
+def reindex_collection(collection, args):
+    if collection.name != "Tsionhehkwen":
+        sys.exit("Only the documents collection has a keyword index")
+    indexed = rebuild_keyword_index(collection, page_size=args.page_size, if_empty=args.if_empty)
+    print("The keyword index is not empty, left as it is." if indexed is None else f"Indexed {indexed} records")
+
+# Function to parse the command line
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Explore and maintain the Tsionhehkwen vector store")
+    parser.add_argument("--collection", choices=sorted(COLLECTIONS), default="documents", help="Collection to work on")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    listing = commands.add_parser("list", help="List one page of records")
+    listing.add_argument("--page", type=int, default=1)
+    listing.add_argument("--page-size", type=int, default=50)
+    listing.add_argument("--doc-id", help="Only records of this document")
+    listing.set_defaults(run=list_records)
+
+    show = commands.add_parser("show", help="Print one record with its metadata")
+    show.add_argument("id")
+    show.set_defaults(run=show_record)
+
+    search = commands.add_parser("search", help="Search by similarity")
+    search.add_argument("query")
+    search.add_argument("-n", type=int, default=5, help="Number of results")
+    search.add_argument("--doc-id", help="Only records of this document")
+    search.set_defaults(run=search_records)
+
+    export = commands.add_parser("export", help="Stream records to a JSONL file, embeddings included")
+    export.add_argument("path")
+    export.add_argument("--doc-id", help="Only records of this document")
+    export.add_argument("--page-size", type=int, default=500)
+    export.add_argument("--no-embeddings", action="store_true", help="Leave the embeddings out")
+    export.set_defaults(run=export_collection)
+
+    load = commands.add_parser("import", help="Upsert records from a JSONL export")
+    load.add_argument("path")
+    load.add_argument("--batch-size", type=int, default=500)
+    load.set_defaults(run=import_collection)
+
+    delete = commands.add_parser("delete", help="Delete records in batches")
+    delete.add_argument("--ids", nargs="+", help="IDs to delete")
+    delete.add_argument("--doc-id", help="Delete every record of this document")
+    delete.add_argument("--all", action="store_true", help="Delete every record")
+    delete.add_argument("--batch-size", type=int, default=500)
+    delete.add_argument("--yes", action="store_true", help="Do not ask for confirmation")
+    delete.set_defaults(run=delete_collection_records)
+
+    stats = commands.add_parser("stats", help="Report record counts, sizes and the embedding dimension")
+    stats.add_argument("--page-size", type=int, default=1000)
+    stats.set_defaults(run=collection_stats)
 
-# Function to show all documents
-def show_all_documents(collection):
-    documents = collection.get()
-    if not documents["documents"]:
-        print("No documents found in the collection.")
-        return
-    for i, (doc_id, document) in enumerate(zip(documents["ids"], documents["documents"]), 1):
-        print(f"\n{i}. ID: {doc_id}\nContent:\n{document}\n")
-
-# Function to delete all documents
-def delete_all_documents(collection):
-    ids_to_delete = collection.get()["ids"]
-    collection.delete(ids=ids_to_delete)
-    
-    # Verify if deletion was successful
-    remaining_ids = collection.get()["ids"]
-    if not remaining_ids:
-        print("All documents deleted successfully.")
-    else:
-        print(f"Warning: Some documents could not be deleted. Remaining IDs: {remaining_ids}")
-
-# Function to explore the collection
-def explore_collection(collection):
-    while True:
-        print("\n--- Tsionhehkwen Vector Store Explorer ---")
-        print("1. Show all documents")
-        print("2. List document IDs")
-        print("3. Retrieve a specific document")
-        print("4. Search documents")
-        print("5. Delete all documents")
-        print("6. Exit")
-        choice = input("Enter your choice: ").strip()
-
-        if choice == "1":
-            show_all_documents(collection)
-        elif choice == "2":
-            documents = collection.peek()
-            print("Documents in Collection:")
-            for i, doc_id in enumerate(documents["ids"], 1):
-                print(f"{i}. {doc_id}")
-        elif choice == "3":
-            doc_id = input("Enter a document ID to retrieve: ").strip()
-            if doc_id:
-                document = collection.get(ids=[doc_id])
-                if document["documents"]:
-                    print(f"\nDocument Content ({doc_id}):\n{document['documents'][0]}")
-                else:
-                    print(f"No document found with ID: {doc_id}")
-        elif choice == "4":
-            query = input("Enter a search query: ").strip()
-            if query:
-                results = collection.query(query_texts=[query], n_results=5)
-                print(f"\nSearch Results for '{query}':")
-                for i, doc in enumerate(results["documents"], 1):
-                    print(f"{i}. {doc}")
-        elif choice == "5":
-            confirm = input("Are you sure you want to delete all documents? (yes/no): ").strip().lower()
-            if confirm == "yes":
-                delete_all_documents(collection)
-            else:
-                print("Deletion canceled.")
-        elif choice == "6":
-            print("Exiting Tsionhehkwen Vector Store Explorer.")
-            break
-        else:
-            print("Invalid choice, please try again.")
+    reindex = commands.add_parser("reindex", help="Rebuild the keyword index from the documents collection")
+    reindex.add_argument("--page-size", type=int, default=500)
+    reindex.add_argument("--if-empty", action="store_true", help="Only when the index holds nothing yet")
+    reindex.set_defaults(run=reindex_collection)
+    return parser.parse_args(argv)
 
 if __name__ == "__main__":
-    explore_collection(collection)
+    args = parse_args()
+    quiet_logging()
+    args.run(COLLECTIONS[args.collection](), args)
@@ -0,0 +1,136 @@
+import re
+import json
+import zlib
+
+# Default packing settings
+MAX_CHUNK_TOKENS = 1500  # Token budget for a chunk sent for analysis
+OVERLAP_TOKENS = 0  # Tokens of the previous chunk repeated at the start of the next one
+
+# Sentence boundaries used when a single section is larger than the budget
+SENTENCE_PATTERN = re.compile(r"(?<=[.;:])\s+(?=[(\w])")
+
+# Function to estimate the token count of a text without a tokenizer
+def estimate_tokens(text):
+    """
+    Estimates tokens at about four characters each, which is close for English legal text.
+    :param text: The text to measure.
+    :return: Estimated number of tokens.
+    """
+    return len(text) // 4 + 1
+
+# Function to read the sections written by xml2text
+def read_sections(path):
+    """
+    :param path: Path to a .sections.jsonl file written by xml2text.
+    :return: Iterator of section dictionaries in document order.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+# Function to cut an oversized section into sentence-aligned pieces
+def split_section(section, max_tokens):
+    """
+    Splits a section whose text is over the budget at sentence boundaries, and at word
+    boundaries for sentences that are over the budget on their own.
+    :param section: A section dictionary.
+    :param max_tokens: The token budget.
+    :return: List of section dictionaries, each within the budget.
+    """
+    max_chars = max_tokens * 4
+    pieces = []
+    current = ""
+    for sentence in SENTENCE_PATTERN.split(section["text"]):
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars) + 1 or max_chars
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(sentence[:cut].strip())
+            sentence = sentence[cut:]
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            pieces.append(current)
+            current = ""
+        current = f"{current} {sentence}" if current else sentence
+    if current:
+        pieces.append(current)
+    return [dict(section, text=piece) for piece in pieces]
+
+# Function to build the heading line that introduces a chunk
+def heading_path(section):
+    """
+    :param section: A section dictionary.
+    :return: The Part, Division and subheading of the section joined with " / ", or an empty string.
+    """
+    return " / ".join(part for part in (section.get("part"), section.get("division"), section.get("heading")) if part)
+
+# Function to pack whole sections into chunks within a token budget
+def pack_sections(sections, max_tokens=MAX_CHUNK_TOKENS, overlap_tokens=OVERLAP_TOKENS):
+    """
+    Packs consecutive sections into chunks of at most max_tokens, never splitting a section
+    unless it is larger than the budget on its own. A new chunk always starts at a new Part
+    or Division, and chunks may also close on a boundary chosen by a hash of the section text
+    once half full, so an edit to one section leaves the chunks around it unchanged.
+    Each chunk starts with its heading path so the analysis has the context it needs.
+    :param sections: Iterable of section dictionaries from xml2text.iter_sections or read_sections.
+    :param max_tokens: Token budget per chunk.
+    :param overlap_tokens: Tokens from the end of the previous chunk to repeat at the start of the next.
+    :return: Tuple of (chunks, metadatas), with Chroma-compatible metadata for each chunk.
+    """
+    chunks = []
+    metadatas = []
+    current = []
+    current_tokens = 0
+    previous_text = ""
+    # Leave room for the overlap and the line break after it so chunks stay within the budget with it included
+    max_tokens = max(max_tokens - (overlap_tokens + 1 if overlap_tokens else 0), 1)
+
+    def flush():
+        nonlocal current, current_tokens, previous_text
+        if not current:
+            return
+        heading = heading_path(current[0])
+        body = "\n".join(section["text"] for section in current)
+        text = f"{heading}\n{body}" if heading else body
+        if overlap_tokens and previous_text:
+            overlap = previous_text[-overlap_tokens * 4:]
+            overlap = overlap[overlap.find(" ") + 1:] if " " in overlap else overlap
+            text = f"{overlap}\n{text}"
+        labels = [section["label"] for section in current if section.get("label")]
+        chunks.append(text)
+        metadatas.append({
+            "heading": heading,
+            "part": current[0].get("part") or "",
+            "division": current[0].get("division") or "",
+            "section_start": labels[0] if labels else "",
+            "section_end": labels[-1] if labels else "",
+            "sections": ", ".join(dict.fromkeys(labels)),
+            "marginal_notes": "; ".join(section["marginal_note"] for section in current if section.get("marginal_note")),
+        })
+        previous_text = body
+        current = []
+        current_tokens = 0
+
+    for section in sections:
+        # The heading line of a chunk that starts with this section counts against the budget too
+        heading = heading_path(section)
+        heading_tokens = estimate_tokens(f"{heading}\n") if heading else 0
+        room = max(max_tokens - heading_tokens, 1)
+        # split_section fills pieces to the character limit, which estimate_tokens rounds up by one
+        pieces = [section] if estimate_tokens(section["text"]) <= room else split_section(section, max(room - 1, 1))
+        for piece in pieces:
+            tokens = estimate_tokens(piece["text"])
+            if current:
+                changed_context = (piece.get("part"), piece.get("division")) != (current[0].get("part"), current[0].get("division"))
+                if changed_context or current_tokens + tokens > max_tokens:
+                    flush()
+            if not current:
+                current_tokens = heading_tokens
+            current.append(piece)
+            current_tokens += tokens
+            # Content-defined boundary: roughly one section in four may close a chunk once it is half full
+            if current_tokens >= max_tokens // 2 and zlib.crc32(piece["text"].encode("utf-8")) % 4 == 0:
+                flush()
+    flush()
+    return chunks, metadatas
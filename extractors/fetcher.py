@@ -0,0 +1,158 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Default location of the raw XML cache
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "raw_cache")
+
+# Fetch settings
+POOL_SIZE = 8  # Connections kept open per host, and bills fetched at once
+TIMEOUT = (10, 60)  # Seconds to connect and to wait between bytes
+KEEP_VERSIONS = 3  # Versions of each bill kept in the cache
+USER_AGENT = "ElectionClock/1.0 (+https://github.com/coldcanuk/ElectionClock)"
+
+# Class fetching bill XML with conditional requests and a raw-source cache
+class BillFetcher:
+    """
+    Downloads bill XML over a pooled session, sending the ETag and Last-Modified validators
+    of the cached copy so an unchanged bill costs a 304 and no download. Every version is kept
+    on disk under the hash of its URL, named by the hash of its content, with the validators
+    in a small JSON file next to it.
+    """
+    def __init__(self, cache_dir=CACHE_DIR, pool_size=POOL_SIZE, timeout=TIMEOUT, session=None):
+        self.cache_dir = cache_dir
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.session = session if session is not None else self._build_session(pool_size)
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    @staticmethod
+    def _build_session(pool_size):
+        session = requests.Session()
+        # Retry connection errors and server errors, which parl.ca returns now and then under load
+        retry = Retry(total=3, backoff_factor=1.0, status_forcelist=(500, 502, 503, 504), allowed_methods=("GET",))
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers["User-Agent"] = USER_AGENT
+        return session
+
+    def _url_dir(self, url):
+        return os.path.join(self.cache_dir, hashlib.sha256(url.encode("utf-8")).hexdigest()[:32])
+
+    def _lock_for(self, url):
+        with self._locks_lock:
+            return self._locks.setdefault(url, threading.Lock())
+
+    def cached(self, url):
+        """
+        :param url: The bill URL.
+        :return: The cache metadata of the URL, or None if it was never fetched.
+        """
+        try:
+            with open(os.path.join(self._url_dir(url), "meta.json"), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        meta["path"] = os.path.join(self._url_dir(url), f"{meta['sha256']}.xml")
+        return meta if os.path.exists(meta["path"]) else None
+
+    def fetch(self, url):
+        """
+        Fetches a bill, reusing the cached copy when the server says it has not changed.
+        :param url: The bill URL.
+        :return: Dictionary with the url, the path of the cached XML, its sha256, the HTTP status
+                 and whether the content changed since the previous fetch.
+        :raises requests.HTTPError: If the server answers with an error, or with a 304 when nothing is cached.
+        """
+        with self._lock_for(url):
+            meta = self.cached(url)
+            headers = {}
+            if meta is not None:
+                if meta.get("etag"):
+                    headers["If-None-Match"] = meta["etag"]
+                if meta.get("last_modified"):
+                    headers["If-Modified-Since"] = meta["last_modified"]
+
+            with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+                if response.status_code == 304 and meta is not None:
+                    meta["checked_at"] = datetime.now(timezone.utc).isoformat()
+                    self._write_meta(url, meta)
+                    return {"url": url, "path": meta["path"], "sha256": meta["sha256"], "status": 304, "changed": False}
+                if response.status_code == 304:
+                    # No validators were sent, so there is no cached copy to reuse and the empty body is not a version
+                    raise requests.HTTPError(f"304 Not Modified without a cached copy for url: {url}", response=response)
+                response.raise_for_status()
+
+                url_dir = self._url_dir(url)
+                os.makedirs(url_dir, exist_ok=True)
+                digest = hashlib.sha256()
+                fd, temp_path = tempfile.mkstemp(dir=url_dir, prefix=".tmp-")
+                try:
+                    with os.fdopen(fd, "wb") as f:
+                        for block in response.iter_content(chunk_size=1 << 16):
+                            digest.update(block)
+                            f.write(block)
+                    sha256 = digest.hexdigest()
+                    path = os.path.join(url_dir, f"{sha256}.xml")
+                    os.replace(temp_path, path)
+                except BaseException:
+                    if os.path.exists(temp_path):
+                        os.unlink(temp_path)
+                    raise
+                etag = response.headers.get("ETag")
+                last_modified = response.headers.get("Last-Modified")
+
+            previous = meta["sha256"] if meta is not None else None
+            versions = [sha256] + [v for v in (meta or {}).get("versions", []) if v != sha256]
+            for stale in versions[KEEP_VERSIONS:]:
+                stale_path = os.path.join(url_dir, f"{stale}.xml")
+                if os.path.exists(stale_path):
+                    os.unlink(stale_path)
+            now = datetime.now(timezone.utc).isoformat()
+            self._write_meta(url, {
+                "url": url,
+                "etag": etag,
+                "last_modified": last_modified,
+                "sha256": sha256,
+                "versions": versions[:KEEP_VERSIONS],
+                "fetched_at": now,
+                "checked_at": now,
+            })
+            return {"url": url, "path": path, "sha256": sha256, "status": 200, "changed": sha256 != previous}
+
+    def _write_meta(self, url, meta):
+        meta = {key: value for key, value in meta.items() if key != "path"}
+        meta_path = os.path.join(self._url_dir(url), "meta.json")
+        with open(f"{meta_path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+        os.replace(f"{meta_path}.tmp", meta_path)
+
+    def fetch_many(self, urls, max_workers=None):
+        """
+        Fetches many bills in parallel over the shared connection pool.
+        :param urls: Iterable of bill URLs.
+        :param max_workers: Number of fetches at once, defaults to the pool size.
+        :return: Dictionary of URL to the fetch result, or to the exception raised for it.
+        """
+        urls = list(dict.fromkeys(urls))
+        results = {}
+        with ThreadPoolExecutor(max_workers=max_workers or self.pool_size) as executor:
+            futures = {url: executor.submit(self.fetch, url) for url in urls}
+            for url, future in futures.items():
+                try:
+                    results[url] = future.result()
+                except Exception as e:
+                    results[url] = e
+        return results
+
+    def close(self):
+        self.session.close()
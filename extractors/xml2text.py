@@ -1,37 +1,278 @@
 import os
-import requests
+import sys
+import json
+import shutil
+import hashlib
+from io import StringIO
 from lxml import etree
 
+# Add the root directory to the Python path for module imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from extractors.fetcher import BillFetcher
+
 # URL of the XML document
 url = "https://www.parl.ca/Content/Bills/441/Government/C-70/C-70_1/C-70_E.xml"
 
-# Function to download and convert XML to plain text
-def xml_to_text(url):
-    # Download the XML content
-    site_response = requests.get(url)
-    if site_response.status_code != 200:
-        raise Exception(f"Failed to download the XML file, status code: {site_response.status_code}")
+# Bills to extract in one run, keyed by the name of the text file written to taillings
+BILLS = {
+    "C-70_E": url,
+}
+
+# Elements that start a new line in the plain text output so the bill keeps its layout
+BLOCK_TAGS = {
+    "Part", "Division", "Subdivision", "Heading", "Section", "Subsection",
+    "Paragraph", "Subparagraph", "Clause", "Subclause", "MarginalNote",
+    "Definition", "Provision", "Schedule", "Identification", "Introduction",
+}
+
+# Class to write text pieces to a file as they are found in the XML
+class TextWriter:
+    """
+    Joins stripped text pieces with single spaces and breaks lines at block elements,
+    writing straight to the output stream instead of building strings in memory.
+    """
+    def __init__(self, output):
+        self.output = output
+        self.line_open = False
+
+    def write(self, text):
+        if not text:
+            return
+        text = text.strip()
+        if not text:
+            return
+        if self.line_open:
+            self.output.write(" ")
+        self.output.write(text)
+        self.line_open = True
+
+    def break_line(self):
+        if self.line_open:
+            self.output.write("\n")
+            self.line_open = False
+
+# Function to stream an XML source into plain text
+def stream_xml_to_text(source, output):
+    """
+    Converts an XML document to plain text with iterparse, writing the text as it goes.
+    Finished elements are cleared so memory stays flat no matter how large the bill is.
+    :param source: A file path or binary file-like object holding the XML.
+    :param output: A text file-like object the plain text is written to.
+    """
+    writer = TextWriter(output)
+    # The text of an element is only complete once the next event arrives, and the
+    # tail of an element once the event after its end arrives, so both are deferred.
+    pending_text = None
+    pending_tail = None
+
+    for event, element in etree.iterparse(source, events=("start", "end", "comment", "pi")):
+        if pending_text is not None:
+            writer.write(pending_text.text)
+            pending_text = None
+        if pending_tail is not None:
+            writer.write(pending_tail.tail)
+            # Drop the finished element and any earlier siblings that are still attached;
+            # comments and processing instructions before the root have no parent to drop them from
+            pending_tail.clear(keep_tail=False)
+            parent = pending_tail.getparent()
+            if parent is not None:
+                while pending_tail.getprevious() is not None:
+                    del parent[0]
+            pending_tail = None
+
+        if event == "start":
+            if etree.QName(element).localname in BLOCK_TAGS:
+                writer.break_line()
+            pending_text = element
+        elif event == "end":
+            if isinstance(element.tag, str) and etree.QName(element).localname in BLOCK_TAGS:
+                writer.break_line()
+            if element.getparent() is not None:
+                pending_tail = element
+        else:
+            # Comments and processing instructions carry no bill text, only a tail
+            pending_tail = element
+
+    writer.break_line()
+
+# Function to write the text of an element that is already fully parsed
+def element_text(element):
+    """
+    Extracts the text of an element and its descendants the same way stream_xml_to_text does,
+    without recursion, breaking lines at block elements.
+    :param element: A parsed element.
+    :return: The plain text.
+    """
+    buffer = StringIO()
+    writer = TextWriter(buffer)
+    for event, node in etree.iterwalk(element, events=("start", "end", "comment", "pi")):
+        if event == "start":
+            if etree.QName(node).localname in BLOCK_TAGS:
+                writer.break_line()
+            writer.write(node.text)
+        elif event == "end":
+            if etree.QName(node).localname in BLOCK_TAGS:
+                writer.break_line()
+            if node is not element:
+                writer.write(node.tail)
+        else:
+            # Comments and processing instructions carry no bill text, only a tail
+            writer.write(node.tail)
+    writer.break_line()
+    return buffer.getvalue().strip()
 
-    xml_content = site_response.content
+# Top-level parts of a bill, outside its sections, that are kept as units of their own
+STANDALONE_TAGS = {"Identification", "Introduction", "Schedule"}
 
-    # Parse the XML content
-    tree_root = etree.fromstring(xml_content)
+# Function to stream the structure of a bill
+def iter_sections(source):
+    """
+    Streams a bill XML and yields one unit per top-level section (and per summary or schedule),
+    together with the Part, Division and subheading it falls under. Each unit is cleared once
+    yielded, so memory stays bounded by the largest single section.
+    :param source: A file path or binary file-like object holding the XML.
+    :return: Iterator of dictionaries with kind, label, marginal_note, part, division, heading and text.
+    """
+    headings = {1: None, 2: None, 3: None}  # Part, Division and subheading currently in effect
+    section_depth = 0
 
-    # Function to extract text recursively
-    def extract_text(trudeauing):
-        texts = []
-        if trudeauing.text:
-            texts.append(trudeauing.text.strip())
-        for child in trudeauing:
-            texts.append(extract_text(child))
-            if child.tail:
-                texts.append(child.tail.strip())
-        return " ".join(filter(None, texts))
+    for event, element in etree.iterparse(source, events=("start", "end")):
+        name = etree.QName(element).localname
+        if event == "start":
+            if name == "Section":
+                section_depth += 1
+            continue
 
-    # Extract the text from the root element
-    plain_text = extract_text(tree_root)
+        unit = None
+        if name == "Section":
+            section_depth -= 1
+            if section_depth == 0:
+                label = element.find("Label")
+                marginal_note = element.find("MarginalNote")
+                unit = {
+                    "kind": "section",
+                    "label": element_text(label) if label is not None else None,
+                    "marginal_note": element_text(marginal_note) if marginal_note is not None else None,
+                }
+        elif section_depth == 0 and name == "Heading":
+            # Headings inside sections belong to amended text, only bill-level ones set the context
+            level = min(int(element.get("level", "1") or 1), 3)
+            headings[level] = element_text(element)
+            for deeper in range(level + 1, 4):
+                headings[deeper] = None
+            element.clear(keep_tail=True)
+        elif section_depth == 0 and name in STANDALONE_TAGS:
+            unit = {"kind": name.lower(), "label": None, "marginal_note": None}
 
-    return plain_text
+        if unit is not None:
+            unit.update({"part": headings[1], "division": headings[2], "heading": headings[3], "text": element_text(element)})
+            element.clear(keep_tail=True)
+            parent = element.getparent()
+            if parent is not None:
+                while element.getprevious() is not None:
+                    del parent[0]
+            if unit["text"]:
+                yield unit
+
+# Function to write the structure of a bill as JSON lines
+def write_sections(source, output):
+    """
+    Writes every unit from iter_sections to the output as one JSON object per line.
+    :param source: A file path or binary file-like object holding the XML.
+    :param output: A text file-like object.
+    :return: Number of units written.
+    """
+    count = 0
+    for unit in iter_sections(source):
+        output.write(json.dumps(unit, ensure_ascii=False))
+        output.write("\n")
+        count += 1
+    return count
+
+# Function to hash a file
+def file_sha256(path):
+    """
+    :param path: Path of the file.
+    :return: Hex sha256 of the file, or None if it does not exist.
+    """
+    digest = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 16), b""):
+                digest.update(block)
+    except FileNotFoundError:
+        return None
+    return digest.hexdigest()
+
+# Function to convert fetched XML to plain text
+def convert_fetched(fetched, output_path):
+    """
+    Streams the fetched XML into a plain text file and a file of its sections (output name
+    with .sections.jsonl), then copies the XML next to them. Nothing is parsed when the copy
+    next to the outputs already has the fetched content, since the outputs came from it.
+    :param fetched: Result of BillFetcher.fetch.
+    :param output_path: Path of the text file to write.
+    :return: True if the text was written, False if it was already up to date.
+    """
+    base_path = os.path.splitext(output_path)[0]
+    xml_path = f"{base_path}.xml"
+    sections_path = f"{base_path}.sections.jsonl"
+
+    outputs_exist = os.path.exists(output_path) and os.path.exists(sections_path)
+    if outputs_exist and file_sha256(xml_path) == fetched["sha256"]:
+        return False
+
+    # Write to temporary files first so a failed run never leaves partial output
+    with open(f"{output_path}.tmp", "w", encoding="utf-8") as f:
+        stream_xml_to_text(fetched["path"], f)
+    with open(f"{sections_path}.tmp", "w", encoding="utf-8") as f:
+        write_sections(fetched["path"], f)
+    os.replace(f"{output_path}.tmp", output_path)
+    os.replace(f"{sections_path}.tmp", sections_path)
+    # The XML goes last so it only matches the fetched content once both outputs are written
+    shutil.copyfile(fetched["path"], f"{xml_path}.tmp")
+    os.replace(f"{xml_path}.tmp", xml_path)
+    return True
+
+# Function to download and convert XML to plain text
+def xml_to_text(url, output_path, fetcher=None):
+    """
+    Fetches the XML document at the given URL through the raw XML cache and converts it.
+    :param url: The URL of the bill XML.
+    :param output_path: Path of the text file to write.
+    :param fetcher: BillFetcher to use, a new one is created when not given.
+    :return: True if the text was written, False if the bill was unchanged.
+    """
+    fetcher = fetcher if fetcher is not None else BillFetcher()
+    return convert_fetched(fetcher.fetch(url), output_path)
+
+# Function to extract several bills in one run
+def extract_bills(bills, taillings_dir, fetcher=None):
+    """
+    Fetches every bill in parallel over one connection pool, then converts each bill that
+    changed to its own text file, carrying on past failures.
+    :param bills: Dictionary of output names to bill XML URLs.
+    :param taillings_dir: Directory the text files are written to.
+    :param fetcher: BillFetcher to use, a new one is created when not given.
+    :return: Dictionary of output names to the error raised, for the bills that failed.
+    """
+    fetcher = fetcher if fetcher is not None else BillFetcher()
+    fetched = fetcher.fetch_many(bills.values())
+    errors = {}
+    for name, bill_url in bills.items():
+        try:
+            result = fetched[bill_url]
+            if isinstance(result, Exception):
+                raise result
+            if convert_fetched(result, os.path.join(taillings_dir, f"{name}.txt")):
+                print(f"{name}: XML document downloaded and converted to plain text.")
+            else:
+                print(f"{name}: Unchanged (HTTP {result['status']}), nothing to convert.")
+        except Exception as e:
+            errors[name] = e
+            print(f"{name}: Error: {e}")
+    return errors
 
 # Main function to write the text to a file
 if __name__ == "__main__":
@@ -39,11 +280,16 @@ if __name__ == "__main__":
     taillings_dir = os.path.join(os.path.dirname(__file__), "taillings")
     os.makedirs(taillings_dir, exist_ok=True)
 
-    try:
-        plain_text = xml_to_text(url)
-        output_path = os.path.join(taillings_dir, "C-70_E.txt")
-        with open(output_path, "w", encoding="utf-8") as f:
-            f.write(plain_text)
-        print(f"XML document downloaded and converted to plain text. Check the taillings directory for the result.")
-    except Exception as e:
-        print(f"Error: {e}")
+    # Bills can be given on the command line as URLs or NAME=URL, otherwise the default list is used
+    if len(sys.argv) > 1:
+        bills = {}
+        for arg in sys.argv[1:]:
+            name, _, bill_url = arg.partition("=") if "=" in arg.split("://", 1)[0] else ("", "", arg)
+            bills[name or os.path.splitext(os.path.basename(bill_url))[0]] = bill_url
+    else:
+        bills = BILLS
+
+    errors = extract_bills(bills, taillings_dir)
+    print("Check the taillings directory for the result.")
+    if errors:
+        sys.exit(1)
@@ -0,0 +1,17 @@
+# gunicorn.conf.py
+import os
+import shutil
+
+# Every worker writes its metrics here so /metrics can add them up, whichever worker serves it.
+# The pipeline writes to the same directory when it is given the same PROMETHEUS_MULTIPROC_DIR.
+metrics_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'metrics_data'))
+
+# Function to start from empty metrics each time gunicorn starts
+def on_starting(server):
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+# Function to drop the live metrics of a worker that exited
+def child_exit(server, worker):
+    import metrics
+    metrics.mark_process_dead(worker.pid)
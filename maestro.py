@@ -2,16 +2,40 @@
 
 import sys
 import os
-import subprocess  # For running shell commands
-from datetime import datetime  # To handle dates and times
-from quants.tsionhehkwen import add_documents  # Function to add documents to the vector store
+import json  # For the chunk files and the pipeline state
+import hashlib  # For content hashes of stage inputs and outputs
+import threading  # For per-stage concurrency limits
+import time  # For stage timings
+from datetime import datetime, timezone  # To handle dates and times
+from concurrent.futures import ThreadPoolExecutor  # To run many bills at once
+from contextlib import contextmanager  # For the store write guard
+
+# With --json, stdout carries only the result: every module below logs to sys.stdout as it is
+# imported, so it is pointed at stderr before they are, and the result goes to the real stdout
+json_output = sys.stdout if __name__ == "__main__" and "--json" in sys.argv else None
+if json_output is not None:
+    sys.stdout = sys.stderr
+
+from quants.tsionhehkwen import split_into_chunks, sync_document_chunks, get_collection  # Functions to chunk and store documents in the vector store
+from quants import apollo  # AI analysis of the chunks of a bill
+from quants import generate_analysis_html  # Analysis pages
+from quants import vector_maintenance  # Snapshots and the store lock
+from extractors.chunker import read_sections, pack_sections  # Structure-aware chunking of bills
+from extractors.fetcher import BillFetcher  # Conditional, pooled downloads of bill XML
+from extractors.xml2text import convert_fetched  # Bill XML to text and sections
+from bills import BillRegistry, REGISTRY_PATH  # The bills the pipeline tracks
+import metrics  # Pipeline stage timings for /metrics
 from loguru import logger  # For logging events and errors
 from dotenv import load_dotenv  # To load environment variables from a .env file
 
 # Constants
-TEXT_FILE_PATH = "extractors/taillings/C-70_E.txt"  # Path to the text file used for analysis
-MAX_FILE_AGE_DAYS = 30  # Maximum age of the text file before it's considered outdated
-CHUNK_SIZE = 2000  # Size of the chunks to split the document into for vector storage
+TAILLINGS_DIR = "extractors/taillings"  # Directory the files of every bill are written to
+STATE_FILE = os.path.join(TAILLINGS_DIR, "pipeline_state.json")  # Input and output hashes of every stage of every bill
+CHUNK_SIZE = 2000  # Size of the chunks to split the document into when its sections are not available
+CHUNK_TOKENS = 1500  # Token budget of a chunk packed from whole sections
+CHUNK_OVERLAP_TOKENS = 0  # Tokens of context repeated from the previous chunk
+SNAPSHOT_BEFORE_INGEST = True  # Snapshot the vector store before the first ingest of a run
+STAGES = ("extract", "chunk", "ingest", "analyze", "render")  # Stages each bill goes through, in order
 
 # Add the root directory to the Python path to ensure modules are found
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
@@ -33,73 +57,398 @@ logger.add(sys.stdout, level=log_level)  # Add a new logger that outputs to the
 logger.info("Begin maestro")  # Log the start of the script
 logger.debug("Debug mode on")  # Log that debug mode is enabled if applicable
 
-# Function to execute the xml2text.py script
-def run_extractor():
+# Number of bills worked on at once, and how many bills may be in each stage at the same time.
+# Ingestion writes to the vector store, which takes one writer at a time, and each analysis
+# already runs many assistant calls in parallel, so those stages are kept narrow.
+PIPELINE_WORKERS = int(os.getenv('PIPELINE_WORKERS', '4'))
+STAGE_CONCURRENCY = {
+    "extract": int(os.getenv('PIPELINE_EXTRACT_CONCURRENCY', '4')),
+    "chunk": int(os.getenv('PIPELINE_CHUNK_CONCURRENCY', '4')),
+    "ingest": 1,
+    "analyze": int(os.getenv('PIPELINE_ANALYZE_CONCURRENCY', '2')),
+    "render": int(os.getenv('PIPELINE_RENDER_CONCURRENCY', '4')),
+}
+stage_slots = {stage: threading.BoundedSemaphore(max(1, limit)) for stage, limit in STAGE_CONCURRENCY.items()}
+
+# Function to get the paths of the files a bill goes through
+def bill_paths(name):
     """
-    Runs the xml2text.py script to extract data and convert it into a text format.
+    :param name: The bill name, e.g. C-70_E
+    :return: Dictionary of the XML, text, sections, chunks, analysis and page paths of the bill
     """
-    try:
-        result = subprocess.run(["python3", "extractors/xml2text.py"], capture_output=True, text=True)
-        if result.returncode != 0:
-            logger.error(f"Error in xml2text.py: {result.stderr}")  # Log an error if the script fails
-        else:
-            logger.info(result.stdout)  # Log the output of the script if successful
-    except Exception as e:
-        logger.error(f"Failed to run xml2text.py: {e}")  # Log any exceptions that occur during execution
+    base = os.path.join(TAILLINGS_DIR, name)
+    return {
+        "xml": f"{base}.xml",
+        "text": f"{base}.txt",
+        "sections": f"{base}.sections.jsonl",
+        "chunks": f"{base}.chunks.jsonl",
+        "analysis": f"{base}_analysis.jsonl",
+        "page": os.path.join(generate_analysis_html.static_pages_dir, f"{name}_analysis.html"),
+    }
+
+# Function to hash the content of some files
+def content_hash(paths, extra=""):
+    """
+    :param paths: Paths of the files to hash; a missing file hashes as missing.
+    :param extra: Settings that also affect the stage, such as the chunk budget.
+    :return: Hex digest of the files and settings.
+    """
+    digest = hashlib.sha256(extra.encode("utf-8"))
+    for path in paths:
+        digest.update(b"\0")
+        try:
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 16), b""):
+                    digest.update(block)
+        except FileNotFoundError:
+            digest.update(b"missing")
+    return digest.hexdigest()
+
+# Function to write a JSON file so readers never see it half written
+def write_json_atomically(path, data):
+    """
+    :param path: Path of the file to write.
+    :param data: The data to write.
+    """
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    os.replace(f"{path}.tmp", path)
+
+# Class holding what every stage of a pipeline run shares
+class PipelineContext:
+    """
+    One HTTP session for every download, one vector store collection for every read and
+    write, and one logger, shared by all the bills of a run. The stages run in this process,
+    so the persistent store is only ever opened once.
+    """
+    def __init__(self, fetcher=None, collection=None):
+        self.fetcher = fetcher if fetcher is not None else BillFetcher()
+        self._collection = collection
+        self.logger = logger
+        # Only the persistent store is snapshotted and locked, not a collection passed in
+        self.owns_store = collection is None
+        self.snapshot = None
+        self._snapshot_lock = threading.Lock()
+
+    @property
+    def collection(self):
+        # Opened on first use, so a run where every ingestion and analysis is fresh never loads chromadb
+        if self._collection is None:
+            self._collection = get_collection()
+        return self._collection
+
+    @contextmanager
+    def store_write(self):
+        """
+        Guards a write to the persistent store: the first write of a run is preceded by a
+        snapshot, so a bad ingest can be rolled back, and every write holds the store lock.
+        """
+        if not self.owns_store:
+            yield
+            return
+        with self._snapshot_lock:
+            if self.snapshot is None and SNAPSHOT_BEFORE_INGEST and os.path.exists(vector_maintenance.vector_store_directory):
+                self.snapshot = vector_maintenance.take_snapshot("pre-ingest")
+        with vector_maintenance.store_lock():
+            yield
+
+    def close(self):
+        self.fetcher.close()
+
+# Function to download a bill and convert it into a text format
+def extract_bill(bill, context):
+    """
+    Fetches the bill XML, which costs a 304 when it has not changed, and converts it to text
+    and sections when it has.
+    :param bill: The bill from the registry.
+    :param context: The PipelineContext.
+    :return: Dictionary with the HTTP status and whether the text was rewritten.
+    """
+    fetched = context.fetcher.fetch(bill['url'])
+    converted = convert_fetched(fetched, bill_paths(bill['name'])["text"])
+    return {"status": fetched["status"], "converted": converted}
+
+# Function to split a bill into chunks and save them
+def chunk_bill(bill, context):
+    """
+    Splits the bill into chunks and writes them, with their metadata, to the chunks file.
+    When xml2text wrote the sections of the bill, chunks are packed from whole sections
+    within a token budget and carry the sections they cover as metadata; otherwise the
+    plain text is split by size.
+    :param bill: The bill from the registry.
+    :param context: The PipelineContext.
+    :return: Dictionary with the number of chunks.
+    """
+    paths = bill_paths(bill['name'])
+    if os.path.exists(paths["sections"]):
+        chunks, metadatas = pack_sections(read_sections(paths["sections"]), CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS)
+    else:
+        with open(paths["text"], "r", encoding="utf-8") as f:
+            chunks = split_into_chunks(f.read(), CHUNK_SIZE)
+        metadatas = [{}] * len(chunks)
+
+    with open(f"{paths['chunks']}.tmp", "w", encoding="utf-8") as f:
+        for chunk, metadata in zip(chunks, metadatas):
+            f.write(json.dumps({"text": chunk, "metadata": metadata}, ensure_ascii=False))
+            f.write("\n")
+    os.replace(f"{paths['chunks']}.tmp", paths["chunks"])
+    context.logger.info(f"{bill['name']}: {len(chunks)} chunks")
+    return {"chunks": len(chunks)}
+
+# Function to add the chunks of a bill to the vector store
+def ingest_bill(bill, context):
+    """
+    Chunks are identified by a hash of their content, so only chunks that changed since the
+    last run are embedded and chunks that no longer exist are removed.
+    :param bill: The bill from the registry.
+    :param context: The PipelineContext.
+    :return: Summary of the chunks added, moved, removed and unchanged.
+    """
+    chunks = []
+    metadatas = []
+    with open(bill_paths(bill['name'])["chunks"], "r", encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            chunks.append(record["text"])
+            metadatas.append(record["metadata"])
+    with context.store_write():
+        return sync_document_chunks(bill['name'], chunks, context.collection, metadatas)  # Embed and store only what changed
 
-# Function to execute the apollo.py script
-def run_analysis():
+# Function to perform AI analysis on the chunks of a bill
+def analyze_bill(bill, context):
     """
-    Runs the apollo.py script to perform AI analysis on the extracted data.
+    :param bill: The bill from the registry.
+    :param context: The PipelineContext.
+    :return: Dictionary with the number of chunks, resumed chunks, cache hits, misses and errors.
+    """
+    summary = apollo.analyze_chunks_from_vector_store(bill['name'], target_collection=context.collection)
+    return {key: value for key, value in summary.items() if key != "path"}
+
+# Function to build the analysis page of a bill
+def render_bill(bill, context):
+    """
+    :param bill: The bill from the registry.
+    :param context: The PipelineContext.
+    :return: Dictionary with the path of the page.
+    :raises RuntimeError: If the analysis could not be read.
+    """
+    page = generate_analysis_html.generate_analysis_html(bill_paths(bill['name'])["analysis"], bill['name'])
+    if page is None:
+        raise RuntimeError("The analysis could not be read")
+    return {"page": page}
+
+# Function to identify the copy of the vector store the pipeline writes to
+def store_identity():
+    """
+    Changes when the store is replaced as a whole, by a snapshot restore or by a git pull that
+    overwrites the tracked store files, but not when chunks are written to it, a collection is
+    rebuilt or the file is vacuumed. Chunks missing from a replaced store are then synced again.
+    :return: The device and inode of the store's SQLite file, or "missing".
     """
     try:
-        result = subprocess.run(["python3", "quants/apollo.py"], capture_output=True, text=True)
-        if result.returncode != 0:
-            logger.error(f"Error in apollo.py: {result.stderr}")  # Log an error if the script fails
-        else:
-            logger.info(result.stdout)  # Log the output of the script if successful
-    except Exception as e:
-        logger.error(f"Failed to run apollo.py: {e}")  # Log any exceptions that occur during execution
+        stat = os.stat(os.path.join(vector_maintenance.vector_store_directory, vector_maintenance.SQLITE_NAME))
+    except FileNotFoundError:
+        return "missing"
+    return f"{stat.st_dev}:{stat.st_ino}"
 
-# Function to check if the text file is valid (i.e., exists and is not too old)
-def is_text_file_valid(file_path, max_age_days=30):
+# Function to describe the stages of a bill
+def stage_plan(bill):
     """
-    Checks whether the specified text file exists and is within the allowed age limit.
-    :param file_path: Path to the file to check
-    :param max_age_days: Maximum allowed age of the file in days
-    :return: True if the file exists and is within the allowed age, False otherwise
+    Lists each stage with the function that runs it, the files and settings it depends on,
+    and the files it produces. A stage is fresh when the hash of its inputs matches the one
+    recorded on its last successful run and its outputs exist. Extraction depends on the
+    remote source, so it always runs, and the stages after it only run when what it wrote changed.
+    Ingestion and analysis read and write the vector store, so they also depend on which copy
+    of the store is in place.
+    :param bill: The bill from the registry.
+    :return: List of (stage, function, input paths, settings, output paths).
     """
-    if os.path.exists(file_path):  # Check if the file exists
-        file_age_days = (datetime.now() - datetime.fromtimestamp(os.path.getmtime(file_path))).days
-        return file_age_days < max_age_days  # Return True if the file is not too old
-    return False  # Return False if the file does not exist
+    paths = bill_paths(bill['name'])
+    store = store_identity()
+    return [
+        ("extract", extract_bill, None, bill['url'], [paths["xml"], paths["text"]]),
+        ("chunk", chunk_bill, [paths["sections"], paths["text"]], f"{CHUNK_TOKENS}:{CHUNK_OVERLAP_TOKENS}:{CHUNK_SIZE}", [paths["chunks"]]),
+        ("ingest", ingest_bill, [paths["chunks"]], store, []),
+        ("analyze", analyze_bill, [paths["chunks"]], f"{os.getenv('id_KEIKO', '')}:{store}", [paths["analysis"]]),
+        ("render", render_bill, [paths["analysis"], "quants/templates/analysis_page.html", "static/dist/manifest.json"], "", [paths["page"]]),
+    ]
 
-# Function to add the document to the vector store
-def add_to_vector_store(file_path, chunk_size=2000):
+# Class tracking the hashes and outcome of every stage of every bill
+class PipelineState:
     """
-    Adds the content of the specified text file to the vector store after splitting it into chunks.
-    :param file_path: Path to the text file to add
-    :param chunk_size: Size of each chunk to split the document into
+    Pipeline state shared by the bill workers, saved after every stage so an interrupted
+    run picks up where it stopped.
     """
-    logger.debug("Begin function add_to_vector_store")
-    with open(file_path, "r", encoding="utf-8") as f:
-        document = f.read()  # Read the entire document into memory
-    logger.info("Split the document into chunks")
+    def __init__(self, path=STATE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self.bills = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.bills = {}
+
+    def get(self, name, stage):
+        with self._lock:
+            return self.bills.get(name, {}).get(stage)
+
+    def record(self, name, stage, **fields):
+        with self._lock:
+            fields["finished_at"] = datetime.now(timezone.utc).isoformat()
+            self.bills.setdefault(name, {})[stage] = fields
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            write_json_atomically(self.path, self.bills)
+
+# Class holding the outcome of a pipeline run
+class PipelineResult:
+    """
+    Outcome of every stage of every bill in a run. Each stage is a dictionary with its
+    status ("ran", "incomplete", "fresh", "failed" or "blocked"), the seconds it took, the
+    error when it failed, and the details the stage returned, such as the chunks added or
+    the cache hits. An incomplete stage ran but reported errors for some of its items, such
+    as chunks the assistant failed on; the stages after it still run.
+    """
+    def __init__(self):
+        self.bills = {}
+        self.seconds = 0.0
+
+    def add(self, name, stages):
+        self.bills[name] = stages
+
+    def statuses(self, name):
+        """
+        :param name: The bill name.
+        :return: Dictionary of stage to status for the bill.
+        """
+        return {stage: outcome["status"] for stage, outcome in self.bills[name].items()}
 
-    # Split the document into chunks of specified size
-    chunks = [document[i:i + chunk_size] for i in range(0, len(document), chunk_size)]
-    ids = [f"C-70_E_{i+1}" for i in range(len(chunks))]  # Generate unique IDs for each chunk
+    def failed(self):
+        """
+        :return: Dictionary of the bills that failed to the stage that failed and its error.
+        """
+        return {
+            name: (stage, outcome["error"])
+            for name, stages in self.bills.items()
+            for stage, outcome in stages.items() if outcome["status"] == "failed"
+        }
 
-    logger.debug(f"Chunking document into {len(chunks)} chunks.")
-    add_documents(chunks, ids=ids)  # Add the chunks to the vector store with their corresponding IDs
+    def stage_seconds(self):
+        """
+        :return: Dictionary of stage to the total seconds spent in it across every bill.
+        """
+        totals = dict.fromkeys(STAGES, 0.0)
+        for stages in self.bills.values():
+            for stage, outcome in stages.items():
+                totals[stage] += outcome["seconds"]
+        return totals
+
+    def to_dict(self):
+        return {"seconds": self.seconds, "stage_seconds": self.stage_seconds(), "bills": self.bills}
+
+# Function to take one bill through every stage
+def run_bill(bill, state, context, force=False):
+    """
+    Runs the stages of a bill in order, skipping fresh stages. A failed stage stops this bill
+    only; its later stages are reported as blocked and tried again on the next run. A stage
+    whose details count errors is recorded as incomplete, never fresh, so the next run picks
+    up the items that failed.
+    :param bill: The bill from the registry.
+    :param state: The PipelineState.
+    :param context: The PipelineContext.
+    :param force: Run every stage even if it is fresh.
+    :return: Dictionary of stage to its outcome, as described in PipelineResult.
+    """
+    name = bill['name']
+    outcomes = {}
+    failed = False
+    for stage, run, inputs, settings, outputs in stage_plan(bill):
+        if failed:
+            outcomes[stage] = {"status": "blocked", "seconds": 0.0, "error": None, "detail": None}
+            continue
+
+        input_hash = content_hash(inputs or [], settings)
+        record = state.get(name, stage)
+        fresh = (
+            inputs is not None and not force and record is not None
+            and record.get("status") == "ok" and record.get("input") == input_hash
+            and all(os.path.exists(path) for path in outputs)
+        )
+        if fresh:
+            outcomes[stage] = {"status": "fresh", "seconds": 0.0, "error": None, "detail": None}
+            continue
+
+        with stage_slots[stage]:
+            started = time.perf_counter()
+            try:
+                context.logger.info(f"{name}: {stage}")
+                detail = run(bill, context)
+            except Exception as e:
+                seconds = time.perf_counter() - started
+                context.logger.error(f"{name}: {stage} failed after {seconds:.2f}s: {e}")
+                state.record(name, stage, status="failed", input=input_hash, error=str(e))
+                outcomes[stage] = {"status": "failed", "seconds": seconds, "error": str(e), "detail": None}
+                metrics.PIPELINE_STAGE_SECONDS.labels(stage=stage, status="failed").observe(seconds)
+                failed = True
+                continue
+            seconds = time.perf_counter() - started
+        errors = detail.get("errors", 0) if isinstance(detail, dict) else 0
+        status = "incomplete" if errors else "ok"
+        metrics.PIPELINE_STAGE_SECONDS.labels(stage=stage, status=status).observe(seconds)
+        state.record(name, stage, status=status, input=input_hash, output=content_hash(outputs), seconds=round(seconds, 3))
+        outcomes[stage] = {"status": "incomplete" if errors else "ran", "seconds": seconds, "error": None, "detail": detail}
+        if errors:
+            context.logger.warning(f"{name}: {stage} took {seconds:.2f}s with {errors} errors; it runs again next time")
+        else:
+            context.logger.info(f"{name}: {stage} took {seconds:.2f}s")
+    return outcomes
+
+# Function to take many bills through the pipeline at once
+def run_pipeline(bills, max_workers=PIPELINE_WORKERS, force=False, state_path=STATE_FILE, context=None):
+    """
+    Runs the pipeline for many bills concurrently in this process, each bill on its own
+    worker and each stage limited by STAGE_CONCURRENCY.
+    :param bills: List of bills from the registry.
+    :param max_workers: Number of bills worked on at once.
+    :param force: Run every stage even if it is fresh.
+    :param state_path: Path of the pipeline state file.
+    :param context: PipelineContext to share, a new one is created (and closed) when not given.
+    :return: A PipelineResult.
+    """
+    os.makedirs(TAILLINGS_DIR, exist_ok=True)
+    state = PipelineState(state_path)
+    own_context = context is None
+    context = context if context is not None else PipelineContext()
+    result = PipelineResult()
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            futures = {bill['name']: executor.submit(run_bill, bill, state, context, force) for bill in bills}
+            for name, future in futures.items():
+                result.add(name, future.result())
+    finally:
+        if own_context:
+            context.close()
+    result.seconds = time.perf_counter() - started
+
+    for name in result.bills:
+        logger.info(f"{name}: {result.statuses(name)}")
+    logger.info(f"Pipeline took {result.seconds:.2f}s; per stage: "
+                + ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in result.stage_seconds().items()))
+    return result
 
 # Main function that orchestrates the workflow
 if __name__ == "__main__":
-    # Check if the text file is valid (exists and is not too old)
-    if not is_text_file_valid(TEXT_FILE_PATH, MAX_FILE_AGE_DAYS):
-        run_extractor()  # Extract data if the file is not valid
-        add_to_vector_store(TEXT_FILE_PATH, CHUNK_SIZE)  # Add the extracted data to the vector store
-    else:
-        logger.info("C-70_E.txt is valid. No need to download and parse.")
+    # Bill names can be given on the command line, otherwise every active bill in the registry is run
+    registry = BillRegistry.load(os.getenv('BILL_REGISTRY_PATH', REGISTRY_PATH))
+    names = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    unknown = [name for name in names if registry.get(name) is None]
+    if unknown:
+        logger.error(f"Bills not in the registry: {', '.join(unknown)}")
+        sys.exit(2)
+    selected = [registry.get(name) for name in names] or registry.active()
 
-    run_analysis()  # Run AI analysis regardless of whether the text file was updated
+    result = run_pipeline(selected, force="--force" in sys.argv)
+    if "--json" in sys.argv:
+        print(json.dumps(result.to_dict(), indent=2, default=str), file=json_output)
+    if result.failed():
+        sys.exit(1)
@@ -0,0 +1,112 @@
+# metrics.py
+import os
+import time
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+# Load environment variables from the .env file; PROMETHEUS_MULTIPROC_DIR has to be set before
+# prometheus_client is imported for the values to be shared between processes
+env_path = os.getenv('HOME') + "/web/ElectionClockEnvironment/.env"
+load_dotenv(dotenv_path=env_path)
+
+MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+if MULTIPROC_DIR:
+    os.makedirs(MULTIPROC_DIR, exist_ok=True)
+
+try:
+    from prometheus_client import Counter, Histogram, CollectorRegistry, REGISTRY, CONTENT_TYPE_LATEST, generate_latest
+    from prometheus_client import multiprocess
+except ImportError:  # prometheus_client is optional; without it every metric is a no-op
+    Counter = Histogram = None
+    CONTENT_TYPE_LATEST = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Buckets, in seconds, for fast in-process work and for calls that go over the network
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SLOW_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+STAGE_BUCKETS = (0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0, 1800.0, 3600.0)
+
+# Stand-in for a metric when prometheus_client is not installed
+class _NoopMetric:
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, value):
+        pass
+
+    def inc(self, amount=1):
+        pass
+
+# Function to create a metric, or a no-op when prometheus_client is not installed
+def _metric(kind, name, documentation, labelnames, **kwargs):
+    if kind is None:
+        return _NoopMetric()
+    return kind(name, documentation, labelnames, **kwargs)
+
+HTTP_REQUEST_SECONDS = _metric(
+    Histogram, 'electionclock_http_request_duration_seconds',
+    'Time to handle a request, by route template', ('route', 'method', 'status'), buckets=FAST_BUCKETS)
+VECTOR_STORE_SECONDS = _metric(
+    Histogram, 'electionclock_vector_store_operation_duration_seconds',
+    'Time spent in vector store calls, including embedding queries', ('operation',), buckets=FAST_BUCKETS)
+OPENAI_REQUEST_SECONDS = _metric(
+    Histogram, 'electionclock_openai_request_duration_seconds',
+    'Time of each OpenAI API call, retries included', ('operation',), buckets=SLOW_BUCKETS)
+OPENAI_RUN_SECONDS = _metric(
+    Histogram, 'electionclock_openai_run_duration_seconds',
+    'Time from creating an assistant run to its end, by final status', ('status',), buckets=SLOW_BUCKETS)
+OPENAI_TOKENS = _metric(
+    Counter, 'electionclock_openai_tokens',
+    'Tokens used, by kind (prompt, completion, or estimated for embeddings)', ('kind',))
+CACHE_REQUESTS = _metric(
+    Counter, 'electionclock_cache_requests',
+    'Cache lookups by cache and result (hit or miss)', ('cache', 'result'))
+PIPELINE_STAGE_SECONDS = _metric(
+    Histogram, 'electionclock_pipeline_stage_duration_seconds',
+    'Time each pipeline stage took for a bill, by outcome', ('stage', 'status'), buckets=STAGE_BUCKETS)
+
+# Function to time a block of code into a histogram
+@contextmanager
+def timed(histogram, **labels):
+    """
+    :param histogram: One of the histograms above.
+    :param labels: Label values for the observation.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        (histogram.labels(**labels) if labels else histogram).observe(time.perf_counter() - started)
+
+# Function to count a cache lookup
+def count_cache(cache, hit, count=1):
+    """
+    :param cache: Name of the cache.
+    :param hit: Whether the lookups were hits.
+    :param count: Number of lookups, for caches that look up many keys at once.
+    """
+    if count:
+        CACHE_REQUESTS.labels(cache=cache, result='hit' if hit else 'miss').inc(count)
+
+# Function to render every metric in the Prometheus text format
+def render():
+    """
+    Collects the metrics of this process, or, when PROMETHEUS_MULTIPROC_DIR is set, of every
+    process that wrote to that directory: all gunicorn workers and the pipeline runs.
+    :return: Tuple of (body, content type).
+    """
+    if Counter is None:
+        return b'# prometheus_client is not installed\n', CONTENT_TYPE_LATEST
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+# Function to clean up after a gunicorn worker exits
+def mark_process_dead(pid):
+    """
+    :param pid: The PID of the worker that exited.
+    """
+    if Counter is not None and MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid)
@@ -0,0 +1,113 @@
+# pages.py
+import os
+import gzip
+import time
+import hashlib
+import logging
+import threading
+from flask import render_template
+import assets
+
+# Class holding one pre-rendered page in every encoding it is served in
+class Page:
+    def __init__(self, body):
+        etag = hashlib.sha1(body).hexdigest()
+        self.variants = {'identity': (body, etag)}
+        self.variants['gzip'] = (gzip.compress(body, compresslevel=9, mtime=0), f"{etag}-gzip")
+        if assets.brotli is not None:
+            self.variants['br'] = (assets.brotli.compress(body, quality=11), f"{etag}-br")
+
+    def variant(self, accept_encodings):
+        """
+        :param accept_encodings: The request's Accept-Encoding header as parsed by Werkzeug.
+        :return: Tuple of (encoding, body, etag) for the best encoding the client accepts.
+        """
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and encoding in accept_encodings:
+                return (encoding,) + self.variants[encoding]
+        return ('identity',) + self.variants['identity']
+
+# Templates served as pages, by page name; other templates, such as partials, are never public
+TEMPLATE_PAGES = {'countdown': 'countdown.html'}
+
+# Directory the analysis page generator writes to, outside the Jinja search path
+GENERATED_PAGES_DIRNAME = 'static_pages'
+GENERATED_PAGE_SUFFIX = '_analysis.html'
+
+# Class mapping page names to pre-rendered pages
+class PageRegistry:
+    """
+    Renders the pages in TEMPLATE_PAGES once, loads the pages written by the analysis page
+    generator as they are, and keeps the bytes, their gzip and brotli variants and ETags in
+    memory, so serving a page is a dictionary lookup. Generated pages are never run through
+    Jinja: they hold model output, which must not be evaluated as template code. The
+    generated pages live in static_pages, outside the Jinja search path. That directory is
+    checked at most every refresh_interval seconds and the registry is rebuilt when it
+    changed, which picks up new generated pages.
+    """
+    def __init__(self, app, refresh_interval=5.0):
+        self.app = app
+        self.pages_dir = os.path.join(app.root_path, GENERATED_PAGES_DIRNAME)
+        self.refresh_interval = refresh_interval
+        self.pages = {}
+        self._signature = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _directory_signature(self):
+        entries = []
+        if not os.path.isdir(self.pages_dir):
+            return ()
+        with os.scandir(self.pages_dir) as it:
+            for entry in it:
+                if entry.name.endswith(GENERATED_PAGE_SUFFIX):
+                    stat = entry.stat()
+                    entries.append((entry.name, stat.st_mtime_ns, stat.st_size))
+        return tuple(sorted(entries))
+
+    def build(self):
+        """
+        Renders the template pages and reads the generated pages.
+        """
+        signature = self._directory_signature()
+        pages = {}
+        # Flask only reloads changed templates in debug mode, so drop compiled ones before re-rendering
+        if self.app.jinja_env.cache is not None:
+            self.app.jinja_env.cache.clear()
+        with self.app.test_request_context():
+            for page_name, template in TEMPLATE_PAGES.items():
+                try:
+                    pages[page_name] = Page(render_template(template).encode('utf-8'))
+                except Exception as e:
+                    logging.warning(f"Could not render page {template}: {e}")
+        for name, _, _ in signature:
+            try:
+                with open(os.path.join(self.pages_dir, name), 'rb') as f:
+                    pages[name[:-len('.html')]] = Page(f.read())
+            except OSError as e:
+                logging.warning(f"Could not read page {name}: {e}")
+        self.pages = pages
+        self._signature = signature
+        logging.info(f"Page registry built with {len(pages)} pages")
+
+    def refresh_if_changed(self):
+        """
+        Rebuilds the registry when the generated pages changed since the last build.
+        """
+        now = time.monotonic()
+        if self._signature is not None and now - self._checked_at < self.refresh_interval:
+            return
+        with self._lock:
+            if self._signature is not None and now - self._checked_at < self.refresh_interval:
+                return
+            self._checked_at = now
+            if self._directory_signature() != self._signature:
+                self.build()
+
+    def get(self, page_name):
+        """
+        :param page_name: The page name without the .html extension.
+        :return: The Page, or None if there is no such page.
+        """
+        self.refresh_if_changed()
+        return self.pages.get(page_name)
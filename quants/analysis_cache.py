@@ -0,0 +1,155 @@
+# quants/analysis_cache.py
+
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from loguru import logger
+import metrics
+
+# Default location of the cache database
+cache_path = "quants/analysis_cache.sqlite3"
+
+# Class to store assistant analyses keyed by the content that produced them
+class AnalysisCache:
+    """
+    Persistent, content-addressed cache of chunk analyses backed by SQLite.
+    Entries are keyed by a hash of the chunk text, the assistant ID and the prompt template,
+    so any change to one of them is a miss. Safe to share between threads.
+    """
+    def __init__(self, path=cache_path, max_age_days=None, max_bytes=None):
+        """
+        :param path: Path to the SQLite database file.
+        :param max_age_days: Entries older than this are evicted (optional).
+        :param max_bytes: Least recently used entries are evicted once the cache holds more than this (optional).
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_age_days = max_age_days
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS analyses (
+                key TEXT PRIMARY KEY,
+                result TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS analyses_last_used ON analyses (last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(chunk, assistant_id, prompt_template):
+        """
+        Builds the cache key for a chunk.
+        :param chunk: The chunk text.
+        :param assistant_id: The ID of the assistant doing the analysis.
+        :param prompt_template: The prompt template the chunk is sent with.
+        :return: A hex SHA-256 digest.
+        """
+        digest = hashlib.sha256()
+        for part in (assistant_id, prompt_template, chunk):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def get(self, key):
+        """
+        Looks up a cached analysis and counts the hit or miss.
+        :param key: Key from make_key.
+        :return: The decoded analysis, or None on a miss.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT result, created_at FROM analyses WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.max_age_days is not None and row[1] < time.time() - self.max_age_days * 86400:
+                self._conn.execute("DELETE FROM analyses WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                hit = False
+            else:
+                self.hits += 1
+                hit = True
+                self._conn.execute("UPDATE analyses SET last_used = ? WHERE key = ?", (time.time(), key))
+                self._conn.commit()
+        metrics.count_cache("analysis", hit)
+        return json.loads(row[0]) if hit else None
+
+    def put(self, key, result, encoder=None):
+        """
+        Stores an analysis.
+        :param key: Key from make_key.
+        :param result: The analysis, anything json.dumps can encode with the given encoder.
+        :param encoder: Optional JSONEncoder class for SDK objects.
+        """
+        payload = json.dumps(result, cls=encoder)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO analyses (key, result, size, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, payload, len(payload), now, now)
+            )
+            self._conn.commit()
+
+    def discard(self, key):
+        """
+        Removes an entry the caller found unusable, such as an analysis that is not valid JSON.
+        The lookup that returned it is counted as a miss instead of a hit.
+        :param key: Key from make_key.
+        """
+        with self._lock:
+            if self._conn.execute("DELETE FROM analyses WHERE key = ?", (key,)).rowcount:
+                self.hits -= 1
+                self.misses += 1
+            self._conn.commit()
+
+    def evict(self):
+        """
+        Removes entries older than max_age_days, then the least recently used entries
+        until the cache is under max_bytes.
+        :return: Number of entries removed.
+        """
+        removed = 0
+        with self._lock:
+            if self.max_age_days is not None:
+                cutoff = time.time() - self.max_age_days * 86400
+                removed += self._conn.execute("DELETE FROM analyses WHERE created_at < ?", (cutoff,)).rowcount
+            if self.max_bytes is not None:
+                total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM analyses").fetchone()[0]
+                if total > self.max_bytes:
+                    stale = []
+                    for key, size in self._conn.execute("SELECT key, size FROM analyses ORDER BY last_used"):
+                        if total <= self.max_bytes:
+                            break
+                        stale.append((key,))
+                        total -= size
+                    self._conn.executemany("DELETE FROM analyses WHERE key = ?", stale)
+                    removed += len(stale)
+            self._conn.commit()
+        if removed:
+            logger.info(f"Evicted {removed} entries from the analysis cache")
+        return removed
+
+    def stats(self):
+        """
+        :return: Dictionary with hit and miss counts for this run and the number of stored entries.
+        """
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM analyses").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": size}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
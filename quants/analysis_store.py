@@ -0,0 +1,166 @@
+# quants/analysis_store.py
+
+import os
+import json
+import tempfile
+import threading
+from loguru import logger
+
+# Class to keep the analysis of a bill as one JSON line per chunk, written as each chunk completes
+class AnalysisStore:
+    """
+    Append-only JSONL file of chunk analyses. Every completed chunk is appended and flushed
+    at once, so an interrupted run loses at most the chunk being written, and the next run
+    only analyzes chunks that have no record for their current content. A record is
+    {"chunk": n, "key": ..., "analysis": {...}}, or "error" in place of "analysis" when the
+    chunk failed; "text" holds the reply when it was not valid JSON. Safe to share between threads.
+    """
+    def __init__(self, path):
+        """
+        :param path: Path of the JSONL file; created if missing.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._latest = {}  # Chunk number to (offset, key, completed) of its latest record
+        self._file = open(path, "a+b")
+        self._scan()
+
+    def _scan(self):
+        """
+        Indexes the records already in the file and cuts off a last line left half written by a crash.
+        """
+        self._file.seek(0)
+        offset = 0
+        end = 0
+        for line in self._file:
+            if not line.endswith(b"\n"):
+                break
+            end = offset + len(line)
+            try:
+                record = json.loads(line)
+                self._latest[record["chunk"]] = (offset, record.get("key"), "analysis" in record)
+            except (ValueError, KeyError, TypeError):
+                logger.warning(f"Skipping an unreadable line at byte {offset} of {self.path}")
+            offset = end
+        if self._file.tell() != end:
+            logger.warning(f"Truncating a partly written record at the end of {self.path}")
+            self._file.truncate(end)
+        self._file.seek(0, os.SEEK_END)
+
+    def completed(self, chunk, key):
+        """
+        :param chunk: Chunk number, starting at 1.
+        :param key: Key of the chunk's current content, from AnalysisCache.make_key.
+        :return: True if the chunk already has an analysis for that content.
+        """
+        with self._lock:
+            latest = self._latest.get(chunk)
+        return latest is not None and latest[1] == key and latest[2]
+
+    def append(self, chunk, key, result):
+        """
+        Normalizes an assistant result and appends it.
+        :param chunk: Chunk number, starting at 1.
+        :param key: Key of the chunk's content.
+        :param result: What apollo got back for the chunk: message content or an error dict.
+        :return: The record written.
+        """
+        record = {"chunk": chunk, "key": key, **normalize_result(result)}
+        line = (json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+        with self._lock:
+            offset = self._file.seek(0, os.SEEK_END)
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._latest[chunk] = (offset, key, "analysis" in record)
+        return record
+
+    def compact(self, keys):
+        """
+        Rewrites the file in chunk order with only the latest record of each current chunk,
+        dropping records for content that has changed or chunks that no longer exist. The new
+        file replaces the old one atomically.
+        :param keys: Keys of the document's current chunks, in order.
+        :return: Dictionary with the number of analyses, errors and missing chunks.
+        """
+        counts = {"analyses": 0, "errors": 0, "missing": 0}
+        with self._lock:
+            self._file.flush()
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or ".", prefix=".tmp-")
+            latest = {}
+            try:
+                with os.fdopen(fd, "wb") as out:
+                    for chunk, key in enumerate(keys, 1):
+                        found = self._latest.get(chunk)
+                        if found is None or found[1] != key:
+                            counts["missing"] += 1
+                            continue
+                        self._file.seek(found[0])
+                        line = self._file.readline()
+                        latest[chunk] = (out.tell(), key, found[2])
+                        out.write(line)
+                        counts["analyses" if found[2] else "errors"] += 1
+                    out.flush()
+                    os.fsync(out.fileno())
+                os.chmod(temp_path, 0o644)
+                os.replace(temp_path, self.path)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+            self._file.close()
+            self._file = open(self.path, "a+b")
+            self._latest = latest
+        return counts
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+# Function to pull the reply text out of the message content the assistant returned
+def message_text(content):
+    """
+    :param content: Message content as SDK objects, or as the dictionaries the analysis cache holds.
+    :return: The text of the first content block, or None if there is none.
+    """
+    if isinstance(content, list):
+        content = content[0] if content else None
+    if isinstance(content, str) or content is None:
+        return content
+    text = content.get("text") if isinstance(content, dict) else getattr(content, "text", None)
+    if isinstance(text, dict):
+        return text.get("value")
+    return getattr(text, "value", text)
+
+# Function to turn an assistant result into the fields of a store record
+def normalize_result(result):
+    """
+    :param result: Message content, or a dict with an "error" key.
+    :return: {"analysis": parsed reply}, or {"error": ...} with the raw "text" when the reply was not JSON.
+    """
+    if isinstance(result, dict) and "error" in result:
+        return {"error": str(result["error"])}
+    text = message_text(result)
+    if text is None:
+        return {"error": "No text in the assistant reply"}
+    try:
+        return {"analysis": json.loads(text)}
+    except json.JSONDecodeError as e:
+        return {"error": f"Reply is not valid JSON: {e}", "text": text}
+
+# Function to read the records of an analysis file one at a time
+def iter_records(path):
+    """
+    Streams the file line by line, so readers never hold more than one record. Lines that
+    cannot be decoded, such as one cut short by a crash, are skipped.
+    :param path: Path of the JSONL file.
+    :return: Generator of record dictionaries, in file order.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Skipping unreadable line {number} of {path}")
@@ -3,14 +3,20 @@ import os
 import sys
 import time
 import json
+import random
+import pathlib
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from loguru import logger
 
 # Add the root directory to the Python path for module imports
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
-# Import the function to search documents from the vector store
-from quants.tsionhehkwen import search_documents
+# Import the function to fetch document chunks from the vector store
+from quants.tsionhehkwen import get_document_chunks
+from quants.analysis_cache import AnalysisCache
+from quants.analysis_store import AnalysisStore, normalize_result
+import metrics
 
 # Load environment variables from the .env file
 env_path = os.getenv('HOME') + "/web/ElectionClockEnvironment/.env"
@@ -30,42 +36,144 @@ logger.debug("Debug mode on")
 asst_keiko = os.getenv("id_KEIKO")
 openai.api_key = os.getenv("keyOPENAI")
 
-# Ensure critical API configuration is available
-if not asst_keiko or not openai.api_key:
-    logger.error("API key or Assistant ID not found. Please check your environment variables.")
-    sys.exit("Missing critical API configuration.")
+# Function to ensure critical API configuration is available
+def check_api_configuration():
+    """
+    Checked when an analysis starts rather than at import, so the module can be imported
+    by maestro without the keys being set.
+    :raises RuntimeError: If the API key or assistant ID is missing.
+    """
+    if not asst_keiko or not openai.api_key:
+        logger.error("API key or Assistant ID not found. Please check your environment variables.")
+        raise RuntimeError("Missing critical API configuration.")
+
+# Point the client at another endpoint, such as a local stub server, when OPENAI_BASE_URL is set
+if os.getenv("OPENAI_BASE_URL"):
+    openai.base_url = os.getenv("OPENAI_BASE_URL")
+
+# Rate limits are retried by call_with_backoff, so the client should not retry on its own
+openai.max_retries = 0
+
+# Concurrency and retry settings for the analysis runs
+MAX_CONCURRENT_RUNS = int(os.getenv("ANALYSIS_CONCURRENCY", "8"))  # Number of assistant runs in flight at once
+RUN_TIMEOUT = float(os.getenv("ANALYSIS_RUN_TIMEOUT", "300"))  # Seconds a run may take before it is cancelled
+MAX_RATE_LIMIT_RETRIES = 6  # Attempts made on a 429 before giving up on a call
+BACKOFF_BASE = 2.0  # Seconds to wait after the first 429, doubled on each retry
+BACKOFF_MAX = 60.0  # Upper bound on a single backoff wait
+
+# Batch mode settings; "threads" runs each chunk on its own assistant thread, "batch" sends every chunk in one Batch API job
+ANALYSIS_MODE = os.getenv("ANALYSIS_MODE", "threads")
+BATCH_POLL_MIN = float(os.getenv("ANALYSIS_BATCH_POLL_MIN", "10"))  # Seconds before the first batch status check
+BATCH_POLL_MAX = float(os.getenv("ANALYSIS_BATCH_POLL_MAX", "600"))  # Upper bound on the wait between checks
+BATCH_TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+# Prompt each chunk is sent with; part of the analysis cache key
+PROMPT_TEMPLATE = "Analyze this section:\n\n{chunk}"
+
+# Analysis cache settings
+ANALYSIS_CACHE_PATH = os.getenv("ANALYSIS_CACHE_PATH", "quants/analysis_cache.sqlite3")
+ANALYSIS_CACHE_MAX_AGE_DAYS = float(os.getenv("ANALYSIS_CACHE_MAX_AGE_DAYS", "180"))  # Re-analyze anything older than this
+ANALYSIS_CACHE_MAX_MB = float(os.getenv("ANALYSIS_CACHE_MAX_MB", "256"))  # Evict least recently used entries past this size
+
+# Function to call the OpenAI API and back off when rate limited
+def call_with_backoff(func, *args, **kwargs):
+    """
+    Calls an OpenAI API function, retrying with exponential backoff and jitter on 429 responses.
+    A Retry-After header from the server is honoured when present.
+    :param func: The API function to call.
+    :return: Whatever the API function returns.
+    """
+    # Timed as one call, so the histogram shows what a caller waits including backoff
+    with metrics.timed(metrics.OPENAI_REQUEST_SECONDS, operation=getattr(func, "__name__", "call")):
+        for attempt in range(MAX_RATE_LIMIT_RETRIES):
+            try:
+                return func(*args, **kwargs)
+            except openai.RateLimitError as e:
+                if attempt == MAX_RATE_LIMIT_RETRIES - 1:
+                    raise
+                retry_after = e.response.headers.get("retry-after") if e.response is not None else None
+                try:
+                    delay = float(retry_after)
+                except (TypeError, ValueError):
+                    delay = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt))
+                    delay = delay / 2 + random.uniform(0, delay / 2)
+                logger.warning(f"Rate limited, retrying in {delay:.1f}s (attempt {attempt + 1} of {MAX_RATE_LIMIT_RETRIES})")
+                time.sleep(delay)
+
+# Function to cancel a run that will not be waited for, so it stops using tokens
+def cancel_run(run):
+    """
+    :param run: The run, from its thread.run.created event.
+    """
+    try:
+        call_with_backoff(openai.beta.threads.runs.cancel, run_id=run.id, thread_id=run.thread_id)
+        logger.warning(f"Cancelled run {run.id}")
+    except Exception as e:
+        logger.warning(f"Could not cancel run {run.id}: {e}")
 
 # Function to analyze a chunk of text using OpenAI's API
-def analyze_chunk_in_thread(chunk, assistant_id=asst_keiko):
+def analyze_chunk_in_thread(chunk, assistant_id=asst_keiko, timeout=RUN_TIMEOUT):
     """
-    Sends a chunk of text to the OpenAI API for analysis in a thread.
+    Sends a chunk of text to the OpenAI API for analysis in a thread. The run is read as a
+    stream of server-sent events, so the reply is returned the moment the run completes,
+    without polling. A run that takes longer than the timeout, or whose stream breaks, is cancelled.
     :param chunk: The text chunk to be analyzed.
     :param assistant_id: The ID of the AI assistant used for analysis.
+    :param timeout: Seconds the run may take, also the longest wait for any one event.
     :return: The analysis result as a string or an error message.
     """
+    run_started = time.perf_counter()
+    deadline = time.monotonic() + timeout
+    status = "error"
+    run = None
+    message = None
     try:
-        # Create and run a new thread for the analysis
-        run = openai.beta.threads.create_and_run(
+        # Create and run a new thread for the analysis, streaming its events
+        stream = call_with_backoff(
+            openai.beta.threads.create_and_run,
             assistant_id=assistant_id,
-            thread={"messages": [{"role": "user", "content": f"Analyze this section:\n\n{chunk}"}]}
+            thread={"messages": [{"role": "user", "content": PROMPT_TEMPLATE.format(chunk=chunk)}]},
+            stream=True,
+            timeout=timeout
         )
-        # Poll the status until the analysis is complete
-        while True:
-            status = openai.beta.threads.runs.retrieve(run_id=run.id, thread_id=run.thread_id).status
-            if status == "completed":
-                break
-            elif status in ["failed", "cancelled"]:
-                raise Exception(f"Run failed or was cancelled. Status: {status}")
-            time.sleep(10)
-
-        # Retrieve and return the first message from the analysis response
-        response = openai.beta.threads.messages.list(run_id=run.id, thread_id=run.thread_id)
-        if response.data:
-            return response.data[0].content
+        with stream:
+            for event in stream:
+                if event.event == "thread.run.created":
+                    run = event.data
+                elif event.event == "thread.message.completed":
+                    message = event.data
+                elif event.event == "thread.run.completed":
+                    status = "completed"
+                    usage = event.data.usage
+                    if usage is not None:
+                        metrics.OPENAI_TOKENS.labels(kind="prompt").inc(usage.prompt_tokens or 0)
+                        metrics.OPENAI_TOKENS.labels(kind="completion").inc(usage.completion_tokens or 0)
+                elif event.event in ("thread.run.failed", "thread.run.cancelled", "thread.run.expired", "thread.run.incomplete"):
+                    status = event.data.status
+                    raise Exception(f"Run failed or was cancelled. Status: {status}")
+                elif event.event == "thread.run.requires_action":
+                    raise Exception("Run requires a tool call, which the analysis does not support")
+                elif event.event == "error":
+                    raise Exception(f"Run stream error: {event.data}")
+                if status != "completed" and time.monotonic() > deadline:
+                    raise TimeoutError(f"Run took longer than {timeout:.0f}s")
+        if status != "completed":
+            raise Exception("Run stream ended before the run completed")
+
+        # The completed assistant message is the analysis
+        if message is not None and message.content:
+            return message.content
         return {"error": "No response found"}
     except Exception as e:
+        # A read that times out mid-stream is raised by the HTTP transport, so the deadline decides
+        if isinstance(e, (TimeoutError, openai.APITimeoutError)) or time.monotonic() > deadline:
+            status = "timeout"
+        if run is not None and status in ("error", "timeout"):
+            cancel_run(run)
         logger.error(f"Thread Analysis Failed: {e}")
         return {"error": str(e)}
+    finally:
+        metrics.OPENAI_RUN_SECONDS.labels(status=status).observe(time.perf_counter() - run_started)
 
 # Custom JSON encoder to handle complex objects
 class CustomEncoder(json.JSONEncoder):
@@ -74,42 +182,309 @@ class CustomEncoder(json.JSONEncoder):
             return obj.__dict__  # Serialize objects by their dictionary representation
         return json.JSONEncoder.default(self, obj)
 
+# Function to look a chunk up in the analysis cache
+def cached_analysis(cache, key):
+    """
+    Entries that do not hold a usable analysis, such as a reply that is not valid JSON, are
+    removed and treated as a miss so the chunk is analyzed again.
+    :param cache: An AnalysisCache, or None.
+    :param key: The chunk's cache key.
+    :return: The cached result, or None.
+    """
+    if cache is None:
+        return None
+    result = cache.get(key)
+    if result is not None and "analysis" not in normalize_result(result):
+        logger.warning(f"Discarding cached result {key[:12]} that is not a valid analysis")
+        cache.discard(key)
+        result = None
+    return result
+
+# Function to cache a result only when it is a usable analysis
+def cache_analysis(cache, key, result, encoder=None):
+    """
+    Errors and replies that are not valid JSON are never cached, so they get retried next run.
+    :param cache: An AnalysisCache, or None.
+    :param key: The chunk's cache key.
+    :param result: The result of the chunk.
+    :param encoder: Optional JSONEncoder class for SDK objects.
+    """
+    if cache is not None and "analysis" in normalize_result(result):
+        cache.put(key, result, encoder=encoder)
+
+# Function to analyze many chunks with a bounded number of runs in flight
+def analyze_chunks_concurrently(chunks, max_workers=MAX_CONCURRENT_RUNS, cache=None, assistant_id=asst_keiko, on_result=None):
+    """
+    Analyzes chunks in parallel on a thread pool. Results come back in chunk order
+    regardless of which run finishes first. When a cache is given it is checked first
+    and only the misses are sent to the API.
+    :param chunks: List of text chunks to analyze.
+    :param max_workers: Maximum number of assistant runs in flight at once.
+    :param cache: An AnalysisCache to read from and write to (optional).
+    :param assistant_id: The ID of the AI assistant used for analysis.
+    :param on_result: Called with the index and result of each chunk as soon as it is known (optional).
+    :return: List of analysis results, one per chunk, in the same order as the chunks.
+    """
+    total = len(chunks)
+    results = [None] * total
+    keys = [None] * total
+    pending = []
+
+    for i, chunk in enumerate(chunks):
+        if cache is not None:
+            keys[i] = AnalysisCache.make_key(chunk, assistant_id, PROMPT_TEMPLATE)
+            results[i] = cached_analysis(cache, keys[i])
+        if results[i] is None:
+            pending.append(i)
+        elif on_result is not None:
+            on_result(i, results[i])
+
+    def analyze(i):
+        logger.debug(f"Processing chunk {i + 1} of {total}")
+        result = analyze_chunk_in_thread(chunks[i], assistant_id=assistant_id)
+        cache_analysis(cache, keys[i], result, encoder=CustomEncoder)
+        if on_result is not None:
+            on_result(i, result)
+        logger.debug(f"Completed processing chunk {i + 1}")
+        return result
+
+    if pending:
+        logger.info(f"Sending {len(pending)} of {total} chunks to the assistant")
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            # executor.map yields results in submission order
+            for i, result in zip(pending, executor.map(analyze, pending)):
+                results[i] = result
+    return results
+
+# Function to build the chat completion that stands in for an assistant run in a batch
+def batch_request_body(chunk, assistant):
+    """
+    The Batch API does not take Assistants runs, so each chunk becomes a chat completion
+    with the assistant's model, instructions and sampling settings.
+    :param chunk: The text chunk to be analyzed.
+    :param assistant: The assistant, as returned by the API.
+    :return: The request body.
+    """
+    messages = [{"role": "user", "content": PROMPT_TEMPLATE.format(chunk=chunk)}]
+    if assistant.instructions:
+        messages.insert(0, {"role": "system", "content": assistant.instructions})
+    body = {"model": assistant.model, "messages": messages}
+    for setting in ("temperature", "top_p"):
+        if getattr(assistant, setting, None) is not None:
+            body[setting] = getattr(assistant, setting)
+    response_format = getattr(assistant, "response_format", None)
+    if hasattr(response_format, "model_dump"):
+        body["response_format"] = response_format.model_dump(exclude_none=True)
+    return body
+
+# Function to write the input file of a batch job
+def write_batch_requests(path, chunks, numbers, assistant):
+    """
+    :param path: Path of the JSONL file to write.
+    :param chunks: The text chunks to analyze.
+    :param numbers: The chunk number of each chunk, used as its custom_id.
+    :param assistant: The assistant, as returned by the API.
+    :return: Number of requests written.
+    """
+    with open(path, "w", encoding="utf-8") as f:
+        for number, chunk in zip(numbers, chunks):
+            request = {
+                "custom_id": f"chunk-{number}",
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": batch_request_body(chunk, assistant)
+            }
+            f.write(json.dumps(request, ensure_ascii=False) + "\n")
+    return len(chunks)
+
+# Function to wait for a batch job to end, checking less often the longer it runs
+def wait_for_batch(batch_id, poll_min=BATCH_POLL_MIN, poll_max=BATCH_POLL_MAX):
+    """
+    :param batch_id: The ID of the batch job.
+    :param poll_min: Seconds before the second check; later waits double, from at least 2 seconds.
+    :param poll_max: Upper bound on the wait between checks.
+    :return: The batch in its final state.
+    """
+    delay = poll_min
+    while True:
+        batch = call_with_backoff(openai.batches.retrieve, batch_id)
+        if batch.status in BATCH_TERMINAL_STATUSES:
+            return batch
+        counts = batch.request_counts
+        if counts is not None:
+            logger.info(f"Batch {batch_id} {batch.status}: {counts.completed} of {counts.total} done, {counts.failed} failed")
+        time.sleep(delay)
+        # Doubled from at least a second, so a poll_min of 0 (as in the benchmarks) never polls in a tight loop
+        delay = min(poll_max, max(delay, 1.0) * 2)
+
+# Function to stream the lines of a batch output or error file
+def iter_batch_file(file_id):
+    """
+    :param file_id: The ID of the file.
+    :return: Generator of the decoded lines, read from the response as they arrive.
+    """
+    with openai.files.with_streaming_response.content(file_id) as response:
+        for line in response.iter_lines():
+            if line.strip():
+                yield json.loads(line)
+
+# Function to turn one line of a batch output file into a chunk result
+def batch_line_result(line):
+    """
+    :param line: A decoded line of the batch output or error file.
+    :return: Tuple of the chunk number and the reply text, or a dict with an "error" key.
+    """
+    number = int(line["custom_id"].split("-", 1)[1])
+    response = line.get("response") or {}
+    if line.get("error") or response.get("status_code") != 200:
+        error = line.get("error") or response.get("body", {}).get("error") or f"HTTP {response.get('status_code')}"
+        return number, {"error": error.get("message", str(error)) if isinstance(error, dict) else str(error)}
+    body = response["body"]
+    usage = body.get("usage") or {}
+    metrics.OPENAI_TOKENS.labels(kind="prompt").inc(usage.get("prompt_tokens") or 0)
+    metrics.OPENAI_TOKENS.labels(kind="completion").inc(usage.get("completion_tokens") or 0)
+    return number, body["choices"][0]["message"]["content"]
+
+# Function to analyze chunks with a single Batch API job
+def analyze_chunks_in_batch(chunks, numbers, keys, store, cache=None, assistant_id=asst_keiko):
+    """
+    Sends every chunk that is not in the cache as one batch job, waits for it and streams
+    the results into the store. The job is recorded next to the store, so a run that stops
+    while waiting picks the same job up again instead of paying for a second one.
+    :param chunks: The text chunks to analyze.
+    :param numbers: The chunk number of each chunk.
+    :param keys: The analysis cache key of each chunk.
+    :param store: The AnalysisStore results are appended to.
+    :param cache: An AnalysisCache to read from and write to (optional).
+    :param assistant_id: The ID of the AI assistant whose settings the requests use.
+    :raises RuntimeError: If the job did not complete; the results it did return are kept.
+    """
+    pending = {}
+    for chunk, number, key in zip(chunks, numbers, keys):
+        cached = cached_analysis(cache, key)
+        if cached is not None:
+            store.append(number, key, cached)
+        else:
+            pending[number] = (chunk, key)
+    if not pending:
+        return
+
+    base = os.path.splitext(store.path)[0]
+    job_path = f"{base}.batch.json"
+    requested = {str(number): key for number, (_, key) in pending.items()}
+    try:
+        with open(job_path, "r", encoding="utf-8") as f:
+            job = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        job = None
+
+    # A recorded job covering every pending chunk is still worth waiting for, even if some of its results were already read
+    if job is not None and all(job["chunks"].get(number) == key for number, key in requested.items()):
+        logger.info(f"Resuming batch {job['batch_id']} for {len(pending)} chunks")
+    else:
+        assistant = call_with_backoff(openai.beta.assistants.retrieve, assistant_id)
+        requests_path = f"{base}.batch.jsonl"
+        write_batch_requests(requests_path, [chunk for chunk, _ in pending.values()], list(pending), assistant)
+        input_file = call_with_backoff(openai.files.create, file=pathlib.Path(requests_path), purpose="batch")
+        batch = call_with_backoff(
+            openai.batches.create,
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+            metadata={"document": os.path.basename(base)}
+        )
+        job = {"batch_id": batch.id, "chunks": requested}
+        with open(job_path, "w", encoding="utf-8") as f:
+            json.dump(job, f)
+        logger.info(f"Submitted batch {batch.id} with {len(pending)} chunks")
+
+    batch = wait_for_batch(job["batch_id"])
+    received = 0
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        for line in iter_batch_file(file_id):
+            number, result = batch_line_result(line)
+            if number not in pending:
+                continue
+            key = pending[number][1]
+            store.append(number, key, result)
+            cache_analysis(cache, key, result)
+            received += 1
+    os.remove(job_path)
+
+    logger.info(f"Batch {batch.id} {batch.status}: {received} of {len(pending)} results received")
+    if batch.status != "completed":
+        raise RuntimeError(f"Batch {batch.id} ended with status {batch.status}")
+
 # Function to analyze chunks of text retrieved from the vector store
-def analyze_chunks_from_vector_store():
+def analyze_chunks_from_vector_store(doc_id="C-70_E", target_collection=None, mode=ANALYSIS_MODE):
     """
-    Retrieves each chunk of the document from the vector store and sends it
-    to the OpenAI API for analysis. The results are saved to a JSON file.
+    Retrieves each chunk of the document from the vector store and sends it to the OpenAI
+    API for analysis. Each analysis is appended to the document's AnalysisStore as soon as it
+    completes, and chunks already in the store for their current content are skipped, so an
+    interrupted run picks up where it stopped.
+    :param doc_id: The document ID of the bill in the vector store.
+    :param target_collection: Collection to read, defaults to the main document collection.
+    :param mode: "threads" to run each chunk on its own assistant thread, "batch" for one Batch API job.
+    :return: Dictionary with the output path and the number of chunks, resumed chunks, cache hits, misses and errors.
     """
-    # Search for the document chunks in the vector store
-    results = search_documents("C-70_E", n_results=100)
+    check_api_configuration()
+
+    # Fetch every chunk of the document, in document order
+    results = get_document_chunks(doc_id, target_collection=target_collection)
     if not results["documents"]:
         raise ValueError("No chunks found for the document in the vector store")
 
-    logger.info(f"Total chunks to process: {len(results['documents'])}")
-    output = {}
+    chunks = results['documents']
+    keys = [AnalysisCache.make_key(chunk, asst_keiko, PROMPT_TEMPLATE) for chunk in chunks]
 
-    # Analyze each chunk and store the results
-    for i, (chunk, _) in enumerate(results['documents'], 1):
-        logger.debug(f"Processing chunk {i} of {len(results['documents'])}")
-        result = analyze_chunk_in_thread(chunk)
-        output[f"Analysis of Chunk {i}"] = {"text": result}
-        logger.debug(f"Completed processing chunk {i}")
+    output_directory = "extractors/taillings/"  # Directory to save the output file
+    output_file_path = os.path.join(output_directory, f"{doc_id}_analysis.jsonl")
+    store = AnalysisStore(output_file_path)
 
-    # Serialize the output using the custom encoder and save it to a file
-    output_string = json.dumps(output, indent=2, cls=CustomEncoder)
-    logger.info("Output as a single string for inspection:")
-    logger.info(output_string)
+    # Only chunks without an analysis of their current text are sent on
+    todo = [i for i in range(len(chunks)) if not store.completed(i + 1, keys[i])]
+    logger.info(f"Total chunks: {len(chunks)}, {len(chunks) - len(todo)} already analyzed, {len(todo)} to process")
 
-    output_directory = "extractors/taillings/"  # Directory to save the output file
-    output_file_path = os.path.join(output_directory, "C-70_E_analysis.json")
+    # Previously analyzed chunks are served from the cache, only new or changed ones hit the API
+    cache = AnalysisCache(
+        ANALYSIS_CACHE_PATH,
+        max_age_days=ANALYSIS_CACHE_MAX_AGE_DAYS,
+        max_bytes=int(ANALYSIS_CACHE_MAX_MB * 1024 * 1024)
+    )
 
     try:
-        with open(output_file_path, "w", encoding="utf-8") as f:
-            f.write(output_string)  # Write the output to a file
-        logger.info("Analysis complete and saved to file.")
-    except Exception as e:
-        logger.error(f"Failed to write output to file: {e}")
+        # Each result is written to the store the moment it is known
+        if mode == "batch":
+            analyze_chunks_in_batch([chunks[i] for i in todo], [i + 1 for i in todo], [keys[i] for i in todo], store, cache=cache)
+        else:
+            analyze_chunks_concurrently(
+                [chunks[i] for i in todo],
+                cache=cache,
+                on_result=lambda j, result: store.append(todo[j] + 1, keys[todo[j]], result)
+            )
+        counts = store.compact(keys)
+    finally:
+        store.close()
+
+    cache.evict()
+    stats = cache.stats()
+    logger.info(f"Analysis cache: {stats['hits']} hits, {stats['misses']} misses, {stats['entries']} entries stored")
+    cache.close()
+
+    logger.info(f"Analysis saved to {output_file_path}: {counts['analyses']} analyses, {counts['errors']} errors")
+    return {
+        "path": output_file_path, "chunks": len(chunks), "resumed": len(chunks) - len(todo),
+        "hits": stats["hits"], "misses": stats["misses"], "errors": counts["errors"]
+    }
 
 # Main function to start the analysis process
 if __name__ == "__main__":
-    analyze_chunks_from_vector_store()
+    # The bill can be given on the command line, otherwise C-70_E is analyzed; --batch sends it as one Batch API job
+    try:
+        check_api_configuration()
+    except RuntimeError as e:
+        sys.exit(str(e))
+    names = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    analyze_chunks_from_vector_store(names[0] if names else "C-70_E", mode="batch" if "--batch" in sys.argv else ANALYSIS_MODE)
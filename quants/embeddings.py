@@ -0,0 +1,183 @@
+# quants/embeddings.py
+
+import os
+import hashlib
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from loguru import logger
+from chromadb.api.types import EmbeddingFunction
+import metrics
+
+# Default location of the embedding cache database
+cache_path = "quants/embedding_cache.sqlite3"
+
+# Request limits for OpenAI's embedding endpoint, with some headroom
+MAX_BATCH_TOKENS = 200000  # Estimated tokens sent in a single request
+MAX_BATCH_SIZE = 1024  # Inputs sent in a single request
+MAX_INPUT_TOKENS = 8191  # Longest single input the embedding models accept
+SQLITE_MAX_VARIABLES = 500  # Keys looked up per cache query
+
+# Function to estimate the token count of a text without a tokenizer
+def estimate_tokens(text):
+    """
+    Estimates tokens on the high side (one token per three bytes) so batches stay under the limit.
+    :param text: The text to measure.
+    :return: Estimated number of tokens.
+    """
+    return len(text.encode("utf-8")) // 3 + 1
+
+# Function to group texts into batches that fit within a request
+def make_batches(texts, max_batch_tokens=MAX_BATCH_TOKENS, max_batch_size=MAX_BATCH_SIZE):
+    """
+    Groups texts into batches bounded by estimated tokens and number of inputs.
+    :param texts: List of texts to batch.
+    :return: List of batches, each a list of texts.
+    """
+    batches = []
+    current = []
+    current_tokens = 0
+    for text in texts:
+        tokens = estimate_tokens(text)
+        if tokens > MAX_INPUT_TOKENS:
+            logger.warning(f"Text of about {tokens} tokens exceeds the {MAX_INPUT_TOKENS} token input limit")
+        if current and (current_tokens + tokens > max_batch_tokens or len(current) >= max_batch_size):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(text)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+# Class to wrap an embedding function with batching and a persistent cache
+class CachedEmbeddingFunction(EmbeddingFunction):
+    """
+    Embedding function for Chroma collections that batches requests by token budget,
+    runs the batches concurrently and keeps every vector in an on-disk cache keyed by
+    model and text hash. Text that was embedded before, in any collection, costs no API call.
+    """
+    def __init__(self, embedding_function, model_name, path=cache_path,
+                 max_batch_tokens=MAX_BATCH_TOKENS, max_batch_size=MAX_BATCH_SIZE, max_workers=4):
+        """
+        :param embedding_function: The embedding function that calls the API.
+        :param model_name: Name of the embedding model, part of the cache key.
+        :param path: Path to the SQLite cache file.
+        :param max_batch_tokens: Estimated token budget per request.
+        :param max_batch_size: Maximum number of inputs per request.
+        :param max_workers: Number of requests in flight at once.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.embedding_function = embedding_function
+        self.model_name = model_name
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.max_workers = max_workers
+        self.hits = 0
+        self.misses = 0
+        self.api_calls = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+        self._conn.commit()
+
+    def key(self, text):
+        """
+        :return: Cache key for a text under this model.
+        """
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def _load(self, keys):
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), SQLITE_MAX_VARIABLES):
+                batch = keys[start:start + SQLITE_MAX_VARIABLES]
+                placeholders = ",".join("?" * len(batch))
+                for key, blob in self._conn.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch):
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def _store(self, items):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in items]
+            )
+            self._conn.commit()
+
+    def _embed_batch(self, batch):
+        with metrics.timed(metrics.OPENAI_REQUEST_SECONDS, operation="embeddings"):
+            vectors = self.embedding_function(batch)
+        metrics.OPENAI_TOKENS.labels(kind="embedding_estimated").inc(sum(estimate_tokens(text) for text in batch))
+        with self._lock:
+            self.api_calls += 1
+        return vectors
+
+    def __call__(self, input):
+        """
+        Embeds a list of texts, serving what it can from the cache.
+        :param input: List of texts.
+        :return: List of embedding vectors in the same order as the texts.
+        """
+        keys = [self.key(text) for text in input]
+        vectors = self._load(list(set(keys)))
+
+        # Embed each missing text once, even if it appears several times in the input
+        missing = {}
+        for key, text in zip(keys, input):
+            if key not in vectors:
+                missing.setdefault(key, text)
+        hits = len(keys) - sum(1 for key in keys if key in missing)
+        with self._lock:
+            self.hits += hits
+            self.misses += len(missing)
+        metrics.count_cache("embeddings", True, hits)
+        metrics.count_cache("embeddings", False, len(missing))
+
+        if missing:
+            batches = make_batches(list(missing.values()), self.max_batch_tokens, self.max_batch_size)
+            logger.debug(f"Embedding {len(missing)} texts in {len(batches)} batches")
+            with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(batches)))) as executor:
+                embedded = [vector for batch_vectors in executor.map(self._embed_batch, batches) for vector in batch_vectors]
+            new_items = list(zip(missing.keys(), embedded))
+            self._store(new_items)
+            for key, vector in new_items:
+                vectors[key] = np.asarray(vector, dtype=np.float32)
+
+        return [vectors[key] for key in keys]
+
+    # Chroma persists the name and config of a collection's embedding function and checks them when
+    # the collection is opened again; the config is that of the wrapped OpenAI function
+    @staticmethod
+    def name():
+        return "electionclock-cached-openai"
+
+    def get_config(self):
+        return self.embedding_function.get_config()
+
+    def default_space(self):
+        return self.embedding_function.default_space()
+
+    def supported_spaces(self):
+        return self.embedding_function.supported_spaces()
+
+    @staticmethod
+    def build_from_config(config):
+        """
+        Rebuilds the function from the config Chroma stored with a collection.
+        :param config: The config of the wrapped OpenAI function.
+        :return: A CachedEmbeddingFunction around a new OpenAI function.
+        """
+        from chromadb.utils.embedding_functions import OpenAIEmbeddingFunction
+        return CachedEmbeddingFunction(OpenAIEmbeddingFunction.build_from_config(config), model_name=config["model_name"])
+
+    def stats(self):
+        """
+        :return: Dictionary with cache hits, misses and API calls since startup.
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "api_calls": self.api_calls}
@@ -1,8 +1,13 @@
 import os
-import json
 import sys
+import json
+import gzip
+import hashlib
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from loguru import logger
 from dotenv import load_dotenv
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache, select_autoescape
 
 # Load environment variables from the .env file
 env_path = os.getenv('HOME') + "/web/ElectionClockEnvironment/.env"
@@ -19,174 +24,208 @@ logger.info("Begin apollo")
 logger.debug("Debug mode on")
 
 # Directory paths for input and output files
-project_root = os.path.dirname(os.path.dirname(__file__))
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 taillings_dir = os.path.join(project_root, "extractors/taillings")
-html_output_dir = os.path.join(project_root, "templates")
+# Generated pages hold model output, so they are kept out of Flask's templates directory and never parsed by Jinja
+static_pages_dir = os.path.join(project_root, "static_pages")  # Pages and their precompressed copies, served by nginx and the page registry
+page_template_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+page_template_name = "analysis_page.html"
+state_file = os.path.join(taillings_dir, "analysis_html_state.json")  # Input hashes of the last generated pages
 
-# Function to generate an HTML file from the AI analysis JSON
-def generate_analysis_html(analysis_file, bill_name):
+sys.path.append(project_root)
+import assets
+from quants.analysis_store import iter_records
+
+# Jinja environment for this process, built on first use so each pool worker compiles the template once
+_environment = {}
+
+# Function to get the compiled page template
+def get_page_template():
     """
-    Generates an HTML file based on AI analysis results stored in a JSON file.
-    :param analysis_file: Path to the JSON file containing the analysis results.
-    :param bill_name: The name of the bill or document being analyzed.
+    :return: The compiled analysis page template for this process.
+    """
+    if "template" not in _environment:
+        environment = Environment(
+            loader=FileSystemLoader(page_template_dir),
+            autoescape=select_autoescape(["html"]),
+            # With no directory Jinja uses a per-user temp directory it creates with mode 0700
+            bytecode_cache=FileSystemBytecodeCache(),
+            trim_blocks=True,
+            lstrip_blocks=True
+        )
+        manifest = assets.load_manifest()
+        environment.globals["static_url"] = lambda filename: assets.static_url(manifest, filename)
+        environment.globals["responsive_background"] = \
+            lambda selector, filename: assets.responsive_background(manifest, selector, filename)
+        _environment["template"] = environment.get_template(page_template_name)
+    return _environment["template"]
+
+# Function to sort the analysis results into the sections of the page
+def parse_analysis(records):
+    """
+    Pulls Keiko's analysis, the collective and individual scores and the philosopher
+    perspectives out of the analysis records. Records without an analysis are skipped.
+    :param records: Iterable of AnalysisStore records, in chunk order.
+    :return: Tuple of the three lists.
     """
     listKeikoAnalysis = []
     listCollIndi = []
     listPhilo = []
 
-    try:
-        with open(analysis_file, "r", encoding="utf-8") as file:
-            analysis_content = json.load(file)  # Load the JSON data from the file
-
-        # Process each analysis result
-        for key, value in analysis_content.items():
-            if isinstance(value['text'], list):
-                logger.debug("Matched a list in the analysis results")
-                json_data_str = value['text'][0]['text']['value']
-                try:
-                    # Parse the string value to actual JSON
-                    json_data = json.loads(json_data_str)
-                except json.JSONDecodeError as e:
-                    logger.error(f"Failed to decode JSON from 'value': {e}")
-                    continue
-
-                analysis = json_data.get('Analysis', {})
-                for topic, details in analysis.items():
-                    if topic in ["Individual_Heart_Analysis", "Borg_Collective_Analysis"]:
-                        logger.debug(f"Processing {topic}")
-                        listCollIndi.append({
-                            'Topic': topic,
-                            'Score': details.get('Score'),
-                            'Explanation': details.get('Explanation')
-                        })
-                    else:
-                        logger.debug(f"Adding topic to listKeikoAnalysis: {topic}")
-                        listKeikoAnalysis.append({topic: details})
-
-                # Extract Philosopher Perspectives
-                philosopher_perspectives = json_data.get('Philosopher_Perspectives', [])
-                for perspective in philosopher_perspectives:
-                    philosopher = perspective.get('Philosopher')
-                    perspective_text = perspective.get('Perspective')
-                    listPhilo.append(
-                        {
-                            'Philosopher': philosopher,
-                            'Perspective': perspective_text
-                        }
-                    )
-    except Exception as e:
-        logger.error(f"Error reading or processing analysis file: {e}")
-        return
-
-    # Create HTML content using the processed data
-    html_content = f"""
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1">
-        <link rel="icon" type="image/x-icon" href="/static/favicon.ico">
-        <title>{bill_name} AI Analysis</title>
-        <link rel="stylesheet" href="/static/styles.css">
-    </head>
-    <body>
-        <div class="countdown-container">
-            <h2 class="countdown-text">Until the Next Canadian Federal Election:</h2>
-            <div id="countdown-timer"></div>
-        </div>
-        <div class="analysis-content">
-            <h2>{bill_name} Analysis</h2>
-            {generate_html_for_keiko_analysis(listKeikoAnalysis)}
-            {generate_html_for_coll_indi(listCollIndi)}
-            {generate_html_for_coll_phil(listPhilo)}
-        </div>
-        <script>
-            // Countdown timer script
-        </script>
-    </body>
-    </html>
+    # Process each analysis result
+    for record in records:
+        json_data = record.get('analysis')
+        if not isinstance(json_data, dict):
+            logger.debug(f"No analysis for chunk {record.get('chunk')}: {record.get('error')}")
+            continue
+
+        analysis = json_data.get('Analysis', {})
+        for topic, details in analysis.items():
+            if topic in ["Individual_Heart_Analysis", "Borg_Collective_Analysis"]:
+                listCollIndi.append({
+                    'Topic': topic,
+                    'Score': details.get('Score'),
+                    'Explanation': details.get('Explanation')
+                })
+            else:
+                listKeikoAnalysis.append({topic: details})
+
+        # Extract Philosopher Perspectives
+        for perspective in json_data.get('Philosopher_Perspectives', []):
+            listPhilo.append({
+                'Philosopher': perspective.get('Philosopher'),
+                'Perspective': perspective.get('Perspective')
+            })
+    return listKeikoAnalysis, listCollIndi, listPhilo
+
+# Function to write a file so readers never see it half written
+def write_atomically(path, content):
+    """
+    Writes to a temporary file in the same directory and renames it over the target.
+    :param path: Path of the file to write.
+    :param content: The bytes to write.
     """
-    output_file = os.path.join(html_output_dir, f"{bill_name}_analysis.html")
-    with open(output_file, "w", encoding="utf-8") as output:
-        output.write(html_content)
-    print(f"Generated HTML file: {output_file}")
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
 
-# Function to generate HTML for Keiko's analysis
-def generate_html_for_keiko_analysis(analyses):
+# Function to generate an HTML file from the AI analysis
+def generate_analysis_html(analysis_file, bill_name):
     """
-    Generates HTML for Keiko's analysis results.
-    :param analyses: List of Keiko's analysis results.
-    :return: HTML content as a string.
+    Generates an HTML file based on AI analysis results stored in a JSONL analysis store, with
+    compressed copies, in static_pages for nginx to serve without going through Flask.
+    :param analysis_file: Path to the JSONL file containing the analysis records.
+    :param bill_name: The name of the bill or document being analyzed.
+    :return: Path of the generated file, or None if the analysis could not be read.
     """
-    html_parts = []
-    for analysis in analyses:
-        for topic, content in analysis.items():
-            if isinstance(content, dict) and topic == "Details":
-                html_parts.append("<div class='analysis-section'><h2>Details</h2>")
-                for part, info in content.items():
-                    html_parts.append(f"<h3>{part}</h3><ul>")
-                    if isinstance(info, dict) and 'Amendments' in info:
-                        for amendment in info['Amendments']:
-                            html_parts.append("<li>")
-                            for key, value in amendment.items():
-                                html_parts.append(f"<strong>{key}:</strong> {value} ")
-                            html_parts.append("</li>")
-                    html_parts.append("</ul>")
-                html_parts.append("</div>")
-            elif isinstance(content, str):
-                html_parts.append(f"""
-                  <div class="analysis-section">
-                    <h2>{topic}</h2>
-                    <p>{content}</p>
-                  </div>
-                """)
-            else:
-                html_parts.append(f"""
-                  <div class="analysis-section">
-                    <h2>{topic}</h2>
-                    <p>Content not displayed properly</p>
-                  </div>
-                """)
-    return ''.join(html_parts) if html_parts else "<p>No additional analysis provided.</p>"
-
-# Function to generate HTML for collective and individual analyses
-def generate_html_for_coll_indi(analyses):
+    try:
+        # Records are streamed from the file rather than loaded all at once
+        keiko_analysis, coll_indi_analysis, philosopher_perspectives = parse_analysis(iter_records(analysis_file))
+    except Exception as e:
+        logger.error(f"Error reading or processing analysis file: {e}")
+        return None
+
+    # Render the page using the compiled template
+    html_content = get_page_template().render(
+        bill_name=bill_name,
+        keiko_analysis=keiko_analysis,
+        coll_indi_analysis=coll_indi_analysis,
+        philosopher_perspectives=philosopher_perspectives
+    ).encode("utf-8")
+
+    page_name = f"{bill_name}_analysis.html"
+    output_file = os.path.join(static_pages_dir, page_name)
+    write_atomically(output_file, html_content)
+    write_atomically(os.path.join(static_pages_dir, f"{page_name}.gz"), gzip.compress(html_content, compresslevel=9, mtime=0))
+    if assets.brotli is not None:
+        write_atomically(os.path.join(static_pages_dir, f"{page_name}.br"), assets.brotli.compress(html_content, quality=11))
+    logger.info(f"Generated HTML file: {output_file}")
+    return output_file
+
+# Function to hash everything a page depends on
+def input_hash(analysis_file):
     """
-    Generates HTML for collective and individual impact analyses.
-    :param analyses: List of collective and individual analyses.
-    :return: HTML content as a string.
+    :param analysis_file: Path to the analysis JSONL.
+    :return: Hex digest of the analysis JSONL, the page template and the asset manifest.
     """
-    html_parts = []
-    for analysis in analyses:
-        if analysis['Topic'] == "Borg_Collective_Analysis":
-            html_parts.append(f"""
-              <h2>Collective Impact Analysis</h2>
-              <h3>The Collective Score: {analysis['Score']}</h3>
-              <p><strong>Explanation:</strong> {analysis['Explanation']}</p>
-            """)
-        elif analysis['Topic'] == "Individual_Heart_Analysis":
-            html_parts.append(f"""
-              <h2>Individual Impact Analysis</h2>
-              <h3>The Individual Score: {analysis['Score']}</h3>
-              <p><strong>Explanation:</strong> {analysis['Explanation']}</p>
-            """)
-    return ''.join(html_parts) if html_parts else "<p>No impact analysis provided.</p>"
-
-# Function to generate HTML for philosopher perspectives
-def generate_html_for_coll_phil(analyses):
+    digest = hashlib.sha256()
+    dependencies = (
+        analysis_file,
+        os.path.join(page_template_dir, page_template_name),
+        os.path.join(assets.STATIC_DIR, assets.DIST_DIRNAME, assets.MANIFEST_NAME),
+    )
+    for path in dependencies:
+        try:
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 16), b""):
+                    digest.update(block)
+        except FileNotFoundError:
+            digest.update(b"missing")
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+# Function to generate the pages of many bills in a process pool
+def generate_pages(bills, max_workers=None, force=False):
     """
-    Generates HTML for philosopher perspectives.
-    :param analyses: List of philosopher perspectives.
-    :return: HTML content as a string.
+    Generates analysis pages for many bills in parallel, skipping bills whose analysis,
+    template and assets have not changed since their page was last generated.
+    :param bills: Dictionary of bill names to analysis JSONL paths.
+    :param max_workers: Number of worker processes (defaults to the number of CPUs).
+    :param force: Regenerate every page even if its inputs are unchanged.
+    :return: Dictionary of bill names to "generated", "unchanged" or "failed".
     """
-    html_parts = [f"<h3>Philosophers:</h3>"]
-    for analysis in analyses:
-        html_parts.append(f"""
-            <p><strong>{analysis['Philosopher']}: {analysis['Perspective']}</strong></p>
-        """)
-    return ''.join(html_parts) if html_parts else "<p>No philosopher perspectives provided.</p>"
-
-# Main function to generate HTML based on the analysis JSON file
+    try:
+        with open(state_file, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        state = {}
+
+    statuses = {}
+    pending = {}
+    for bill_name, analysis_file in bills.items():
+        digest = input_hash(analysis_file)
+        page_exists = os.path.exists(os.path.join(static_pages_dir, f"{bill_name}_analysis.html"))
+        if not force and page_exists and state.get(bill_name) == digest:
+            statuses[bill_name] = "unchanged"
+        else:
+            pending[bill_name] = (analysis_file, digest)
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                bill_name: executor.submit(generate_analysis_html, analysis_file, bill_name)
+                for bill_name, (analysis_file, _) in pending.items()
+            }
+            for bill_name, future in futures.items():
+                try:
+                    generated = future.result()
+                except Exception as e:
+                    logger.error(f"Failed to generate the page for {bill_name}: {e}")
+                    generated = None
+                if generated:
+                    statuses[bill_name] = "generated"
+                    state[bill_name] = pending[bill_name][1]
+                else:
+                    statuses[bill_name] = "failed"
+
+        write_atomically(state_file, json.dumps(state, indent=2, sort_keys=True).encode("utf-8"))
+
+    logger.info(f"Analysis pages: {statuses}")
+    return statuses
+
+# Main function to generate HTML based on the analysis files
 if __name__ == "__main__":
-    analysis_file_path = os.path.join(taillings_dir, "C-70_E_analysis.json")
-    generate_analysis_html(analysis_file_path, "C-70_E")
+    # Bill names can be given on the command line, otherwise C-70_E is generated
+    bill_names = [arg for arg in sys.argv[1:] if not arg.startswith("--")] or ["C-70_E"]
+    generate_pages(
+        {name: os.path.join(taillings_dir, f"{name}_analysis.jsonl") for name in bill_names},
+        force="--force" in sys.argv
+    )
@@ -0,0 +1,225 @@
+# quants/keyword_index.py
+
+import os
+import re
+import html
+import sqlite3
+import threading
+from loguru import logger
+
+# Default location of the full-text index
+index_path = os.getenv("KEYWORD_INDEX_PATH", "quants/keyword_index.sqlite3")
+
+# Markers snippet() puts around matches; control characters survive html.escape and never occur in bills
+MATCH_START = "\x02"
+MATCH_END = "\x03"
+
+# Terms of a query: quoted phrases, or runs of anything but whitespace
+QUERY_TERM = re.compile(r'"([^"]+)"|(\S+)')
+
+# Class keeping a local full-text index of the bill chunks in the vector store
+class KeywordIndex:
+    """
+    SQLite FTS5 index over the chunks of the Tsionhehkwen collection, ranked with BM25.
+    The chunks table holds the text and is indexed by chunk ID, so updates and deletes by ID
+    are cheap; triggers keep the FTS table in step with it. Porter stemming lets "registries"
+    find "registry". Safe to share between threads.
+    """
+    def __init__(self, path=index_path):
+        """
+        :param path: Path to the SQLite database file.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS chunks (
+                rowid INTEGER PRIMARY KEY,
+                id TEXT UNIQUE NOT NULL,
+                doc_id TEXT,
+                heading TEXT,
+                document TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS chunks_doc_id ON chunks (doc_id);
+            CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(
+                heading, document, content='chunks', content_rowid='rowid',
+                tokenize='porter unicode61 remove_diacritics 2'
+            );
+            CREATE TRIGGER IF NOT EXISTS chunks_ai AFTER INSERT ON chunks BEGIN
+                INSERT INTO chunks_fts (rowid, heading, document) VALUES (new.rowid, new.heading, new.document);
+            END;
+            CREATE TRIGGER IF NOT EXISTS chunks_ad AFTER DELETE ON chunks BEGIN
+                INSERT INTO chunks_fts (chunks_fts, rowid, heading, document) VALUES ('delete', old.rowid, old.heading, old.document);
+            END;
+            CREATE TRIGGER IF NOT EXISTS chunks_au AFTER UPDATE ON chunks BEGIN
+                INSERT INTO chunks_fts (chunks_fts, rowid, heading, document) VALUES ('delete', old.rowid, old.heading, old.document);
+                INSERT INTO chunks_fts (rowid, heading, document) VALUES (new.rowid, new.heading, new.document);
+            END;
+            """
+        )
+        self._conn.commit()
+
+    def upsert(self, ids, documents, metadatas=None):
+        """
+        Adds chunks, replacing any already stored under the same IDs.
+        :param ids: Chunk IDs.
+        :param documents: Chunk texts.
+        :param metadatas: Chunk metadata, for the doc_id and heading (optional).
+        """
+        metadatas = metadatas or [None] * len(ids)
+        rows = [
+            (id_, (metadata or {}).get("doc_id"), (metadata or {}).get("heading"), document or "")
+            for id_, document, metadata in zip(ids, documents, metadatas)
+        ]
+        with self._lock:
+            self._conn.executemany(
+                """
+                INSERT INTO chunks (id, doc_id, heading, document) VALUES (?, ?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET doc_id = excluded.doc_id, heading = excluded.heading, document = excluded.document
+                """,
+                rows
+            )
+            self._conn.commit()
+
+    def update_metadata(self, ids, metadatas):
+        """
+        Updates the doc_id and heading of chunks whose text is unchanged.
+        :param ids: Chunk IDs.
+        :param metadatas: The new metadata.
+        """
+        rows = [((metadata or {}).get("doc_id"), (metadata or {}).get("heading"), id_) for id_, metadata in zip(ids, metadatas)]
+        with self._lock:
+            self._conn.executemany("UPDATE chunks SET doc_id = ?, heading = ? WHERE id = ?", rows)
+            self._conn.commit()
+
+    def delete(self, ids):
+        """
+        :param ids: Chunk IDs to remove.
+        """
+        with self._lock:
+            self._conn.executemany("DELETE FROM chunks WHERE id = ?", [(id_,) for id_ in ids])
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM chunks")
+            self._conn.commit()
+
+    def count(self):
+        """
+        :return: Number of chunks in the index.
+        """
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def search(self, query, limit=10, offset=0, doc_id=None):
+        """
+        Ranks the chunks matching every term of the query with BM25, headings weighted twice
+        as much as text. No network call is made.
+        :param query: The search text; "quoted phrases" must match in order.
+        :param limit: Number of results.
+        :param offset: Number of results to skip.
+        :param doc_id: Only search chunks of this document (optional).
+        :return: Tuple of (total number of matches, list of result dictionaries, best first).
+        """
+        expression = match_expression(query)
+        if expression is None:
+            return 0, []
+        where = "chunks_fts MATCH ?" + (" AND chunks.doc_id = ?" if doc_id else "")
+        parameters = [expression] + ([doc_id] if doc_id else [])
+        with self._lock:
+            total = self._conn.execute(
+                f"SELECT COUNT(*) FROM chunks_fts JOIN chunks ON chunks.rowid = chunks_fts.rowid WHERE {where}",
+                parameters
+            ).fetchone()[0]
+            rows = self._conn.execute(
+                f"""
+                SELECT chunks.id, chunks.doc_id, chunks.heading,
+                       snippet(chunks_fts, 1, ?, ?, '…', 24), bm25(chunks_fts, 2.0, 1.0) AS rank
+                FROM chunks_fts JOIN chunks ON chunks.rowid = chunks_fts.rowid
+                WHERE {where}
+                ORDER BY rank LIMIT ? OFFSET ?
+                """,
+                [MATCH_START, MATCH_END] + parameters + [limit, offset]
+            ).fetchall()
+        results = [
+            {"id": id_, "doc_id": doc, "heading": heading, "snippet": mark_snippet(snippet), "bm25": -rank}
+            for id_, doc, heading, snippet, rank in rows
+        ]
+        return total, results
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+# Function to turn a search box query into an FTS5 expression
+def match_expression(query):
+    """
+    Every term is quoted, so punctuation such as "83.01" or "C-70" is matched as a phrase of
+    its parts and FTS5 operators in user input are taken literally.
+    :param query: The search text.
+    :return: The MATCH expression, or None if the query has no terms.
+    """
+    terms = [phrase or word for phrase, word in QUERY_TERM.findall(query or "")]
+    terms = [term.replace('"', '""') for term in terms if re.search(r"\w", term)]
+    if not terms:
+        return None
+    return " ".join(f'"{term}"' for term in terms)
+
+# Function to tell whether a query asks for exact text only
+def is_exact_query(query):
+    """
+    :param query: The search text.
+    :return: True if every term of the query is a "quoted phrase", such as "83.01".
+    """
+    terms = [(phrase, word) for phrase, word in QUERY_TERM.findall(query or "") if re.search(r"\w", phrase or word)]
+    return bool(terms) and all(phrase for phrase, _ in terms)
+
+# Function to make a snippet safe for HTML with its matches in <mark>
+def mark_snippet(snippet):
+    """
+    :param snippet: Text with matches between MATCH_START and MATCH_END.
+    :return: Escaped HTML.
+    """
+    return html.escape(snippet or "").replace(MATCH_START, "<mark>").replace(MATCH_END, "</mark>")
+
+# Function to build a snippet for a chunk that was found by vector search only
+def highlight(text, query, width=200):
+    """
+    Shows the text around the first query term it contains, with every term marked.
+    :param text: The chunk text.
+    :param query: The search text.
+    :param width: Approximate number of characters of the snippet.
+    :return: Escaped HTML.
+    """
+    text = " ".join((text or "").split())
+    words = [re.escape(word) for phrase, bare in QUERY_TERM.findall(query or "") for word in (phrase or bare).split() if re.search(r"\w", word)]
+    pattern = re.compile(r"\b(" + "|".join(words) + r")\b", re.IGNORECASE) if words else None
+    found = pattern.search(text) if pattern else None
+    start = max(0, found.start() - width // 3) if found else 0
+    excerpt = text[start:start + width]
+    if pattern:
+        excerpt = pattern.sub(lambda match: f"{MATCH_START}{match.group(0)}{MATCH_END}", excerpt)
+    prefix = "…" if start > 0 else ""
+    suffix = "…" if start + width < len(text) else ""
+    return mark_snippet(f"{prefix}{excerpt}{suffix}")
+
+# The index for this process, opened on first use; a forked child opens its own
+_index = {}
+_index_lock = threading.Lock()
+
+# Function to get the keyword index for this process
+def get_index():
+    """
+    :return: The KeywordIndex at index_path.
+    """
+    with _index_lock:
+        if _index.get("pid") != os.getpid():
+            _index.update(pid=os.getpid(), index=KeywordIndex(index_path))
+            logger.debug(f"Opened keyword index {index_path}")
+        return _index["index"]
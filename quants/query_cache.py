@@ -0,0 +1,64 @@
+# quants/query_cache.py
+
+import time
+import threading
+from collections import OrderedDict
+import metrics
+
+# Class for a small in-process cache with least-recently-used eviction and expiry
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries expire after a fixed number of seconds.
+    Used to keep recent query results in memory between requests in a worker.
+    """
+    def __init__(self, max_entries=256, ttl_seconds=300, name=None):
+        """
+        :param max_entries: Number of entries kept before the least recently used is dropped.
+        :param ttl_seconds: Seconds an entry stays valid.
+        :param name: Name the hits and misses are reported under in /metrics (optional).
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        :param key: A hashable key.
+        :return: The cached value, or None if it is missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                hit = False
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                hit = True
+        if self.name:
+            metrics.count_cache(self.name, hit)
+        return entry[1] if hit else None
+
+    def put(self, key, value):
+        """
+        :param key: A hashable key.
+        :param value: The value to cache.
+        """
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Drops every entry, used when the data behind the cache changes.
+        """
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,103 @@
+# quants/search.py
+
+import os
+import sys
+from loguru import logger
+
+# Add the root directory to the Python path for module imports
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from quants.keyword_index import get_index, highlight, is_exact_query
+from quants.tsionhehkwen import vector_search
+
+# Search settings
+SEARCH_MODES = ("hybrid", "keyword", "vector")
+RRF_K = 60  # Rank constant of reciprocal rank fusion; larger values flatten the difference between ranks
+SEARCH_CANDIDATES = int(os.getenv("SEARCH_CANDIDATES", "50"))  # Results taken from each side before fusing
+MAX_SEARCH_DEPTH = 500  # Deepest result a vector or hybrid search pages to
+
+# Function to search the bill chunks by keyword, by meaning, or both
+def search_chunks(query, mode="hybrid", page=1, per_page=10, doc_id=None):
+    """
+    Keyword search is answered from the local full-text index alone and never touches the
+    network. Vector search embeds the query (cached per query). Hybrid search takes the top
+    SEARCH_CANDIDATES of each and merges them with reciprocal rank fusion, so the exact term
+    matches of BM25 and the paraphrases found by embeddings both rank well without having to
+    compare their scores. If the vector side fails, hybrid search returns the keyword results
+    and says so in "degraded". A hybrid query made only of "quoted phrases" asks for exact text,
+    which embeddings cannot find, so it is answered as a keyword search without embedding it.
+    :param query: The search text.
+    :param mode: One of SEARCH_MODES.
+    :param page: Page number, from 1.
+    :param per_page: Results per page.
+    :param doc_id: Only search the chunks of this document (optional).
+    :return: Dictionary with the mode used, the results of the page, the number of results and whether more pages follow.
+             Results are scored by BM25 in keyword mode and by their fused rank otherwise.
+    """
+    if mode == "hybrid" and is_exact_query(query):
+        mode = "keyword"
+    offset = (page - 1) * per_page
+    response = {"query": query, "mode": mode, "page": page, "per_page": per_page, "degraded": False}
+
+    if mode == "keyword":
+        total, hits = get_index().search(query, limit=per_page, offset=offset, doc_id=doc_id)
+        results = [keyword_result(hit, offset + rank) for rank, hit in enumerate(hits, 1)]
+        response.update(total=total, has_more=offset + len(results) < total, results=results)
+        return response
+
+    depth = min(max(SEARCH_CANDIDATES, offset + per_page), MAX_SEARCH_DEPTH)
+    keyword_hits = []
+    if mode == "hybrid":
+        keyword_hits = get_index().search(query, limit=depth, doc_id=doc_id)[1]
+    try:
+        vector_hits = vector_search(query, n_results=depth, where={"doc_id": doc_id} if doc_id else None)
+    except Exception as e:
+        if mode == "vector":
+            raise
+        logger.warning(f"Vector search failed, serving keyword results only: {e}")
+        vector_hits = {"ids": []}
+        response["degraded"] = True
+
+    fused = {}
+    for rank, hit in enumerate(keyword_hits, 1):
+        fused[hit["id"]] = keyword_result(hit, rank)
+        fused[hit["id"]]["score"] = 1 / (RRF_K + rank)
+    for rank, id_ in enumerate(vector_hits["ids"], 1):
+        result = fused.get(id_)
+        if result is None:
+            metadata = vector_hits["metadatas"][rank - 1] or {}
+            result = fused[id_] = {
+                "id": id_,
+                "doc_id": metadata.get("doc_id"),
+                "heading": metadata.get("heading"),
+                "snippet": highlight(vector_hits["documents"][rank - 1], query),
+                "score": 0.0,
+                "keyword_rank": None,
+                "vector_rank": None,
+                "distance": None,
+            }
+        result["score"] += 1 / (RRF_K + rank)
+        result["vector_rank"] = rank
+        result["distance"] = vector_hits["distances"][rank - 1]
+
+    ranked = sorted(fused.values(), key=lambda result: result["score"], reverse=True)
+    response.update(total=len(ranked), has_more=offset + per_page < len(ranked), results=ranked[offset:offset + per_page])
+    return response
+
+# Function to shape a keyword index hit as a search result
+def keyword_result(hit, rank):
+    """
+    :param hit: A result of KeywordIndex.search.
+    :param rank: Its rank in the keyword results, from 1.
+    :return: The search result, scored by BM25.
+    """
+    return {
+        "id": hit["id"],
+        "doc_id": hit["doc_id"],
+        "heading": hit["heading"],
+        "snippet": hit["snippet"],
+        "score": hit["bm25"],
+        "keyword_rank": rank,
+        "vector_rank": None,
+        "distance": None,
+    }
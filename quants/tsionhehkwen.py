@@ -2,10 +2,23 @@
 
 import os
 import sys
+import time
+import json
+import zlib
+import hashlib
+import threading
+
+_import_started = time.perf_counter()
+
 from dotenv import load_dotenv
 from loguru import logger
-import chromadb
-from chromadb.utils.embedding_functions import OpenAIEmbeddingFunction
+
+# Add the root directory to the Python path for module imports
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from quants.query_cache import TTLCache
+from quants.keyword_index import get_index as get_keyword_index
+from metrics import VECTOR_STORE_SECONDS, timed
 
 # Load environment variables from the .env file
 env_path = os.getenv('HOME') + "/web/ElectionClockEnvironment/.env"
@@ -21,46 +34,257 @@ logger.add(sys.stdout, level=log_level)
 logger.info("Begin tsionhehkwen")
 logger.debug("Debug mode on")
 
-# Ensure the vector store directory exists
+# Location of the persistent vector store
 vector_store_directory = "quants/vector_store"
-os.makedirs(vector_store_directory, exist_ok=True)
-
-# Initialize the ChromaDB client with disk persistence
-client = chromadb.PersistentClient(path=vector_store_directory)
-
-# Retrieve the OpenAI API key
-openai_key = os.getenv("keyOPENAI")
-if not openai_key:
-    logger.error("OpenAI API key not found. Please set 'keyOPENAI' in the environment variables.")
-    raise ValueError("OpenAI API key not found. Please set 'keyOPENAI' in the environment variables.")
-
-# Initialize the embedding function using OpenAI's `text-embedding-ada-002` model
-try:
-    logger.info("Use OpenAI's `text-embedding-ada-002` model")
-    embedding_function = OpenAIEmbeddingFunction(api_key=openai_key, model_name="text-embedding-ada-002")
-    logger.info("Successfully initialized embedding function.")
-except Exception as e:
-    logger.error(f"Failed to initialize embedding function: {e}")
-
-# Retrieve or create the main document collection in the vector store
-try:
-    logger.info("Retrieve or create the collection")
-    collection = client.get_or_create_collection(
-        name="Tsionhehkwen",
-        embedding_function=embedding_function
-    )
-except Exception as e:
-    logger.error(f"Failed to retrieve or create the collection: {e}")
-
-# Retrieve or create the collection for analysis results
-try:
-    logger.info("Create a collection for analysis results")
-    analysis_collection = client.get_or_create_collection(
-        name="AnalysisResults",
-        embedding_function=embedding_function
-    )
-except Exception as e:
-    logger.error(f"Failed to create a collection for analysis results: {e}")
+
+# File replaced whenever maintenance replaces the store or a collection in it, so every process reopens them
+store_generation_path = vector_store_directory.rstrip("/") + ".generation"
+
+# HNSW index settings a collection is created with (Chroma's defaults). They only apply to new
+# collections; quants/vector_maintenance.py changes them on an existing one.
+HNSW_SETTINGS = {
+    "Tsionhehkwen": {"space": "l2", "max_neighbors": 16, "ef_construction": 100, "ef_search": 100},
+    "AnalysisResults": {"space": "l2", "max_neighbors": 16, "ef_construction": 100, "ef_search": 100},
+}
+
+# The client, embedding function and collections are created on first use, once per process.
+# Nothing heavy happens at import, and a process forked after initialization (for example a
+# gunicorn worker under --preload) builds its own client instead of sharing the parent's.
+_store = {}
+_store_lock = threading.Lock()
+_timings = {}
+
+# Function to forget the client and collections, along with Chroma's cached client for the path
+def _drop_store():
+    if _store:
+        # Chroma caches clients per path; the old one is unusable in a forked child or after a restore
+        try:
+            from chromadb.api.shared_system_client import SharedSystemClient
+            SharedSystemClient.clear_system_cache()
+        except Exception as e:
+            logger.warning(f"Could not clear the Chroma client cache: {e}")
+    _store.clear()
+
+# Function to drop the parent's vector store handles in a freshly forked child
+def _reset_after_fork():
+    global _store_lock
+    _drop_store()
+    _store_lock = threading.Lock()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+# Function to identify the current generation of the store
+def _store_generation():
+    """
+    :return: The inode and modification time of the generation file, or None if it does not exist.
+    """
+    try:
+        stat = os.stat(store_generation_path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns)
+
+# Function to tell every process using the store that its collections were replaced
+def mark_store_replaced():
+    """
+    Called after a rebuild, a restore or an in-place HNSW change. A gunicorn worker still holding
+    the old collection would otherwise fail with NotFoundError until restarted; instead each
+    process sees the new generation on its next use of the store and opens it again.
+    """
+    os.makedirs(os.path.dirname(store_generation_path) or ".", exist_ok=True)
+    temporary = f"{store_generation_path}.tmp-{os.getpid()}"
+    with open(temporary, "w", encoding="utf-8") as f:
+        f.write(f"{time.time()}\n")
+    os.replace(temporary, store_generation_path)  # A new inode each time, whatever the clock resolution
+
+# Function to finish or undo a collection swap that a rebuild left part way through
+def _recover_collection(client, name):
+    """
+    A rebuild renames the collection to <name>-old, renames the rebuilt copy to <name>, then
+    drops <name>-old. If it stopped after the first rename, the old collection is put back.
+    :param client: The ChromaDB client.
+    :param name: Name of the collection.
+    """
+    names = {collection.name for collection in client.list_collections()}
+    old = f"{name}-old"
+    if old not in names:
+        return
+    if name in names:
+        client.delete_collection(old)  # The swap finished, only dropping the old copy did not
+    else:
+        client.get_collection(old).modify(name=name)
+        logger.warning(f"Put {name} back after an interrupted rebuild")
+
+# Function to drop this process's vector store handles, so the next use opens the store again
+def reset_store():
+    """
+    Needed after the store's files or collections were replaced, for example by a restore or a rebuild.
+    """
+    with _store_lock:
+        _drop_store()
+
+# Function to create the client, embedding function and collections for this process
+def _init_store():
+    """
+    Initializes the vector store for the current process and records how long it took.
+    :return: Dictionary holding the client, embedding function and both collections.
+    """
+    generation = _store_generation()
+    with _store_lock:
+        if _store.get("pid") == os.getpid() and _store.get("generation") == generation:
+            return _store
+        if _store:
+            logger.info("The vector store was replaced by maintenance, opening it again")
+            _drop_store()
+
+        started = time.perf_counter()
+        import chromadb
+        from chromadb.utils.embedding_functions import OpenAIEmbeddingFunction
+        from quants.embeddings import CachedEmbeddingFunction
+        _timings["chromadb_import_seconds"] = time.perf_counter() - started
+
+        # Ensure the vector store directory exists and open the ChromaDB client with disk persistence
+        os.makedirs(vector_store_directory, exist_ok=True)
+        client = chromadb.PersistentClient(path=vector_store_directory)
+
+        # Retrieve the OpenAI API key
+        openai_key = os.getenv("keyOPENAI")
+        if not openai_key:
+            logger.error("OpenAI API key not found. Please set 'keyOPENAI' in the environment variables.")
+            raise ValueError("OpenAI API key not found. Please set 'keyOPENAI' in the environment variables.")
+
+        # Initialize the embedding function using OpenAI's `text-embedding-ada-002` model
+        try:
+            logger.info("Use OpenAI's `text-embedding-ada-002` model")
+            # Wrap the OpenAI function so both collections share batching and the on-disk embedding cache
+            embedding_function = CachedEmbeddingFunction(
+                # Named by variable rather than passed, so the config Chroma stores with the collections holds no secret
+                OpenAIEmbeddingFunction(api_key_env_var="keyOPENAI", model_name="text-embedding-ada-002"),
+                model_name="text-embedding-ada-002"
+            )
+            logger.info("Successfully initialized embedding function.")
+        except Exception as e:
+            logger.error(f"Failed to initialize embedding function: {e}")
+            raise
+
+        for name in HNSW_SETTINGS:
+            _recover_collection(client, name)
+
+        # Retrieve or create the main document collection in the vector store
+        try:
+            logger.info("Retrieve or create the collection")
+            collection = client.get_or_create_collection(
+                name="Tsionhehkwen",
+                configuration={"hnsw": HNSW_SETTINGS["Tsionhehkwen"]},
+                embedding_function=embedding_function
+            )
+        except Exception as e:
+            logger.error(f"Failed to retrieve or create the collection: {e}")
+            raise
+
+        # Retrieve or create the collection for analysis results
+        try:
+            logger.info("Create a collection for analysis results")
+            analysis_collection = client.get_or_create_collection(
+                name="AnalysisResults",
+                configuration={"hnsw": HNSW_SETTINGS["AnalysisResults"]},
+                embedding_function=embedding_function
+            )
+        except Exception as e:
+            logger.error(f"Failed to create a collection for analysis results: {e}")
+            raise
+
+        _store.update({
+            "pid": os.getpid(),
+            "generation": generation,
+            "client": client,
+            "embedding_function": embedding_function,
+            "collection": collection,
+            "analysis_collection": analysis_collection,
+        })
+        _timings["init_seconds"] = time.perf_counter() - started
+        logger.info(f"Vector store initialized in {_timings['init_seconds']:.3f}s (pid {os.getpid()})")
+        return _store
+
+# Function to get the ChromaDB client
+def get_client():
+    """
+    :return: The ChromaDB client for this process, created on first use.
+    """
+    return _init_store()["client"]
+
+# Function to get the shared embedding function
+def get_embedding_function():
+    """
+    :return: The embedding function used by both collections, created on first use.
+    """
+    return _init_store()["embedding_function"]
+
+# Function to get the main document collection
+def get_collection():
+    """
+    :return: The Tsionhehkwen collection, created on first use.
+    """
+    return _init_store()["collection"]
+
+# Function to get the analysis results collection
+def get_analysis_collection():
+    """
+    :return: The AnalysisResults collection, created on first use.
+    """
+    return _init_store()["analysis_collection"]
+
+# Function to report what importing and initializing the vector store cost
+def startup_report():
+    """
+    :return: Dictionary of timings in seconds: module import, chromadb import and store initialization.
+             The last two are missing until the store has been used in this process.
+    """
+    return dict(_timings)
+
+# Function to mirror a change to the main collection in the keyword index
+def _update_keyword_index(target_collection, change, *args):
+    """
+    The vector store is the source of truth, so a failed index update is logged rather than
+    raised; `python3 explore.py reindex` rebuilds the index from the store.
+    :param target_collection: The collection that was changed; only Tsionhehkwen is indexed.
+    :param change: Name of the KeywordIndex method to call.
+    :param args: Arguments of the method.
+    """
+    if target_collection.name != "Tsionhehkwen":
+        return
+    try:
+        getattr(get_keyword_index(), change)(*args)
+    except Exception as e:
+        logger.error(f"Keyword index {change} failed, run `python3 explore.py reindex`: {e}")
+
+# Function to fill the keyword index from the main collection
+def rebuild_keyword_index(target_collection=None, page_size=500, if_empty=False):
+    """
+    Replaces the contents of the keyword index with the chunks in the vector store. Records are
+    read page by page and nothing is embedded.
+    :param target_collection: Collection to index, defaults to the main document collection.
+    :param page_size: Number of records read per call.
+    :param if_empty: Only rebuild when the index holds nothing yet.
+    :return: Number of chunks indexed, or None if the index was left as it was.
+    """
+    index = get_keyword_index()
+    if if_empty and index.count():
+        return None
+    target_collection = target_collection if target_collection is not None else get_collection()
+    started = time.perf_counter()
+    index.clear()
+    indexed = 0
+    for page in iter_collection(target_collection, page_size=page_size):
+        index.upsert(page["ids"], page["documents"], page["metadatas"])
+        indexed += len(page["ids"])
+    logger.info(f"Keyword index rebuilt with {indexed} chunks in {time.perf_counter() - started:.1f}s")
+    return indexed
+
+# In-process caches for analysis queries; query embeddings never change, results do when analyses are written
+query_embedding_cache = TTLCache(max_entries=1024, ttl_seconds=24 * 3600, name="query_embeddings")
+analysis_results_cache = TTLCache(max_entries=256, ttl_seconds=int(os.getenv("ANALYSIS_RESULTS_TTL", "300")), name="analysis_results")
 
 # Function to add documents to the vector store
 def add_documents(documents, ids=None, metadatas=None):
@@ -75,15 +299,145 @@ def add_documents(documents, ids=None, metadatas=None):
         ids = [str(i) for i in range(len(documents))]
     try:
         logger.info(f"Adding {len(documents)} documents to the vector store.")
-        collection.add(
-            documents=documents,
-            ids=ids,
-            metadatas=metadatas
-        )
+        with timed(VECTOR_STORE_SECONDS, operation="add"):
+            get_collection().add(
+                documents=documents,
+                ids=ids,
+                metadatas=metadatas
+            )
+        _update_keyword_index(get_collection(), "upsert", ids, documents, metadatas)
         logger.info("Documents added successfully.")
     except Exception as e:
         logger.error(f"Error in add_documents: {e}")
 
+# Function to split a document into chunks whose boundaries depend on content, not offsets
+def split_into_chunks(document, chunk_size=2000):
+    """
+    Splits a document into chunks of at most chunk_size characters. Chunks end on line
+    breaks chosen by a hash of the line, so an edit only moves the boundaries near it
+    and the chunks after it keep the same content.
+    :param document: The full text of the document.
+    :param chunk_size: Maximum size of each chunk.
+    :return: List of text chunks.
+    """
+    # Break the document into lines, cutting over-long lines at word boundaries
+    pieces = []
+    for line in document.splitlines(keepends=True):
+        while len(line) > chunk_size:
+            cut = line.rfind(" ", 0, chunk_size) + 1 or chunk_size
+            pieces.append(line[:cut])
+            line = line[cut:]
+        if line:
+            pieces.append(line)
+
+    chunks = []
+    current = []
+    current_size = 0
+    for piece in pieces:
+        if current and current_size + len(piece) > chunk_size:
+            chunks.append("".join(current))
+            current, current_size = [], 0
+        current.append(piece)
+        current_size += len(piece)
+        # Content-defined boundary: roughly one line in four may close a chunk once it is half full
+        if current_size >= chunk_size // 2 and zlib.crc32(piece.encode("utf-8")) % 4 == 0:
+            chunks.append("".join(current))
+            current, current_size = [], 0
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+# Function to build a chunk ID from the chunk content
+def chunk_id(doc_id, chunk, seen=None):
+    """
+    Builds an ID for a chunk from a hash of its content.
+    :param doc_id: The base ID of the document.
+    :param chunk: The chunk text.
+    :param seen: Set of IDs already handed out for this document, used to tell repeated chunks apart.
+    :return: The chunk ID.
+    """
+    base = f"{doc_id}#{hashlib.sha256(chunk.encode('utf-8')).hexdigest()[:16]}"
+    candidate, n = base, 1
+    while seen is not None and candidate in seen:
+        n += 1
+        candidate = f"{base}-{n}"
+    if seen is not None:
+        seen.add(candidate)
+    return candidate
+
+# Function to bring the stored chunks of a document in line with a new set of chunks
+def sync_document_chunks(doc_id, chunks, target_collection=None, metadatas=None):
+    """
+    Incrementally updates the chunks of a document. Only new chunks are embedded and upserted,
+    chunks that moved only have their position metadata updated, and chunks that are gone
+    are deleted. Each kind of change is sent as a single batched call; additions go first
+    so a failure part way through never leaves the document with fewer chunks than before.
+    :param doc_id: The base ID of the document.
+    :param chunks: The new chunks of the document, in order.
+    :param target_collection: Collection to update, defaults to the main document collection.
+    :param metadatas: Optional extra metadata for each chunk, such as the sections it covers.
+    :return: Dictionary with the number of chunks added, moved, removed and unchanged.
+    """
+    target_collection = target_collection if target_collection is not None else get_collection()
+    seen = set()
+    ids = [chunk_id(doc_id, chunk, seen) for chunk in chunks]
+    extra = metadatas if metadatas is not None else [{}] * len(chunks)
+    metadatas = [
+        dict(extra[i], doc_id=doc_id, position=i, content_hash=id_.split("#", 1)[1])
+        for i, id_ in enumerate(ids)
+    ]
+
+    with timed(VECTOR_STORE_SECONDS, operation="get"):
+        existing = target_collection.get(where={"doc_id": doc_id}, include=["metadatas"])
+    existing_positions = {id_: (meta or {}).get("position") for id_, meta in zip(existing["ids"], existing["metadatas"])}
+
+    added = [i for i, id_ in enumerate(ids) if id_ not in existing_positions]
+    moved = [i for i, id_ in enumerate(ids) if id_ in existing_positions and existing_positions[id_] != i]
+    removed = [id_ for id_ in existing_positions if id_ not in seen]
+    removed.extend(find_positional_chunk_ids(doc_id, target_collection))
+
+    if added:
+        logger.info(f"Embedding {len(added)} new chunks for {doc_id}")
+        with timed(VECTOR_STORE_SECONDS, operation="upsert"):
+            target_collection.upsert(
+                documents=[chunks[i] for i in added],
+                ids=[ids[i] for i in added],
+                metadatas=[metadatas[i] for i in added]
+            )
+        _update_keyword_index(target_collection, "upsert", [ids[i] for i in added], [chunks[i] for i in added], [metadatas[i] for i in added])
+    if moved:
+        # Metadata-only updates never call the embedding function
+        with timed(VECTOR_STORE_SECONDS, operation="update"):
+            target_collection.update(ids=[ids[i] for i in moved], metadatas=[metadatas[i] for i in moved])
+        _update_keyword_index(target_collection, "update_metadata", [ids[i] for i in moved], [metadatas[i] for i in moved])
+    if removed:
+        with timed(VECTOR_STORE_SECONDS, operation="delete"):
+            target_collection.delete(ids=removed)
+        _update_keyword_index(target_collection, "delete", removed)
+
+    summary = {"added": len(added), "moved": len(moved), "removed": len(removed), "unchanged": len(ids) - len(added) - len(moved)}
+    logger.info(f"Synced {doc_id}: {summary}")
+    return summary
+
+# Function to find chunks stored under the old positional IDs (doc_id_1, doc_id_2, ...)
+def find_positional_chunk_ids(doc_id, target_collection, page_size=256):
+    """
+    Finds chunks stored with positional IDs before chunk IDs were content based.
+    :param doc_id: The base ID of the document.
+    :param target_collection: Collection to look in.
+    :param page_size: Number of IDs probed per call.
+    :return: List of positional IDs present in the collection.
+    """
+    found = []
+    start = 1
+    while True:
+        probe = [f"{doc_id}_{i}" for i in range(start, start + page_size)]
+        page = target_collection.get(ids=probe, include=[])["ids"]
+        if not page:
+            return found
+        found.extend(page)
+        start += page_size
+
 # Function to split a document into chunks and add them to the vector store
 def add_chunks_to_vector_store(document, doc_id):
     """
@@ -92,45 +446,120 @@ def add_chunks_to_vector_store(document, doc_id):
     :param doc_id: The base ID for each chunk.
     """
     logger.debug(f"Adding chunks to vector store for doc_id: {doc_id}")
-    chunks = [document[i:i+2000] for i in range(0, len(document), 2000)]
-    ids = [f"{doc_id}_{i+1}" for i in range(len(chunks))]
-    add_documents(chunks, ids=ids)
+    return sync_document_chunks(doc_id, split_into_chunks(document))
+
+# Function to fetch every chunk of a document in its original order
+def get_document_chunks(doc_id, page_size=500, target_collection=None):
+    """
+    Retrieves all chunks of a document in document order by paging through the stored
+    records by metadata. No query is embedded, so this never calls the embedding API.
+    :param doc_id: The base ID of the document, e.g. "C-70_E".
+    :param page_size: Number of records fetched per call.
+    :param target_collection: Collection to read, defaults to the main document collection.
+    :return: A dictionary with the ids, documents and metadatas of the chunks, in order.
+    """
+    target_collection = target_collection if target_collection is not None else get_collection()
+    records = []
+    offset = 0
+    while True:
+        with timed(VECTOR_STORE_SECONDS, operation="get"):
+            page = target_collection.get(
+                where={"doc_id": doc_id},
+                include=["documents", "metadatas"],
+                limit=page_size,
+                offset=offset
+            )
+        records.extend(zip(page["ids"], page["documents"], page["metadatas"]))
+        if len(page["ids"]) < page_size:
+            break
+        offset += page_size
+
+    if records:
+        # A chunk written without a position, e.g. by a partial import, goes last instead of failing the read
+        unplaced = sum(1 for record in records if "position" not in (record[2] or {}))
+        if unplaced:
+            logger.warning(f"{unplaced} chunks of {doc_id} have no position and are placed at the end")
+        last = len(records)
+        records.sort(key=lambda record: (record[2] or {}).get("position", last))
+    else:
+        # Chunks stored before chunk metadata existed only have positional IDs (doc_id_1, doc_id_2, ...)
+        legacy_ids = find_positional_chunk_ids(doc_id, target_collection)
+        if legacy_ids:
+            page = target_collection.get(ids=legacy_ids, include=["documents", "metadatas"])
+            records = sorted(
+                zip(page["ids"], page["documents"], page["metadatas"]),
+                key=lambda record: int(record[0].rsplit("_", 1)[1])
+            )
+
+    logger.debug(f"Fetched {len(records)} chunks for {doc_id}")
+    return {
+        "ids": [record[0] for record in records],
+        "documents": [record[1] for record in records],
+        "metadatas": [record[2] for record in records]
+    }
 
 # Function to search for documents in the vector store
 def search_documents(query, n_results=None):
     """
     Searches for documents in the vector store based on a query.
     :param query: The search query (text).
-    :param n_results: Number of results to return.
-    :return: A dictionary with the search results.
+    :param n_results: Number of results to return, or None for every document ranked by similarity.
+    :return: A dictionary with the matching documents, most similar first.
     """
     try:
-        results = []
-        page = 0
-        page_size = 10  # Define a reasonable page size for pagination
-
-        while True:
-            logger.debug(f"Searching for query: {query} with n_results: {n_results} at page: {page}")
-            current_results = collection.query(
-                query_texts=[query],
-                n_results=n_results if n_results is not None else page_size,
-                # offset=page * page_size #ChromaDB hates offset? not sure
-            )
-            if not current_results['documents']:
-                break  # Break if no more documents are returned
-            results.extend(current_results['documents'])
-            if n_results is not None and len(results) >= n_results:
-                results = results[:n_results]  # Limit results if n_results is specified
-                break
-            if n_results is None:
-                page += 1  # Only increment page if fetching all documents
-
-        logger.debug(f"Total documents fetched: {len(results)}")
-        return {'documents': results}
+        # Chroma queries have no offset, so fetching everything is a single query sized to the collection
+        if n_results is None:
+            n_results = get_collection().count()
+        if n_results == 0:
+            return {'documents': []}
+        logger.debug(f"Searching for query: {query} with n_results: {n_results}")
+        collection = get_collection()
+        with timed(VECTOR_STORE_SECONDS, operation="query"):
+            results = collection.query(query_texts=[query], n_results=n_results)
+        documents = results['documents'][0] if results['documents'] else []
+        logger.debug(f"Total documents fetched: {len(documents)}")
+        return {'documents': documents}
     except Exception as e:
         logger.error(f"Error in search_documents: {e}")
         return {'documents': []}
 
+# Function to embed a search query, reusing the embedding of a query seen before
+def embed_query(query):
+    """
+    :param query: The search query (text).
+    :return: The embedding of the query.
+    """
+    query_embedding = query_embedding_cache.get(query)
+    if query_embedding is None:
+        embedding_function = get_embedding_function()
+        with timed(VECTOR_STORE_SECONDS, operation="embed_query"):
+            query_embedding = embedding_function([query])[0]
+        query_embedding_cache.put(query, query_embedding)
+    return query_embedding
+
+# Function to rank the chunks of the main collection by similarity to a query
+def vector_search(query, n_results=10, where=None):
+    """
+    Unlike search_documents, errors are raised so the caller can fall back to keyword search.
+    :param query: The search query (text).
+    :param n_results: Number of results to return.
+    :param where: Metadata filter (optional).
+    :return: A dictionary with the ids, documents, metadatas and distances of the chunks, most similar first.
+    """
+    collection = get_collection()
+    n_results = min(n_results, collection.count())
+    if n_results <= 0:
+        return {"ids": [], "documents": [], "metadatas": [], "distances": []}
+    query_embedding = embed_query(query)
+    with timed(VECTOR_STORE_SECONDS, operation="query"):
+        results = collection.query(
+            query_embeddings=[query_embedding],
+            n_results=n_results,
+            where=where,
+            include=["documents", "metadatas", "distances"]
+        )
+    return {key: results[key][0] for key in ("ids", "documents", "metadatas", "distances")}
+
 # Function to add analysis results to the vector store
 def add_analysis_results(results, ids=None, metadatas=None):
     """
@@ -142,11 +571,13 @@ def add_analysis_results(results, ids=None, metadatas=None):
     if ids is None:
         ids = [str(i) for i in range(len(results))]
     logger.debug(f"Adding analysis results: {results}")
-    analysis_collection.add(
-        documents=results,
-        ids=ids,
-        metadatas=metadatas
-    )
+    with timed(VECTOR_STORE_SECONDS, operation="add"):
+        get_analysis_collection().add(
+            documents=results,
+            ids=ids,
+            metadatas=metadatas
+        )
+    analysis_results_cache.clear()  # Cached query results may no longer be accurate
 
 # Function to retrieve analysis results from the vector store
 def get_analysis_results(query, n_results=5):
@@ -157,12 +588,21 @@ def get_analysis_results(query, n_results=5):
     :return: The search results.
     """
     try:
+        cached = analysis_results_cache.get((query, n_results))
+        if cached is not None:
+            logger.debug(f"Serving cached analysis results for query: {query}")
+            return cached
+
         logger.debug(f"Fetching analysis results for query: {query} with n_results: {n_results}")
-        results = analysis_collection.query(
-            query_texts=[query],
-            n_results=n_results
-        )
+        query_embedding = embed_query(query)
+        analysis_collection = get_analysis_collection()
+        with timed(VECTOR_STORE_SECONDS, operation="query"):
+            results = analysis_collection.query(
+                query_embeddings=[query_embedding],
+                n_results=n_results
+            )
         logger.debug(f"Analysis results: {results}")
+        analysis_results_cache.put((query, n_results), results)
         return results
     except Exception as e:
         logger.error(f"Error in get_analysis_results: {e}")
@@ -174,7 +614,7 @@ def list_all_analysis_results():
     Lists all analysis results stored in the vector store.
     :return: A list of all analysis results.
     """
-    return analysis_collection.peek()
+    return get_analysis_collection().peek()
 
 #Function to list all document IDs in the vector store
 def list_documents():
@@ -183,25 +623,151 @@ def list_documents():
     :return: A list of all document IDs.
     """
     try:
-        documents = collection.get()
-        document_ids = documents['ids']
-        return document_ids
+        return [doc_id for page in iter_collection(include=[]) for doc_id in page["ids"]]
     except Exception as e:
         logger.error(f"Error in list_documents: {e}")
         return []
 
+# Function to page through a collection without loading all of it
+def iter_collection(target_collection=None, where=None, include=("documents", "metadatas"), page_size=500, offset=0, limit=None):
+    """
+    Reads the records of a collection one page at a time, so memory stays bounded however
+    large the collection is.
+    :param target_collection: Collection to read, defaults to the main document collection.
+    :param where: Metadata filter (optional).
+    :param include: Fields to fetch with each record, as for collection.get.
+    :param page_size: Number of records per page.
+    :param offset: Number of records to skip first.
+    :param limit: Stop after this many records (optional).
+    :return: Generator of pages as returned by collection.get.
+    """
+    target_collection = target_collection if target_collection is not None else get_collection()
+    read = 0
+    while limit is None or read < limit:
+        size = page_size if limit is None else min(page_size, limit - read)
+        with timed(VECTOR_STORE_SECONDS, operation="get"):
+            page = target_collection.get(where=where, include=list(include), limit=size, offset=offset + read)
+        if not page["ids"]:
+            return
+        yield page
+        read += len(page["ids"])
+        if len(page["ids"]) < size:
+            return
+
+# Function to delete records in batches
+def delete_records(target_collection=None, where=None, ids=None, batch_size=500):
+    """
+    Deletes the given IDs, or every record matching the filter (every record when neither is
+    given), batch_size at a time, so a large delete never builds one huge request.
+    :param target_collection: Collection to delete from, defaults to the main document collection.
+    :param where: Metadata filter (optional).
+    :param ids: IDs to delete (optional).
+    :param batch_size: Number of records deleted per call.
+    :return: Number of records deleted.
+    """
+    target_collection = target_collection if target_collection is not None else get_collection()
+    deleted = 0
+    if ids is not None:
+        for start in range(0, len(ids), batch_size):
+            batch = ids[start:start + batch_size]
+            with timed(VECTOR_STORE_SECONDS, operation="delete"):
+                target_collection.delete(ids=batch)
+            _update_keyword_index(target_collection, "delete", batch)
+            deleted += len(batch)
+    else:
+        # Deleted records drop out of the filter, so the first page is always the next batch
+        while True:
+            batch = target_collection.get(where=where, include=[], limit=batch_size)["ids"]
+            if not batch:
+                break
+            with timed(VECTOR_STORE_SECONDS, operation="delete"):
+                target_collection.delete(ids=batch)
+            _update_keyword_index(target_collection, "delete", batch)
+            deleted += len(batch)
+    analysis_results_cache.clear()
+    return deleted
+
+# Function to write the records of a collection to a JSONL file
+def export_records(target_collection, f, where=None, page_size=500, embeddings=True):
+    """
+    Streams one JSON line per record, with its embedding so it can be restored without
+    calling the embedding API again.
+    :param target_collection: Collection to export.
+    :param f: Text file to write to.
+    :param where: Metadata filter (optional).
+    :param page_size: Number of records read per call.
+    :param embeddings: Include the embeddings.
+    :return: Number of records written.
+    """
+    include = ["documents", "metadatas"] + (["embeddings"] if embeddings else [])
+    written = 0
+    for page in iter_collection(target_collection, where=where, include=include, page_size=page_size):
+        vectors = page["embeddings"] if embeddings else [None] * len(page["ids"])
+        for record_id, document, metadata, vector in zip(page["ids"], page["documents"], page["metadatas"], vectors):
+            record = {"id": record_id, "document": document, "metadata": metadata}
+            if vector is not None:
+                record["embedding"] = [float(value) for value in vector]
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            written += 1
+    return written
+
+# Function to load records from a JSONL export into a collection
+def import_records(target_collection, f, batch_size=500):
+    """
+    Upserts the records of an export batch_size at a time. Records with an embedding are
+    stored as they are; the others are embedded by the collection.
+    :param target_collection: Collection to import into.
+    :param f: Text file to read from.
+    :param batch_size: Number of records written per call.
+    :return: Number of records imported.
+    """
+    imported = 0
+    batch = []
+
+    def flush():
+        with_vectors = [record for record in batch if record.get("embedding") is not None]
+        without = [record for record in batch if record.get("embedding") is None]
+        for records, vectors in ((with_vectors, True), (without, False)):
+            if not records:
+                continue
+            with timed(VECTOR_STORE_SECONDS, operation="upsert"):
+                target_collection.upsert(
+                    ids=[record["id"] for record in records],
+                    documents=[record["document"] for record in records],
+                    metadatas=[record.get("metadata") or None for record in records],
+                    embeddings=[record["embedding"] for record in records] if vectors else None
+                )
+            _update_keyword_index(
+                target_collection, "upsert",
+                [record["id"] for record in records], [record["document"] for record in records], [record.get("metadata") for record in records]
+            )
+        batch.clear()
+
+    for line in f:
+        if not line.strip():
+            continue
+        batch.append(json.loads(line))
+        imported += 1
+        if len(batch) >= batch_size:
+            flush()
+    flush()
+    analysis_results_cache.clear()
+    return imported
+
 # Function to delete all analysis results from the vector store
 def delete_all_analysis_results():
     """
     Deletes all analysis results from the vector store.
     :return: Confirmation message or warning if any results remain.
     """
-    ids_to_delete = analysis_collection.get()["ids"]
-    analysis_collection.delete(ids=ids_to_delete)
+    analysis_collection = get_analysis_collection()
+    delete_records(analysis_collection)
 
     # Verify if deletion was successful
-    remaining_ids = analysis_collection.get()["ids"]
-    if not remaining_ids:
+    remaining = analysis_collection.count()
+    if not remaining:
         return "All analysis results deleted successfully."
     else:
-        return f"Warning: Some analysis results could not be deleted. Remaining IDs: {remaining_ids}"
+        return f"Warning: {remaining} analysis results could not be deleted."
+
+_timings["import_seconds"] = time.perf_counter() - _import_started
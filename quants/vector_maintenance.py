@@ -0,0 +1,350 @@
+# quants/vector_maintenance.py
+
+import os
+import sys
+import json
+import math
+import time
+import fcntl
+import shutil
+import sqlite3
+import argparse
+import resource
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from loguru import logger
+
+# Add the root directory to the Python path for module imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from quants.tsionhehkwen import (
+    vector_store_directory, get_client, get_embedding_function, iter_collection, reset_store, rebuild_keyword_index,
+    mark_store_replaced, HNSW_SETTINGS
+)
+
+# Where snapshots are kept, and how many of them
+snapshot_directory = os.getenv("VECTOR_SNAPSHOT_DIR", "quants/vector_snapshots")
+SNAPSHOT_KEEP = int(os.getenv("VECTOR_SNAPSHOT_KEEP", "4"))
+
+# Lock taken by everything that writes to the store in bulk, so a snapshot never sees half a write
+lock_path = vector_store_directory.rstrip("/") + ".lock"
+
+# HNSW parameters by the names used on the command line, mapped to Chroma's configuration keys
+HNSW_PARAMETERS = {"space": "space", "M": "max_neighbors", "construction_ef": "ef_construction", "search_ef": "ef_search"}
+
+# Only these can change on an existing index; the others need a rebuild
+MUTABLE_HNSW = ("ef_search",)
+
+SQLITE_NAME = "chroma.sqlite3"
+
+# Function to hold the store lock for a block of code
+@contextmanager
+def store_lock():
+    """
+    Exclusive lock on the vector store shared between processes, held by snapshots, restores,
+    rebuilds and pipeline ingestion. Readers do not take it.
+    """
+    os.makedirs(os.path.dirname(lock_path) or ".", exist_ok=True)
+    with open(lock_path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+# Function to add up the size of a directory
+def directory_bytes(path):
+    """
+    :param path: The directory.
+    :return: Total size in bytes of the files below it.
+    """
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path) for name in names
+    )
+
+# Function to get the HNSW settings of a collection
+def hnsw_settings(collection):
+    """
+    :param collection: A Chroma collection.
+    :return: Dictionary of space, max_neighbors, ef_construction and ef_search.
+    """
+    hnsw = (collection.configuration or {}).get("hnsw") or {}
+    return {key: hnsw.get(key) for key in HNSW_PARAMETERS.values()}
+
+# Function to copy a collection into a new one with other HNSW settings and swap it in
+def rebuild_collection(name, hnsw=None, page_size=1000):
+    """
+    Builds a fresh index from the stored embeddings, so nothing is embedded again. This is
+    how space, M and construction_ef change, and it compacts an index that has been through
+    large deletes. The copy is swapped in by renames, the old collection is only dropped once
+    the new one has its name, and the SQLite file is vacuumed afterwards to give the freed
+    space back. Other processes using the store open the new collection on their next use.
+    :param name: Name of the collection.
+    :param hnsw: HNSW settings to change, by Chroma key (optional; the current ones are kept).
+    :param page_size: Number of records copied per call.
+    :return: Dictionary with the number of records, the new settings and the seconds taken.
+    """
+    started = time.perf_counter()
+    with store_lock():
+        client = get_client()
+        embedding_function = get_embedding_function()
+        source = client.get_collection(name, embedding_function=embedding_function)
+        settings = {**hnsw_settings(source), **(hnsw or {})}
+
+        temporary = f"{name}-rebuild"
+        if temporary in [collection.name for collection in client.list_collections()]:
+            client.delete_collection(temporary)  # Left over from a rebuild that did not finish
+        target = client.create_collection(
+            temporary,
+            configuration={"hnsw": settings},
+            metadata=source.metadata,
+            embedding_function=embedding_function
+        )
+        copied = 0
+        for page in iter_collection(source, include=["documents", "metadatas", "embeddings"], page_size=page_size):
+            target.add(ids=page["ids"], documents=page["documents"], metadatas=page["metadatas"], embeddings=page["embeddings"])
+            copied += len(page["ids"])
+        if target.count() != source.count():
+            client.delete_collection(temporary)
+            raise RuntimeError(f"Rebuild of {name} copied {target.count()} of {source.count()} records")
+
+        # A crash between the two renames is undone the next time the store is opened
+        source.modify(name=f"{name}-old")
+        target.modify(name=name)
+        client.delete_collection(f"{name}-old")
+        vacuum()
+        reset_store()
+        mark_store_replaced()
+    seconds = time.perf_counter() - started
+    logger.info(f"Rebuilt {name}: {copied} records in {seconds:.1f}s with {settings}")
+    return {"records": copied, "hnsw": settings, "seconds": seconds}
+
+# Function to change the HNSW settings of a collection
+def tune_collection(name, **hnsw):
+    """
+    search_ef is changed in place; any other change rebuilds the collection.
+    :param name: Name of the collection.
+    :param hnsw: New settings, by Chroma key: space, max_neighbors, ef_construction, ef_search.
+    :return: The collection's settings after the change.
+    """
+    client = get_client()
+    collection = client.get_collection(name, embedding_function=get_embedding_function())
+    current = hnsw_settings(collection)
+    changes = {key: value for key, value in hnsw.items() if value is not None and current.get(key) != value}
+    if not changes:
+        return current
+    if all(key in MUTABLE_HNSW for key in changes):
+        collection.modify(configuration={"hnsw": changes})
+        reset_store()
+        mark_store_replaced()
+        logger.info(f"Changed {name} in place: {changes}")
+        return {**current, **changes}
+    return rebuild_collection(name, changes)["hnsw"]
+
+# Function to give the space freed by deletes back to the file system
+def vacuum():
+    with sqlite3.connect(os.path.join(vector_store_directory, SQLITE_NAME)) as db:
+        db.execute("VACUUM")
+
+# Function to take a point-in-time copy of the store
+def take_snapshot(label=None):
+    """
+    Copies the store under the store lock. The HNSW segments are copied first and the SQLite
+    file last, with SQLite's backup API, so the copy is consistent even if Chroma holds the
+    file open; Chroma replays anything the segments are missing from the SQLite log. The copy is
+    built in a temporary directory and renamed into place, so a snapshot is complete or absent.
+    :param label: Short label added to the snapshot name (optional).
+    :return: Path of the snapshot.
+    """
+    name = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ") + (f"-{label}" if label else "")
+    if os.path.exists(os.path.join(snapshot_directory, name)):
+        name = f"{name}-{time.monotonic_ns()}"
+    path = os.path.join(snapshot_directory, name)
+    temporary = os.path.join(snapshot_directory, f".tmp-{name}")
+    os.makedirs(snapshot_directory, exist_ok=True)
+    started = time.perf_counter()
+    with store_lock():
+        try:
+            shutil.copytree(vector_store_directory, temporary, ignore=shutil.ignore_patterns(f"{SQLITE_NAME}*"))
+            with sqlite3.connect(os.path.join(vector_store_directory, SQLITE_NAME)) as source, \
+                    sqlite3.connect(os.path.join(temporary, SQLITE_NAME)) as copy:
+                source.backup(copy)
+            source.close()
+            copy.close()
+            manifest = {
+                "name": name,
+                "created": datetime.now(timezone.utc).isoformat(),
+                "collections": collection_counts(os.path.join(temporary, SQLITE_NAME)),
+                "bytes": directory_bytes(temporary),
+            }
+            with open(os.path.join(temporary, "manifest.json"), "w", encoding="utf-8") as f:
+                json.dump(manifest, f, indent=2)
+            os.rename(temporary, path)
+        except BaseException:
+            shutil.rmtree(temporary, ignore_errors=True)
+            raise
+    logger.info(f"Snapshot {name} taken in {time.perf_counter() - started:.1f}s ({manifest['bytes'] // 1024} KiB)")
+    prune_snapshots()
+    return path
+
+# Function to count the records of every collection in a Chroma SQLite file without opening Chroma
+def collection_counts(sqlite_path):
+    """
+    :param sqlite_path: Path of chroma.sqlite3.
+    :return: Dictionary of collection names to record counts.
+    """
+    with sqlite3.connect(f"file:{sqlite_path}?mode=ro", uri=True) as db:
+        rows = db.execute(
+            """
+            SELECT collections.name, COUNT(embeddings.id)
+            FROM collections
+            JOIN segments ON segments.collection = collections.id AND segments.scope = 'METADATA'
+            LEFT JOIN embeddings ON embeddings.segment_id = segments.id
+            GROUP BY collections.name
+            """
+        ).fetchall()
+    db.close()
+    return dict(rows)
+
+# Function to list the snapshots, newest first
+def list_snapshots():
+    """
+    :return: List of snapshot manifests.
+    """
+    if not os.path.isdir(snapshot_directory):
+        return []
+    snapshots = []
+    for name in sorted(os.listdir(snapshot_directory), reverse=True):
+        if name.startswith("."):
+            continue  # A snapshot still being taken
+        try:
+            with open(os.path.join(snapshot_directory, name, "manifest.json"), "r", encoding="utf-8") as f:
+                snapshots.append(json.load(f))
+        except (FileNotFoundError, NotADirectoryError, json.JSONDecodeError):
+            continue
+    return snapshots
+
+# Function to remove all but the newest snapshots
+def prune_snapshots(keep=SNAPSHOT_KEEP):
+    """
+    :param keep: Number of snapshots to keep.
+    :return: Names of the snapshots removed.
+    """
+    removed = [snapshot["name"] for snapshot in list_snapshots()[keep:]]
+    for name in removed:
+        shutil.rmtree(os.path.join(snapshot_directory, name))
+    return removed
+
+# Function to put a snapshot back in place of the store
+def restore_snapshot(name):
+    """
+    Copies the snapshot next to the store, then swaps the two directories with renames, so
+    the store is never half restored. The replaced store is kept as <store>.previous until
+    the next restore, and the keyword index is rebuilt from the restored chunks. Other
+    processes using the store, such as gunicorn workers, open the restored one on their next use.
+    :param name: Name of the snapshot.
+    :return: Path of the replaced store.
+    """
+    source = os.path.join(snapshot_directory, name)
+    if not os.path.exists(os.path.join(source, "manifest.json")):
+        raise FileNotFoundError(f"No snapshot named {name}")
+    store = vector_store_directory.rstrip("/")
+    incoming = f"{store}.restoring"
+    previous = f"{store}.previous"
+    started = time.perf_counter()
+    with store_lock():
+        shutil.rmtree(incoming, ignore_errors=True)
+        shutil.copytree(source, incoming, ignore=shutil.ignore_patterns("manifest.json"))
+        reset_store()
+        shutil.rmtree(previous, ignore_errors=True)
+        if os.path.exists(store):
+            os.rename(store, previous)
+        os.rename(incoming, store)
+        mark_store_replaced()
+    rebuild_keyword_index()
+    logger.info(f"Restored snapshot {name} in {time.perf_counter() - started:.1f}s; the replaced store is in {previous}")
+    return previous
+
+# Function to report the size and memory footprint of each index
+def index_report():
+    """
+    The memory estimate for each HNSW index is what hnswlib allocates: each vector in float32,
+    plus 2 * M level-0 links and the upper layers, which add about 1 / ln(M) of that again.
+    :return: Dictionary with the store size on disk, each collection and the snapshots.
+    """
+    client = get_client()
+    sqlite_path = os.path.join(vector_store_directory, SQLITE_NAME)
+    with sqlite3.connect(f"file:{sqlite_path}?mode=ro", uri=True) as db:
+        segments = dict(db.execute(
+            "SELECT collections.name, segments.id FROM segments JOIN collections ON segments.collection = collections.id "
+            "WHERE segments.scope = 'VECTOR'"
+        ).fetchall())
+    db.close()
+
+    collections = {}
+    for collection in client.list_collections():
+        settings = hnsw_settings(collection)
+        count = collection.count()
+        sample = collection.get(limit=1, include=["embeddings"])["embeddings"] if count else []
+        dimension = len(sample[0]) if len(sample) else 0
+        neighbors = settings.get("max_neighbors") or 16
+        per_vector = dimension * 4 + 2 * neighbors * 4 + 8
+        segment_path = os.path.join(vector_store_directory, segments.get(collection.name, ""))
+        collections[collection.name] = {
+            "records": count,
+            "dimension": dimension,
+            "hnsw": settings,
+            "index_bytes": directory_bytes(segment_path) if segments.get(collection.name) else 0,
+            "estimated_memory_bytes": int(count * per_vector * (1 + 1 / max(1.0, math.log(neighbors)))),
+        }
+    return {
+        "store_bytes": directory_bytes(vector_store_directory),
+        "sqlite_bytes": os.path.getsize(sqlite_path),
+        "process_max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "collections": collections,
+        "snapshots": [{"name": snapshot["name"], "bytes": snapshot["bytes"]} for snapshot in list_snapshots()],
+    }
+
+# Function to parse the command line
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Tune, rebuild, snapshot and restore the vector store")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("report", help="Index sizes and estimated memory")
+
+    tune = commands.add_parser("tune", help="Change HNSW settings; anything but --search-ef rebuilds the index")
+    tune.add_argument("collection", choices=sorted(HNSW_SETTINGS))
+    tune.add_argument("--space", choices=("l2", "cosine", "ip"))
+    tune.add_argument("--M", type=int, dest="M")
+    tune.add_argument("--construction-ef", type=int, dest="construction_ef")
+    tune.add_argument("--search-ef", type=int, dest="search_ef")
+
+    rebuild = commands.add_parser("rebuild", help="Rebuild and compact an index with its current settings")
+    rebuild.add_argument("collection", choices=sorted(HNSW_SETTINGS))
+
+    snapshot = commands.add_parser("snapshot", help="Take a point-in-time copy of the store")
+    snapshot.add_argument("--label")
+
+    commands.add_parser("snapshots", help="List the snapshots, newest first")
+
+    restore = commands.add_parser("restore", help="Replace the store with a snapshot")
+    restore.add_argument("name")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.command == "report":
+        print(json.dumps(index_report(), indent=2))
+    elif args.command == "tune":
+        settings = {HNSW_PARAMETERS[key]: getattr(args, key) for key in HNSW_PARAMETERS}
+        print(json.dumps(tune_collection(args.collection, **settings), indent=2))
+    elif args.command == "rebuild":
+        print(json.dumps(rebuild_collection(args.collection), indent=2))
+    elif args.command == "snapshot":
+        print(take_snapshot(args.label))
+    elif args.command == "snapshots":
+        for snapshot in list_snapshots():
+            print(f"{snapshot['name']}  {snapshot['bytes'] // 1024} KiB  {snapshot['collections']}")
+    elif args.command == "restore":
+        restore_snapshot(args.name)
@@ -0,0 +1,9 @@
+import os
+import sys
+
+# Add the root directory to the Python path for module imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# And the tests directory, for the local fakes
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+# And the benchmarks directory, for the modules benchmarks.fakes imports
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
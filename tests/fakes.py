@@ -0,0 +1,54 @@
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Class serving bill XML locally, with the conditional requests parl.ca answers
+class BillServer:
+    """
+    A local server for BillFetcher. Each path serves the bytes set in documents, with an ETag
+    of their hash, and answers 304 when If-None-Match matches it. Every request is recorded as
+    (path, status), and status_override makes a path answer with a fixed status instead.
+    """
+    def __init__(self):
+        self.documents = {}
+        self.status_override = {}
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body=b"", headers=None):
+                server.requests.append((self.path, status))
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path in server.status_override:
+                    self._send(server.status_override[self.path])
+                    return
+                body = server.documents.get(self.path)
+                if body is None:
+                    self._send(404)
+                    return
+                etag = f'"{hashlib.sha1(body).hexdigest()}"'
+                if self.headers.get("If-None-Match") == etag:
+                    self._send(304, headers={"ETag": etag})
+                    return
+                self._send(200, body, {"Content-Type": "application/xml", "ETag": etag})
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
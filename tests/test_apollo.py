@@ -0,0 +1,130 @@
+# tests/test_apollo.py
+import json
+import functools
+
+import openai
+import pytest
+
+from quants import apollo
+from quants.analysis_cache import AnalysisCache
+from quants.analysis_store import AnalysisStore, normalize_result
+from benchmarks.fakes import StubAssistant
+
+ASSISTANT = "asst_test"
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = AnalysisCache(str(tmp_path / "cache.sqlite3"))
+    yield cache
+    cache.close()
+
+def reply(text):
+    return [{"type": "text", "text": {"value": text, "annotations": []}}]
+
+def test_bad_replies_are_not_cached_and_are_retried_on_resume(cache, tmp_path, monkeypatch):
+    chunks = ["Section one.", "Section two."]
+    keys = [AnalysisCache.make_key(chunk, ASSISTANT, apollo.PROMPT_TEMPLATE) for chunk in chunks]
+    replies = {"Section one.": reply('{"summary": "one"}'), "Section two.": reply("not json")}
+    sent = []
+    monkeypatch.setattr(apollo, "analyze_chunk_in_thread", lambda chunk, assistant_id: sent.append(chunk) or replies[chunk])
+
+    store = AnalysisStore(str(tmp_path / "C-70_E_analysis.jsonl"))
+    on_result = lambda i, result: store.append(i + 1, keys[i], result)
+    apollo.analyze_chunks_concurrently(chunks, cache=cache, assistant_id=ASSISTANT, on_result=on_result)
+    assert sent == chunks
+    assert cache.stats()["entries"] == 1
+    assert [store.completed(n, key) for n, key in ((1, keys[0]), (2, keys[1]))] == [True, False]
+    store.close()
+
+    # A bad reply cached by an older version is a miss, and is evicted
+    cache.put(keys[1], reply("still not json"))
+    replies["Section two."] = reply('{"summary": "two"}')
+    sent.clear()
+    store = AnalysisStore(str(tmp_path / "C-70_E_analysis.jsonl"))
+    todo = [i for i in range(len(chunks)) if not store.completed(i + 1, keys[i])]
+    assert todo == [1]
+    apollo.analyze_chunks_concurrently(
+        [chunks[i] for i in todo], cache=cache, assistant_id=ASSISTANT,
+        on_result=lambda j, result: store.append(todo[j] + 1, keys[todo[j]], result)
+    )
+    assert sent == ["Section two."]
+    assert store.compact(keys) == {"analyses": 2, "errors": 0, "missing": 0}
+    store.close()
+
+    records = [json.loads(line) for line in open(tmp_path / "C-70_E_analysis.jsonl", encoding="utf-8")]
+    assert [record["analysis"] for record in records] == [{"summary": "one"}, {"summary": "two"}]
+    assert cache.get(keys[1]) == reply('{"summary": "two"}')
+
+@pytest.fixture
+def stub(monkeypatch):
+    stubs = []
+    def start(**options):
+        stub = StubAssistant(**options)
+        monkeypatch.setattr(openai, "base_url", stub.base_url)
+        monkeypatch.setattr(openai, "api_key", "sk-test")
+        stubs.append(stub)
+        return stub
+    yield start
+    for stub in stubs:
+        stub.close()
+
+def chunk_of(prompt):
+    return prompt.rsplit("\n", 1)[-1]
+
+def echo(prompt):
+    return json.dumps({"chunk": chunk_of(prompt)})
+
+def test_results_keep_chunk_order_when_runs_finish_out_of_order(stub):
+    chunks = [f"Section {n}." for n in range(1, 7)]
+    # Earlier chunks take longer, so the runs finish in reverse order
+    stub(reply_for=echo, run_seconds=lambda prompt: 0.05 * (7 - int(chunk_of(prompt).split()[1].rstrip("."))))
+    finished = []
+    results = apollo.analyze_chunks_concurrently(
+        chunks, max_workers=len(chunks), assistant_id=ASSISTANT, on_result=lambda i, result: finished.append(i)
+    )
+    assert [normalize_result(result) for result in results] == [{"analysis": {"chunk": chunk}} for chunk in chunks]
+    assert sorted(finished) == list(range(len(chunks)))
+    assert finished != sorted(finished)
+
+def test_rate_limited_run_waits_for_retry_after(stub):
+    server = stub(reply_for=echo, rate_limited=1, retry_after="0.3")
+    result = apollo.analyze_chunk_in_thread("Section 1.", assistant_id=ASSISTANT)
+    assert normalize_result(result) == {"analysis": {"chunk": "Section 1."}}
+    runs = [request for request in server.requests if request[1].endswith("/threads/runs")]
+    assert [status for _, _, status, _ in runs] == [429, 200]
+    # Without the header the first backoff would be at least a second
+    assert 0.3 <= runs[1][3] - runs[0][3] < 1.0
+
+class Stopped(Exception):
+    pass
+
+def test_batch_is_resumed_and_results_are_stored_by_chunk(stub, cache, tmp_path, monkeypatch):
+    server = stub(reply_for=echo)
+    chunks = ["Section 1.", "Section 2.", "Section 3."]
+    numbers = [1, 2, 3]
+    keys = [AnalysisCache.make_key(chunk, ASSISTANT, apollo.PROMPT_TEMPLATE) for chunk in chunks]
+    store = AnalysisStore(str(tmp_path / "C-70_E_analysis.jsonl"))
+    wait = apollo.wait_for_batch
+
+    # The first run stops while waiting on the job it submitted
+    def stop(batch_id):
+        raise Stopped(batch_id)
+    monkeypatch.setattr(apollo, "wait_for_batch", stop)
+    with pytest.raises(Stopped) as stopped:
+        apollo.analyze_chunks_in_batch(chunks, numbers, keys, store, cache=cache, assistant_id=ASSISTANT)
+    job = json.load(open(tmp_path / "C-70_E_analysis.batch.json", encoding="utf-8"))
+    assert job["batch_id"] == str(stopped.value)
+
+    # The next run waits on the same job instead of submitting another
+    monkeypatch.setattr(apollo, "wait_for_batch", functools.partial(wait, poll_min=0))
+    apollo.analyze_chunks_in_batch(chunks, numbers, keys, store, cache=cache, assistant_id=ASSISTANT)
+    posts = [path for method, path, _, _ in server.requests if method == "POST"]
+    assert sum(path.endswith("/batches") for path in posts) == 1
+    assert sum(path.endswith("/files") for path in posts) == 1
+    assert not (tmp_path / "C-70_E_analysis.batch.json").exists()
+
+    assert [store.completed(number, key) for number, key in zip(numbers, keys)] == [True, True, True]
+    store.close()
+    records = {record["chunk"]: record for record in map(json.loads, open(tmp_path / "C-70_E_analysis.jsonl", encoding="utf-8"))}
+    assert {number: record["analysis"] for number, record in records.items()} == {n: {"chunk": c} for n, c in zip(numbers, chunks)}
+    assert cache.stats()["entries"] == 3
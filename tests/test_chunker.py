@@ -0,0 +1,63 @@
+# tests/test_chunker.py
+import random
+
+import pytest
+
+from extractors.chunker import pack_sections, estimate_tokens
+
+WORDS = "the minister may by order designate any foreign principal agent registry person entity".split()
+
+def sections(count=120, seed=70):
+    rng = random.Random(seed)
+    return [
+        {
+            "label": str(n), "part": f"PART {n // 40 + 1}", "division": f"Division {n // 20 + 1}",
+            "heading": f"Heading {n // 5 + 1}", "marginal_note": f"Note {n}",
+            "text": " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 500))) + ".",
+        }
+        for n in range(count)
+    ]
+
+@pytest.mark.parametrize("max_tokens, overlap_tokens", [(300, 0), (300, 50), (1500, 100), (100, 20)])
+def test_chunks_stay_within_the_token_budget(max_tokens, overlap_tokens):
+    chunks, metadatas = pack_sections(sections(), max_tokens=max_tokens, overlap_tokens=overlap_tokens)
+    assert len(chunks) == len(metadatas) > 1
+    assert max(estimate_tokens(chunk) for chunk in chunks) <= max_tokens
+
+def test_sections_are_kept_whole_and_in_order():
+    source = [section for section in sections() if estimate_tokens(section["text"]) < 250]
+    chunks, metadatas = pack_sections(source, max_tokens=300)
+    labels = [label for metadata in metadatas for label in metadata["sections"].split(", ")]
+    assert labels == [section["label"] for section in source]
+    by_label = {section["label"]: section for section in source}
+    for chunk, metadata in zip(chunks, metadatas):
+        assert chunk.startswith(metadata["heading"] + "\n")
+        assert all(by_label[label]["text"] in chunk for label in metadata["sections"].split(", "))
+
+def test_chunks_do_not_span_parts_or_divisions():
+    source = sections()
+    _, metadatas = pack_sections(source, max_tokens=1500)
+    by_label = {section["label"]: section for section in source}
+    for metadata in metadatas:
+        contexts = {(by_label[label]["part"], by_label[label]["division"]) for label in metadata["sections"].split(", ")}
+        assert contexts == {(metadata["part"], metadata["division"])}
+
+def test_oversized_sections_are_split_at_sentences():
+    text = " ".join(f"Sentence {n} says the minister may designate an entity." for n in range(200))
+    section = {"label": "83.01", "part": "PART 1", "division": "", "heading": "Designation", "text": text}
+    chunks, metadatas = pack_sections([section], max_tokens=200)
+    assert len(chunks) > 1
+    assert all(estimate_tokens(chunk) <= 200 for chunk in chunks)
+    assert all(chunk.endswith("entity.") for chunk in chunks)
+    assert {metadata["sections"] for metadata in metadatas} == {"83.01"}
+    assert " ".join(chunk.split("\n", 1)[1] for chunk in chunks) == text
+
+def test_overlap_repeats_the_end_of_the_previous_chunk():
+    source = sections()
+    chunks, metadatas = pack_sections(source, max_tokens=300, overlap_tokens=40)
+    assert chunks[0].startswith(metadatas[0]["heading"] + "\n")
+    for previous, chunk, metadata in zip(chunks, chunks[1:], metadatas[1:]):
+        # The overlap may span sections, so it is found by the heading line that follows it
+        overlap = chunk[:chunk.index("\n" + metadata["heading"] + "\n")]
+        assert 0 < len(overlap) <= 40 * 4
+        assert previous.endswith(overlap)
@@ -0,0 +1,59 @@
+# tests/test_fetcher.py
+import os
+
+import pytest
+import requests
+
+from extractors import xml2text
+from extractors.fetcher import BillFetcher
+from fakes import BillServer
+
+BILL = b"<Bill><Section><Label>1</Label><Text>First version.</Text></Section></Bill>"
+AMENDED = b"<Bill><Section><Label>1</Label><Text>Amended version.</Text></Section></Bill>"
+
+@pytest.fixture
+def server():
+    server = BillServer()
+    yield server
+    server.close()
+
+@pytest.fixture
+def fetcher(tmp_path):
+    fetcher = BillFetcher(cache_dir=str(tmp_path / "raw_cache"))
+    yield fetcher
+    fetcher.close()
+
+def test_unchanged_bill_is_not_downloaded_or_parsed_again(server, fetcher, tmp_path, monkeypatch):
+    server.documents["/C-70.xml"] = BILL
+    url = f"{server.base_url}/C-70.xml"
+    output = str(tmp_path / "C-70.txt")
+    parses = []
+    stream = xml2text.stream_xml_to_text
+    monkeypatch.setattr(xml2text, "stream_xml_to_text", lambda source, out: parses.append(source) or stream(source, out))
+
+    assert xml2text.xml_to_text(url, output, fetcher) is True
+    assert open(output, encoding="utf-8").read() == "1 First version.\n"
+
+    assert xml2text.xml_to_text(url, output, fetcher) is False
+    assert server.requests == [("/C-70.xml", 200), ("/C-70.xml", 304)]
+    assert len(parses) == 1
+
+    server.documents["/C-70.xml"] = AMENDED
+    fetched = fetcher.fetch(url)
+    assert (fetched["status"], fetched["changed"]) == (200, True)
+    assert xml2text.convert_fetched(fetched, output) is True
+    assert open(output, encoding="utf-8").read() == "1 Amended version.\n"
+    assert len(parses) == 2
+
+def test_not_modified_without_a_cached_copy_is_an_error(server, fetcher):
+    server.status_override["/C-70.xml"] = 304
+    with pytest.raises(requests.HTTPError):
+        fetcher.fetch(f"{server.base_url}/C-70.xml")
+    assert fetcher.cached(f"{server.base_url}/C-70.xml") is None
+    assert not os.path.exists(fetcher.cache_dir) or not any(
+        name.endswith(".xml") for _, _, names in os.walk(fetcher.cache_dir) for name in names
+    )
+
+def test_server_errors_are_raised(server, fetcher):
+    with pytest.raises(requests.HTTPError):
+        fetcher.fetch(f"{server.base_url}/missing.xml")
@@ -0,0 +1,122 @@
+# tests/test_search.py
+import pytest
+
+from quants import search
+from quants.keyword_index import KeywordIndex, match_expression, highlight, is_exact_query
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    index = KeywordIndex(str(tmp_path / "keyword_index.sqlite3"))
+    monkeypatch.setattr(search, "get_index", lambda: index)
+    yield index
+    index.close()
+
+def ids(results):
+    return [result["id"] for result in results]
+
+def test_index_follows_adds_updates_and_deletes(index):
+    index.upsert(
+        ["C-70_E#a", "C-70_E#b"],
+        ["A foreign agent must register.", "The registry is public."],
+        [{"doc_id": "C-70_E", "heading": "Registration"}, {"doc_id": "C-70_E", "heading": "Registry"}]
+    )
+    assert index.count() == 2
+    assert ids(index.search("register")[1]) == ["C-70_E#a"]
+    # Porter stemming matches "registries" with "registry"
+    assert ids(index.search("registries")[1]) == ["C-70_E#b"]
+
+    index.upsert(["C-70_E#a"], ["A foreign principal must report."], [{"doc_id": "C-70_E", "heading": "Reporting"}])
+    assert index.count() == 2
+    assert index.search("register") == (0, [])
+    assert ids(index.search("report")[1]) == ["C-70_E#a"]
+
+    index.update_metadata(["C-70_E#b"], [{"doc_id": "C-71_E", "heading": "Public registry"}])
+    assert ids(index.search("public", doc_id="C-70_E")[1]) == []
+    total, results = index.search("public", doc_id="C-71_E")
+    assert (total, results[0]["heading"]) == (1, "Public registry")
+
+    index.delete(["C-70_E#a"])
+    assert index.count() == 1
+    assert index.search("foreign") == (0, [])
+
+@pytest.mark.parametrize("query, expression", [
+    ("foreign agent", '"foreign" "agent"'),
+    ("section 83.01 of C-70", '"section" "83.01" "of" "C-70"'),
+    ('"foreign agent" registry', '"foreign agent" "registry"'),
+    ("agent OR NEAR(registry) *", '"agent" "OR" "NEAR(registry)"'),
+    ('say"hi', '"say""hi"'),
+    ("", None),
+    ("  -- * ()", None),
+])
+def test_match_expression_quotes_every_term(query, expression):
+    assert match_expression(query) == expression
+
+def test_operators_in_queries_are_searched_literally(index):
+    index.upsert(["C-70_E#a"], ["Section 83.01 of the Criminal Code, as amended by C-70."], [{"doc_id": "C-70_E"}])
+    assert index.search("83.01")[0] == 1
+    assert index.search("C-70 AND")[0] == 0
+    assert index.search('"Criminal Code" NOT')[0] == 0
+    assert index.search('"Criminal Code"')[0] == 1
+
+def test_snippets_are_escaped_with_matches_marked(index):
+    index.upsert(["C-70_E#a"], ['Rules & <script>alert("registry")</script> for the registry.'], [{"doc_id": "C-70_E"}])
+    snippet = index.search("registry")[1][0]["snippet"]
+    assert "<script>" not in snippet
+    assert "&lt;script&gt;" in snippet and "&amp;" in snippet
+    assert snippet.count("<mark>registry</mark>") == 2
+
+    marked = highlight('Rules & <b>bold</b> for the registry.', "registry")
+    assert marked == "Rules &amp; &lt;b&gt;bold&lt;/b&gt; for the <mark>registry</mark>."
+
+def vector_hits(*ids):
+    return {
+        "ids": list(ids),
+        "documents": [f"Text of {id_}." for id_ in ids],
+        "metadatas": [{"doc_id": "C-70_E", "heading": None} for _ in ids],
+        "distances": [0.1 * rank for rank in range(1, len(ids) + 1)],
+    }
+
+def test_hybrid_search_fuses_ranks(index, monkeypatch):
+    index.upsert(
+        ["C-70_E#a", "C-70_E#b", "C-70_E#c"],
+        ["agent agent agent registry", "agent registry", "registry"],
+        [{"doc_id": "C-70_E"}] * 3
+    )
+    monkeypatch.setattr(search, "vector_search", lambda query, n_results, where: vector_hits("C-70_E#b", "C-70_E#d"))
+
+    response = search.search_chunks("agent registry", mode="hybrid")
+    results = {result["id"]: result for result in response["results"]}
+    assert (response["mode"], response["degraded"], response["total"]) == ("hybrid", False, 3)
+    # Found by both sides, b outranks a although BM25 puts a first
+    assert ids(response["results"]) == ["C-70_E#b", "C-70_E#a", "C-70_E#d"]
+    assert results["C-70_E#b"]["score"] == pytest.approx(1 / (search.RRF_K + 2) + 1 / (search.RRF_K + 1))
+    assert (results["C-70_E#b"]["keyword_rank"], results["C-70_E#b"]["vector_rank"]) == (2, 1)
+    assert results["C-70_E#a"]["score"] == pytest.approx(1 / (search.RRF_K + 1))
+    assert results["C-70_E#d"]["score"] == pytest.approx(1 / (search.RRF_K + 2))
+    assert results["C-70_E#d"]["distance"] == pytest.approx(0.2)
+
+    second = search.search_chunks("agent registry", mode="hybrid", page=2, per_page=2)
+    assert (ids(second["results"]), second["has_more"]) == (["C-70_E#d"], False)
+
+def test_hybrid_search_degrades_to_keywords(index, monkeypatch):
+    index.upsert(["C-70_E#a"], ["agent registry"], [{"doc_id": "C-70_E"}])
+    def unreachable(query, n_results, where):
+        raise ConnectionError("OpenAI is unreachable")
+    monkeypatch.setattr(search, "vector_search", unreachable)
+
+    response = search.search_chunks("agent", mode="hybrid")
+    assert (response["degraded"], ids(response["results"])) == (True, ["C-70_E#a"])
+    with pytest.raises(ConnectionError):
+        search.search_chunks("agent", mode="vector")
+
+def test_quoted_queries_are_not_embedded(index, monkeypatch):
+    index.upsert(["C-70_E#a"], ["Section 83.01 is amended."], [{"doc_id": "C-70_E"}])
+    embedded = []
+    monkeypatch.setattr(search, "vector_search", lambda query, n_results, where: embedded.append(query) or vector_hits())
+
+    assert is_exact_query('"83.01"') and is_exact_query('"83.01" "amended"')
+    assert not is_exact_query('"83.01" amended') and not is_exact_query("")
+    response = search.search_chunks('"83.01"', mode="hybrid")
+    assert (response["mode"], ids(response["results"]), embedded) == ("keyword", ["C-70_E#a"], [])
+    search.search_chunks('"83.01" amended', mode="hybrid")
+    assert embedded == ['"83.01" amended']
@@ -0,0 +1,100 @@
+# tests/test_tsionhehkwen.py
+import random
+
+import chromadb
+import pytest
+
+from quants.tsionhehkwen import sync_document_chunks, split_into_chunks, get_document_chunks
+from benchmarks.fakes import HashEmbeddingFunction
+
+WORDS = "the minister may by order designate any foreign principal agent registry person entity".split()
+
+class CountingEmbeddingFunction(HashEmbeddingFunction):
+    def __init__(self):
+        super().__init__(dimension=16)
+        self.embedded = []
+
+    def __call__(self, input):
+        self.embedded.extend(input)
+        return super().__call__(input)
+
+@pytest.fixture
+def embedding_function():
+    return CountingEmbeddingFunction()
+
+@pytest.fixture
+def collection(tmp_path, embedding_function):
+    client = chromadb.PersistentClient(path=str(tmp_path / "vector_store"))
+    return client.create_collection("Bills", embedding_function=embedding_function)
+
+def document(lines=400, seed=70):
+    rng = random.Random(seed)
+    return "".join(" ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 30))) + ".\n" for _ in range(lines))
+
+def positions(collection, doc_id):
+    stored = collection.get(where={"doc_id": doc_id}, include=["metadatas"])
+    return {id_: metadata["position"] for id_, metadata in zip(stored["ids"], stored["metadatas"])}
+
+def test_unchanged_resync_does_nothing(collection, embedding_function):
+    chunks = [f"Section {n}. " + " ".join(WORDS[:n + 1]) for n in range(6)]
+    assert sync_document_chunks("C-70_E", chunks, target_collection=collection) == \
+        {"added": 6, "moved": 0, "removed": 0, "unchanged": 0}
+    embedding_function.embedded.clear()
+
+    assert sync_document_chunks("C-70_E", chunks, target_collection=collection) == \
+        {"added": 0, "moved": 0, "removed": 0, "unchanged": 6}
+    assert embedding_function.embedded == []
+    assert get_document_chunks("C-70_E", target_collection=collection)["documents"] == chunks
+
+def test_editing_one_chunk_replaces_only_that_chunk(collection, embedding_function):
+    chunks = [f"Section {n}." for n in range(6)]
+    sync_document_chunks("C-70_E", chunks, target_collection=collection)
+    before = set(positions(collection, "C-70_E"))
+    embedding_function.embedded.clear()
+
+    chunks[3] = "Section 3, as amended."
+    assert sync_document_chunks("C-70_E", chunks, target_collection=collection) == \
+        {"added": 1, "moved": 0, "removed": 1, "unchanged": 5}
+    assert embedding_function.embedded == ["Section 3, as amended."]
+    after = set(positions(collection, "C-70_E"))
+    assert len(after - before) == 1 and len(before - after) == 1
+    assert get_document_chunks("C-70_E", target_collection=collection)["documents"] == chunks
+
+def test_reordering_chunks_only_updates_positions(collection, embedding_function):
+    chunks = [f"Section {n}." for n in range(6)]
+    sync_document_chunks("C-70_E", chunks, target_collection=collection)
+    embedding_function.embedded.clear()
+
+    chunks[1], chunks[4] = chunks[4], chunks[1]
+    assert sync_document_chunks("C-70_E", chunks, target_collection=collection) == \
+        {"added": 0, "moved": 2, "removed": 0, "unchanged": 4}
+    assert embedding_function.embedded == []
+    assert sorted(positions(collection, "C-70_E").values()) == list(range(6))
+    assert get_document_chunks("C-70_E", target_collection=collection)["documents"] == chunks
+
+def test_repeated_chunks_get_their_own_ids(collection):
+    chunks = ["Repealed.", "Section 1.", "Repealed."]
+    sync_document_chunks("C-70_E", chunks, target_collection=collection)
+    assert len(positions(collection, "C-70_E")) == 3
+    assert get_document_chunks("C-70_E", target_collection=collection)["documents"] == chunks
+
+def test_chunks_fit_the_size_and_cover_the_document():
+    text = document()
+    chunks = split_into_chunks(text, chunk_size=500)
+    assert "".join(chunks) == text
+    assert max(len(chunk) for chunk in chunks) <= 500
+    assert len(chunks) > 10
+
+    long_line = " ".join(["registry"] * 200) + "\n"
+    assert all(len(chunk) <= 500 for chunk in split_into_chunks(long_line, chunk_size=500))
+    assert "".join(split_into_chunks(long_line, chunk_size=500)) == long_line
+
+def test_an_edit_only_changes_the_chunks_around_it():
+    text = document()
+    lines = text.splitlines(keepends=True)
+    lines[200] = "The minister may, by order, designate a foreign principal.\n"
+    before = split_into_chunks(text, chunk_size=500)
+    after = split_into_chunks("".join(lines), chunk_size=500)
+    changed = set(after) - set(before)
+    assert 1 <= len(changed) <= 2
+    assert after[:3] == before[:3] and after[-3:] == before[-3:]
@@ -0,0 +1,34 @@
+# tests/test_xml2text.py
+from io import BytesIO, StringIO
+
+from extractors.xml2text import stream_xml_to_text, write_sections
+
+BILL = (
+    b'<Bill><Identification><LongTitle>An Act respecting elections</LongTitle></Identification>'
+    b'<Section><Label>1</Label><MarginalNote>Short title</MarginalNote>'
+    b'<Text>This Act may be cited as the <Emphasis>Test Act</Emphasis>.</Text></Section>'
+    b'<!-- between sections --><Section><Label>2</Label><Text>Second section.</Text></Section></Bill>'
+)
+
+# Function to convert XML bytes to text
+def to_text(xml):
+    output = StringIO()
+    stream_xml_to_text(BytesIO(xml), output)
+    return output.getvalue()
+
+def test_block_elements_start_new_lines():
+    assert to_text(BILL) == (
+        "An Act respecting elections\n"
+        "1\nShort title\nThis Act may be cited as the Test Act .\n"
+        "2 Second section.\n"
+    )
+
+def test_nodes_before_and_after_the_root():
+    # Top-level siblings of the root have no parent, so they cannot be deleted like nested ones
+    xml = (
+        b'<?xml version="1.0"?><?xml-stylesheet type="text/xsl" href="bill.xsl"?><!-- generated -->'
+        + BILL + b'<!-- trailer -->'
+    )
+    assert to_text(xml) == to_text(BILL)
+    sections = StringIO()
+    assert write_sections(BytesIO(xml), sections) == 3